@@ -1,14 +1,17 @@
 from pathlib import Path
-from typing import Optional, TypedDict
+from typing import NotRequired, Optional, TypedDict
 
-from agents import Agent, Runner, Tool, set_trace_processors
+from agents import Agent, RunConfig, Runner, Tool, set_trace_processors
 from perfparser import LineLoc
 
 from accelerant import tools
+from accelerant.history import DEFAULT_TOKEN_BUDGET, HistoryManager
 from accelerant.project import Project
 from accelerant.prompts import system_prompt, user_prompt
+from accelerant.replay import RecordingModelProvider, ReplayModelProvider
 from accelerant.tools import AgentContext
 from accelerant.trace import LoggingTracingProcessor
+from accelerant.verify import keep_improving_edits
 
 
 class AgentInput(TypedDict):
@@ -18,6 +21,18 @@ class AgentInput(TypedDict):
 
 class AgentConfig(TypedDict):
     model_id: str
+    # Save the model's responses to this file as the agent runs.
+    record_path: NotRequired[Path]
+    # Serve the model's responses from a recording instead of calling the model.
+    replay_path: NotRequired[Path]
+    # Append the timing and resource use of every span to this JSON-lines file.
+    trace_path: NotRequired[Path]
+    # Approximate cap on the tokens sent to the model per turn; older tool outputs
+    # are elided to stay under it.
+    context_token_budget: NotRequired[int]
+    # Time the edited program against the original before persisting the edits,
+    # and revert edits that don't help. On by default.
+    verify_edits: NotRequired[bool]
 
 
 class AgentResult(TypedDict):
@@ -30,18 +45,60 @@ def run_agent(
     ag_input: AgentInput,
     ag_config: AgentConfig,
 ) -> AgentResult:
-    set_trace_processors([LoggingTracingProcessor()])
+    ag_context = AgentContext(project=project)
+    set_trace_processors(
+        [LoggingTracingProcessor(ag_context.tool_cache, ag_config.get("trace_path"))]
+    )
+    if project.benches():
+        # Estimates of the original code, for the agent to compare its edits with.
+        project.run_benches()
+    try:
+        final_message = run_agent_session(ag_context, ag_input, ag_config)
+    finally:
+        project.stop_live_profiling()
+    # Long-running targets never finish a workload, so they can't be timed.
+    if (
+        ag_config.get("verify_edits", True)
+        and not project.long_running()
+        and project.fs_sandbox().modified_files()
+    ):
+        report = keep_improving_edits(project)
+        print(report.summary())
+        final_message += "\n\n" + report.summary()
+    project.fs_sandbox().persist_all()
+    return AgentResult(final_message=final_message)
+
 
+def run_agent_session(
+    ag_context: AgentContext,
+    ag_input: AgentInput,
+    ag_config: AgentConfig,
+) -> str:
+    """Run the agent to completion, leaving its edits unpersisted in the project's
+    sandbox, and return its final message."""
+    project = ag_context.project
     ag_tools: list[Tool] = [
         tools.edit_code,
+        tools.edit_code_batch,
         tools.check_codebase_for_errors,
         tools.run_perf_profiler,
+        tools.run_offcpu_profiler,
+        tools.get_top_allocating_lines,
+        tools.compare_workloads,
+        tools.get_profile_phases,
+        tools.get_thread_utilization,
         # tools.generate_flamegraph,
         tools.lookup_executable_symbol,
         tools.get_info,
         tools.get_references,
         tools.get_surrounding_code,
+        tools.get_annotated_hot_code,
+        tools.get_annotated_assembly,
     ]
+    if project.long_running():
+        ag_tools.append(tools.get_live_hotspots)
+    if project.benches():
+        ag_tools.append(tools.run_benchmarks)
 
     agent = Agent(
         name="Code Optimization Agent",
@@ -50,17 +107,33 @@ def run_agent(
         tools=ag_tools,
     )
 
-    ag_context = AgentContext(project=project)
     prompt = user_prompt(
         lang=project.lang(), hotspot_lines=ag_input["hotspot_lines"] or []
     )
+    history = HistoryManager(
+        ag_config.get("context_token_budget", DEFAULT_TOKEN_BUDGET)
+    )
+    run_config = RunConfig(call_model_input_filter=history)
+    if "replay_path" in ag_config:
+        run_config.model_provider = ReplayModelProvider(ag_config["replay_path"])
+    elif "record_path" in ag_config:
+        run_config.model_provider = RecordingModelProvider(ag_config["record_path"])
     result = Runner.run_sync(
         agent,
         prompt,
         context=ag_context,
         max_turns=100,
+        run_config=run_config,
     ).final_output
     assert result is not None
-    final_message = str(result)
-    project.fs_sandbox().persist_all()
-    return AgentResult(final_message=final_message)
+    print(
+        f"Final model input: ~{history.last_input_tokens} tokens,"
+        f" {history.last_compacted_outputs} tool outputs compacted"
+    )
+    if isinstance(run_config.model_provider, ReplayModelProvider):
+        diverged_calls = run_config.model_provider.model.diverged_calls
+        if diverged_calls > 0:
+            print(
+                f"warning: tool outputs differed from the recording before {diverged_calls} model calls"
+            )
+    return str(result)
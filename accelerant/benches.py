@@ -0,0 +1,126 @@
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import subprocess
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class BenchEstimate:
+    """Criterion's estimate of one benchmark's mean time per iteration."""
+
+    # Like `group/function/parameter`.
+    id: str
+    mean_ns: float
+    lower_ns: float
+    upper_ns: float
+
+    def noise(self) -> float:
+        """Half the width of the confidence interval, relative to the mean."""
+        if self.mean_ns <= 0:
+            return 0.0
+        return (self.upper_ns - self.lower_ns) / 2 / self.mean_ns
+
+
+def list_benches(root: Path, path_env_var: str) -> list[str]:
+    """Names of the bench targets of the project's packages, as `cargo bench --bench`
+    takes them."""
+    result = subprocess.run(
+        ["cargo", "metadata", "--no-deps", "--format-version", "1"],
+        check=True,
+        cwd=str(root),
+        env={"PATH": path_env_var},
+        capture_output=True,
+        text=True,
+    )
+    metadata = json.loads(result.stdout)
+    return sorted(
+        {
+            target["name"]
+            for package in metadata["packages"]
+            for target in package["targets"]
+            if "bench" in target["kind"]
+        }
+    )
+
+
+def build_bench(root: Path, bench: str, env: dict[str, str]) -> Path:
+    """Build a bench target without running it, and return its executable."""
+    result = subprocess.run(
+        [
+            "cargo",
+            "bench",
+            "--config",
+            "profile.bench.debug=true",
+            "--bench",
+            bench,
+            "--no-run",
+            "--message-format=json",
+        ],
+        check=True,
+        cwd=str(root),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    executable: Optional[str] = None
+    for line in result.stdout.splitlines():
+        message = json.loads(line)
+        if (
+            message.get("reason") == "compiler-artifact"
+            and message["target"]["name"] == bench
+            and "bench" in message["target"]["kind"]
+        ):
+            executable = message.get("executable") or executable
+    if executable is None:
+        raise RuntimeError(f"cargo built no executable for bench {bench}")
+    return Path(executable)
+
+
+def run_bench(
+    root: Path, bench: str, baseline: str, env: dict[str, str]
+) -> list[BenchEstimate]:
+    """Run a criterion bench target, saving its results as `baseline`, and return
+    the estimate of each benchmark in it."""
+    subprocess.run(
+        [
+            "cargo",
+            "bench",
+            "--config",
+            "profile.bench.debug=true",
+            "--bench",
+            bench,
+            "--",
+            "--save-baseline",
+            baseline,
+            "--noplot",
+        ],
+        check=True,
+        cwd=str(root),
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    return load_estimates(root / "target" / "criterion", baseline)
+
+
+def load_estimates(criterion_dir: Path, baseline: str) -> list[BenchEstimate]:
+    """Estimates saved under a baseline name in criterion's output directory."""
+    estimates = []
+    for path in sorted(criterion_dir.glob(f"**/{baseline}/estimates.json")):
+        with open(path, "r") as f:
+            mean = json.load(f)["mean"]
+        bench_id = path.parent.parent.relative_to(criterion_dir).as_posix()
+        benchmark_path = path.parent / "benchmark.json"
+        if benchmark_path.exists():
+            with open(benchmark_path, "r") as f:
+                bench_id = json.load(f).get("full_id", bench_id)
+        interval = mean["confidence_interval"]
+        estimates.append(
+            BenchEstimate(
+                bench_id,
+                mean["point_estimate"],
+                interval["lower_bound"],
+                interval["upper_bound"],
+            )
+        )
+    return estimates
@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+import ctypes.util
+from dataclasses import dataclass, field, fields, replace
+from pathlib import Path
+import re
+import subprocess
+import tomllib
+from typing import Any, Optional
+
+from accelerant.project import Project
+from accelerant.verify import MIN_SPEEDUP
+
+# Values tried for each setting, besides the project's current one.
+SEARCH_SPACE: dict[str, list[Any]] = {
+    "lto": ["false", "thin", "fat"],
+    "codegen_units": [16, 1],
+    "opt_level": ["3", "2"],
+    "target_cpu_native": [False, True],
+    "panic": ["unwind", "abort"],
+    "allocator": [None, "jemalloc", "mimalloc"],
+}
+
+# Allocators are tried by preloading their shared library, so that the project
+# doesn't need a dependency on each to be measured.
+ALLOCATOR_LIBRARIES = {"jemalloc": "jemalloc", "mimalloc": "mimalloc"}
+ALLOCATOR_CRATES = {"jemalloc": "tikv-jemallocator", "mimalloc": "mimalloc"}
+
+TARGET_CPU_NATIVE_RE = re.compile(r"-C\s*target-cpu=native")
+
+
+@dataclass(frozen=True)
+class BuildConfig:
+    """Release build settings that can change performance without source edits.
+
+    The defaults are cargo's; `current` reads the project's own.
+    """
+
+    lto: str = "false"
+    codegen_units: int = 16
+    opt_level: str = "3"
+    target_cpu_native: bool = False
+    panic: str = "unwind"
+    allocator: Optional[str] = None
+
+    @staticmethod
+    def current(project_root: Path) -> "BuildConfig":
+        """The project's release profile and rustflags, as they're built now."""
+        cargo_toml = project_root / "Cargo.toml"
+        manifest = tomllib.loads(cargo_toml.read_text()) if cargo_toml.exists() else {}
+        profile = manifest.get("profile", {}).get("release", {})
+        config = BuildConfig(
+            target_cpu_native=bool(
+                TARGET_CPU_NATIVE_RE.search(project_rustflags(project_root))
+            )
+        )
+        if "lto" in profile:
+            lto = profile["lto"]
+            # `lto = true` is the same as "fat".
+            if isinstance(lto, bool):
+                lto = "fat" if lto else "false"
+            config = replace(config, lto=str(lto))
+        if "codegen-units" in profile:
+            config = replace(config, codegen_units=int(profile["codegen-units"]))
+        if "opt-level" in profile:
+            config = replace(config, opt_level=str(profile["opt-level"]))
+        if "panic" in profile:
+            config = replace(config, panic=str(profile["panic"]))
+        return config
+
+    def name(self, current: "BuildConfig") -> str:
+        changed = [
+            f"{f.name}={getattr(self, f.name)}"
+            for f in fields(self)
+            if getattr(self, f.name) != getattr(current, f.name)
+        ]
+        return ",".join(changed) or "current"
+
+    def _profile_changes(self, current: "BuildConfig") -> list[tuple[str, str]]:
+        """The `[profile.release]` keys this configuration sets differently from
+        `current`, with their values in TOML."""
+        changes = []
+        if self.lto != current.lto:
+            changes.append(("lto", "false" if self.lto == "false" else f'"{self.lto}"'))
+        if self.codegen_units != current.codegen_units:
+            changes.append(("codegen-units", str(self.codegen_units)))
+        if self.opt_level != current.opt_level:
+            opt_level = self.opt_level
+            changes.append(
+                ("opt-level", opt_level if opt_level.isdigit() else f'"{opt_level}"')
+            )
+        if self.panic != current.panic:
+            changes.append(("panic", f'"{self.panic}"'))
+        return changes
+
+    def cargo_args(self, current: "BuildConfig") -> list[str]:
+        """Overrides of the release profile for the settings that differ from
+        `current`, so that the rest stay as the project has them."""
+        return [
+            arg
+            for key, value in self._profile_changes(current)
+            for arg in ["--config", f"profile.release.{key}={value}"]
+        ]
+
+    def rustflags(self, current: "BuildConfig", project_rustflags: str) -> str:
+        """The project's rustflags, with `target-cpu=native` added or dropped."""
+        if self.target_cpu_native == current.target_cpu_native:
+            return project_rustflags
+        if self.target_cpu_native:
+            return f"{project_rustflags} -C target-cpu=native".strip()
+        return " ".join(TARGET_CPU_NATIVE_RE.sub("", project_rustflags).split())
+
+    def env(self) -> dict[str, str]:
+        if self.allocator is None:
+            return {}
+        library = ctypes.util.find_library(ALLOCATOR_LIBRARIES[self.allocator])
+        assert library is not None, f"{self.allocator} is not installed"
+        return {"LD_PRELOAD": library}
+
+    def proposal(self, current: "BuildConfig") -> str:
+        """The changes to the project's build files that turn `current` into this
+        configuration."""
+        profile = [f"{key} = {value}" for key, value in self._profile_changes(current)]
+        sections = []
+        if profile:
+            sections.append(
+                "In Cargo.toml:\n\n[profile.release]\n" + "\n".join(profile)
+            )
+        if self.target_cpu_native and not current.target_cpu_native:
+            sections.append(
+                "In .cargo/config.toml (the binary then only runs on CPUs like this"
+                ' one):\n\n[build]\nrustflags = ["-C", "target-cpu=native"]'
+            )
+        elif current.target_cpu_native and not self.target_cpu_native:
+            sections.append(
+                "In .cargo/config.toml, drop `-C target-cpu=native` from the build"
+                " rustflags."
+            )
+        if self.allocator is not None and self.allocator != current.allocator:
+            crate = ALLOCATOR_CRATES[self.allocator]
+            sections.append(
+                f"Make {self.allocator} the global allocator: add the `{crate}`"
+                " crate as a dependency and set it with `#[global_allocator]`."
+            )
+        return "\n\n".join(sections) or "Keep the current build settings."
+
+
+def project_rustflags(project_root: Path) -> str:
+    """The rustflags the project's `.cargo/config.toml` builds with, which the
+    `RUSTFLAGS` the search builds with would otherwise override."""
+    for name in ["config.toml", "config"]:
+        config_path = project_root / ".cargo" / name
+        if config_path.exists():
+            rustflags = (
+                tomllib.loads(config_path.read_text())
+                .get("build", {})
+                .get("rustflags", "")
+            )
+            return rustflags if isinstance(rustflags, str) else " ".join(rustflags)
+    return ""
+
+
+@dataclass
+class BuildSearchReport:
+    baseline_secs: float
+    # The project's own settings, which the baseline was built with.
+    current: BuildConfig
+    # Baseline runtime divided by each tried configuration's, or None if it failed
+    # to build or run.
+    speedups: dict[BuildConfig, Optional[float]] = field(default_factory=dict)
+    best: Optional[BuildConfig] = None
+
+    def summary(self) -> str:
+        lines = [f"Baseline release build: {self.baseline_secs:.3f}s."]
+        for config, speedup in self.speedups.items():
+            measured = f"{speedup:.3f}x" if speedup is not None else "failed"
+            lines.append(f"- {config.name(self.current)}: {measured}")
+        best_speedup = self.speedups.get(self.best) if self.best else None
+        if self.best is None or best_speedup is None:
+            lines.append("No configuration beat the project's current release build.")
+        else:
+            lines.append(
+                f"Best: {self.best.name(self.current)}, {best_speedup:.3f}x."
+                f"\n\n{self.best.proposal(self.current)}"
+            )
+        return "\n".join(lines)
+
+
+def _available(setting: str, value: Any) -> bool:
+    if setting == "allocator" and value is not None:
+        return ctypes.util.find_library(ALLOCATOR_LIBRARIES[value]) is not None
+    return True
+
+
+def search_build_config(
+    project: Project, runs: int = 3, max_parallel_builds: int = 2
+) -> BuildSearchReport:
+    """Find the release build settings under which the workloads run fastest.
+
+    The search changes one setting at a time, keeping each change that beats the
+    best configuration so far by `MIN_SPEEDUP`: trying every combination would take
+    hundreds of builds. The candidates for each setting are built in parallel, into
+    their own target directories, and timed one at a time.
+    """
+    search_dir = project.root() / "target" / "accelerant-build-search"
+    current = BuildConfig.current(project.root())
+    rustflags = project_rustflags(project.root())
+
+    def build(config: BuildConfig) -> Optional[Path]:
+        try:
+            return project.build_release(
+                config.cargo_args(current),
+                config.rustflags(current, rustflags),
+                search_dir / config.name(current),
+            )
+        except subprocess.CalledProcessError:
+            return None
+
+    def measure(config: BuildConfig, binary: Optional[Path]) -> Optional[float]:
+        if binary is None:
+            return None
+        try:
+            return project.time_binary(binary, runs, config.env())
+        except subprocess.CalledProcessError:
+            return None
+
+    best = current
+    baseline_secs = measure(best, build(best))
+    assert baseline_secs is not None, "the current release build should build and run"
+    report = BuildSearchReport(baseline_secs, current)
+    best_secs = baseline_secs
+
+    for setting, values in SEARCH_SPACE.items():
+        candidates = [
+            replace(best, **{setting: value})
+            for value in values
+            if value != getattr(best, setting) and _available(setting, value)
+        ]
+        with ThreadPoolExecutor(max_workers=max_parallel_builds) as executor:
+            binaries = list(executor.map(build, candidates))
+        for config, binary in zip(candidates, binaries):
+            secs = measure(config, binary)
+            report.speedups[config] = baseline_secs / secs if secs else None
+            if secs is not None and best_secs / secs >= MIN_SPEEDUP:
+                best, best_secs = config, secs
+    if best != current:
+        report.best = best
+    return report
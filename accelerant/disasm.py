@@ -0,0 +1,167 @@
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import subprocess
+from typing import Optional
+
+# Disassemblies of binaries seen in this process, by build ID.
+_LOADED: dict[str, "Disassembly"] = {}
+
+_SYMBOL_RE = re.compile(r"^([0-9a-f]+) <(.+)>:$")
+_INSTRUCTION_RE = re.compile(r"^\s+([0-9a-f]+):\t(.*)$")
+_SRCLINE_RE = re.compile(r"^(/.*):(\d+)(?: \(discriminator \d+\))?$")
+
+
+@dataclass
+class Instruction:
+    # Offset from the start of the symbol, as perf reports sampled addresses.
+    offset: int
+    text: str
+    # Absolute path and line of the source the instruction came from, if known.
+    path: Optional[str]
+    line: Optional[int]
+
+
+@dataclass
+class Disassembly:
+    build_id: str
+    symbols: dict[str, list[Instruction]]
+
+    def instructions_at(self, path: Path, line: int) -> dict[str, list[Instruction]]:
+        """Instructions generated from a source line, by the symbol they're in.
+
+        Inlining can put copies of a line in several symbols.
+        """
+        found: dict[str, list[Instruction]] = {}
+        abspath = str(path)
+        for symbol, instructions in self.symbols.items():
+            for instruction in instructions:
+                if instruction.line == line and instruction.path == abspath:
+                    found.setdefault(symbol, []).append(instruction)
+        return found
+
+
+def build_id(binary: Path) -> str:
+    """The binary's GNU build ID, or a hash of its contents if it has none."""
+    result = subprocess.run(
+        ["readelf", "-n", str(binary)], capture_output=True, text=True
+    )
+    for line in result.stdout.splitlines():
+        key, _, value = line.strip().partition(": ")
+        if key == "Build ID":
+            return value
+    with open(binary, "rb") as f:
+        return "sha256-" + hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def load_disassembly(binary: Path) -> Disassembly:
+    """Disassemble a binary with line info, or reuse an earlier disassembly of the
+    same build from this process or the on-disk cache."""
+    bid = build_id(binary)
+    if bid in _LOADED:
+        return _LOADED[bid]
+    cache_path = _cache_dir() / f"{bid}.json"
+    if cache_path.exists():
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        disasm = Disassembly(
+            bid,
+            {
+                symbol: [Instruction(**i) for i in instructions]
+                for symbol, instructions in cached["symbols"].items()
+            },
+        )
+    else:
+        disasm = Disassembly(bid, _disassemble(binary))
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(asdict(disasm), f)
+    _LOADED[bid] = disasm
+    return disasm
+
+
+def _cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    base = Path(cache_home) if cache_home else Path.home() / ".cache"
+    return base / "accelerant" / "disasm"
+
+
+def _disassemble(binary: Path) -> dict[str, list[Instruction]]:
+    result = subprocess.run(
+        ["objdump", "-d", "-l", "-C", "--no-show-raw-insn", str(binary)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    symbols: dict[str, list[Instruction]] = {}
+    # Generic functions can demangle to the same name; only the first is kept.
+    instructions: Optional[list[Instruction]] = None
+    start = 0
+    path: Optional[str] = None
+    line: Optional[int] = None
+    for text in result.stdout.splitlines():
+        if m := _INSTRUCTION_RE.match(text):
+            if instructions is not None:
+                instructions.append(
+                    Instruction(int(m[1], 16) - start, m[2].strip(), path, line)
+                )
+        elif m := _SRCLINE_RE.match(text):
+            path, line = m[1], int(m[2])
+        elif m := _SYMBOL_RE.match(text):
+            start = int(m[1], 16)
+            instructions = [] if m[2] not in symbols else None
+            if instructions is not None:
+                symbols[m[2]] = instructions
+            path, line = None, None
+    return symbols
+
+
+def annotate(
+    instructions: list[Instruction],
+    hits: dict[int, int],
+    total_hits: int,
+    project_root: Path,
+    hot_pct: float = 5.0,
+    context: int = 3,
+) -> str:
+    """Instructions with each one's share of `total_hits`, marking those over
+    `hot_pct` and collapsing long runs without samples."""
+    sampled = [i for i, instr in enumerate(instructions) if instr.offset in hits]
+    shown = [
+        not sampled or any(abs(i - j) <= context for j in sampled)
+        for i in range(len(instructions))
+    ]
+    lines = []
+    last_src: Optional[tuple[Optional[str], Optional[int]]] = None
+    skipped = 0
+    for i, instr in enumerate(instructions):
+        if not shown[i]:
+            skipped += 1
+            continue
+        if skipped:
+            lines.append(f"        ... ({skipped} instructions with no samples) ...")
+            skipped = 0
+        if (instr.path, instr.line) != last_src:
+            last_src = (instr.path, instr.line)
+            lines.append(
+                f"        ; {_relative(instr.path, project_root)}:{instr.line}"
+            )
+        pct = 100 * hits.get(instr.offset, 0) / total_hits if total_hits else 0.0
+        mark = " HOT" if pct >= hot_pct else ""
+        pct_text = f"{pct:5.1f}%" if pct > 0 else ""
+        lines.append(f"{pct_text:>6} {instr.offset:+#7x}  {instr.text}{mark}")
+    if skipped:
+        lines.append(f"        ... ({skipped} instructions with no samples) ...")
+    return "\n".join(lines)
+
+
+def _relative(path: Optional[str], project_root: Path) -> str:
+    if path is None:
+        return "<unknown>"
+    try:
+        return str(Path(path).relative_to(project_root))
+    except ValueError:
+        return path
@@ -0,0 +1,197 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import subprocess
+import tempfile
+from typing import Optional
+
+from agents import set_trace_processors
+from perfparser import LineLoc
+
+from accelerant.agent import AgentConfig, AgentInput, AgentResult, run_agent_session
+from accelerant.lsp import TOP_LEVEL_SYMBOL_KINDS
+from accelerant.project import Project
+from accelerant.tools import AgentContext
+from accelerant.trace import LoggingTracingProcessor
+from accelerant.verify import MIN_SPEEDUP
+
+DEFAULT_NUM_HOTSPOTS = 3
+
+
+@dataclass
+class HotspotResult:
+    loc: LineLoc
+    region: str
+    final_message: str = ""
+    # New contents of each file the sub-agent changed, relative to the project root.
+    edits: dict[Path, str] = field(default_factory=dict)
+    # Baseline runtime divided by the runtime with these edits alone, or None if
+    # they were not measured or did not build.
+    speedup: Optional[float] = None
+    error: Optional[str] = None
+
+
+def run_fanout(
+    project: Project,
+    ag_input: AgentInput,
+    ag_config: AgentConfig,
+    num_hotspots: int = DEFAULT_NUM_HOTSPOTS,
+) -> AgentResult:
+    """Optimize each top hotspot with its own agent, then keep the edits that help.
+
+    Every agent works on a copy of the project, concurrently. Their edits are then
+    measured one at a time in `project`'s sandbox, the winners that touch disjoint
+    files are combined, and the combination is measured again before it's
+    persisted. The project's LSP server must be running and its sandbox entered.
+    """
+    if "record_path" in ag_config or "replay_path" in ag_config:
+        raise ValueError("recording and replaying need a single agent")
+    set_trace_processors([LoggingTracingProcessor(None, ag_config.get("trace_path"))])
+
+    fs = project.fs_sandbox()
+    baseline_secs = project.measure_runtime()
+    hotspots = _pick_hotspots(project, ag_input, num_hotspots)
+    print(
+        f"Baseline takes {baseline_secs:.3f}s; optimizing {len(hotspots)} hotspots:"
+        f" {', '.join(f'{h.region} ({h.loc.path}:{h.loc.line})' for h in hotspots)}"
+    )
+    with ThreadPoolExecutor(max_workers=max(1, len(hotspots))) as executor:
+        for future in [
+            executor.submit(_optimize_hotspot, project, hotspot, ag_config)
+            for hotspot in hotspots
+        ]:
+            future.result()
+
+    # Measure each candidate on its own, in the project's build directory.
+    for hotspot in hotspots:
+        if not hotspot.edits or hotspot.error is not None:
+            continue
+        old_texts = _apply(project, hotspot.edits)
+        try:
+            hotspot.speedup = baseline_secs / project.measure_runtime()
+        except subprocess.CalledProcessError as e:
+            hotspot.error = f"failed to build or run: {e}"
+        _apply(project, old_texts)
+
+    winners: list[HotspotResult] = []
+    for hotspot in sorted(hotspots, key=lambda h: -(h.speedup or 0)):
+        if hotspot.speedup is None or hotspot.speedup < MIN_SPEEDUP:
+            continue
+        if any(set(hotspot.edits) & set(winner.edits) for winner in winners):
+            hotspot.error = "edits conflict with a faster hotspot's"
+            continue
+        winners.append(hotspot)
+
+    combined_speedup: Optional[float] = None
+    if winners:
+        originals: dict[Path, str] = {}
+        for winner in winners:
+            originals.update(_apply(project, winner.edits))
+        try:
+            combined_speedup = baseline_secs / project.measure_runtime()
+        except subprocess.CalledProcessError:
+            combined_speedup = None
+        # The parts can interfere once combined; fall back to the best one alone.
+        best_speedup = winners[0].speedup
+        assert best_speedup is not None
+        if combined_speedup is None or combined_speedup < best_speedup:
+            for winner in winners[1:]:
+                _apply(project, {path: originals[path] for path in winner.edits})
+                winner.error = "dropped: slower when combined with the others"
+            winners = winners[:1]
+            combined_speedup = best_speedup
+        fs.persist_all()
+
+    return AgentResult(final_message=_summarize(hotspots, winners, combined_speedup))
+
+
+def _pick_hotspots(
+    project: Project, ag_input: AgentInput, num_hotspots: int
+) -> list[HotspotResult]:
+    """The hottest lines in distinct top-level symbols, or the lines given as input."""
+    if ag_input["hotspot_lines"]:
+        candidates = list(ag_input["hotspot_lines"])
+    else:
+        perf_data = project.perf_data()
+        if perf_data is None:
+            project.build_for_profiling()
+            project.run_profiler()
+            perf_data = project.perf_data()
+        assert perf_data is not None, "perf data should be available after profiling"
+        candidates = [loc for loc, _ in perf_data.tabulate() if loc.line > 0]
+
+    hotspots: list[HotspotResult] = []
+    seen_regions: set[tuple[str, str]] = set()
+    for loc in candidates:
+        parent_sym = project.lsp().syncexec(
+            project.lsp().request_nearest_parent_symbol(
+                loc.path, loc.line - 1, TOP_LEVEL_SYMBOL_KINDS
+            ),
+        )
+        region = parent_sym["name"] if parent_sym is not None else "<unknown>"
+        if (loc.path, region) in seen_regions:
+            continue
+        seen_regions.add((loc.path, region))
+        hotspots.append(HotspotResult(loc=loc, region=region))
+        if len(hotspots) == num_hotspots:
+            break
+    return hotspots
+
+
+def _optimize_hotspot(
+    project: Project, hotspot: HotspotResult, ag_config: AgentConfig
+) -> None:
+    # The agents SDK needs an event loop in the calling thread.
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        copy = project.copy_to(Path(scratch_dir) / project._root.name)
+        try:
+            with copy.lsp().start_server():
+                with copy.fs_sandbox() as fs:
+                    hotspot.final_message = run_agent_session(
+                        AgentContext(project=copy),
+                        {"perf_data_path": None, "hotspot_lines": [hotspot.loc]},
+                        ag_config,
+                    )
+                    hotspot.edits = {
+                        relpath: fs.read_file(relpath)
+                        for relpath in fs.modified_files()
+                    }
+        except Exception as e:
+            hotspot.error = f"agent failed: {e}"
+
+
+def _apply(project: Project, texts: dict[Path, str]) -> dict[Path, str]:
+    """Write `texts` through the project's sandbox, returning what they replaced."""
+    fs = project.fs_sandbox()
+    old_texts = {path: fs.read_file(path) for path in texts}
+    for path, text in texts.items():
+        fs.write_file(path, text)
+    return old_texts
+
+
+def _summarize(
+    hotspots: list[HotspotResult],
+    winners: list[HotspotResult],
+    combined_speedup: Optional[float],
+) -> str:
+    lines = []
+    for hotspot in hotspots:
+        if hotspot in winners:
+            outcome = f"kept, {hotspot.speedup:.3f}x on its own"
+        elif hotspot.error is not None:
+            outcome = hotspot.error
+        elif hotspot.speedup is not None:
+            outcome = f"discarded, {hotspot.speedup:.3f}x on its own"
+        else:
+            outcome = "no edits"
+        lines.append(
+            f"## {hotspot.region} ({hotspot.loc.path}:{hotspot.loc.line}): {outcome}"
+        )
+        lines.append(hotspot.final_message)
+    if combined_speedup is not None:
+        lines.append(f"Combined speedup of the kept edits: {combined_speedup:.3f}x")
+    else:
+        lines.append("No edits gave a measured speedup; the code is unchanged.")
+    return "\n\n".join(lines)
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 import hashlib
 from pathlib import Path
-from typing import Literal
+from typing import Callable, Literal, Optional
 
 
 @dataclass(frozen=True)
@@ -13,12 +13,14 @@ class FsSandbox:
     base_dir: Path
     old_versions: dict[Path, str]
     cur_hashes: dict[Path, str]
+    write_listeners: list[Callable[[Path], None]]
     status: Literal["fresh"] | Literal["entered"] | Literal["done"] = "fresh"
 
     def __init__(self, base_dir: Path) -> None:
         self.base_dir = base_dir
         self.old_versions = {}
         self.cur_hashes = {}
+        self.write_listeners = []
 
     def __enter__(self) -> "FsSandbox":
         self.status = "entered"
@@ -40,7 +42,8 @@ class FsSandbox:
 
     def write_file(self, relpath: Path, new_text: str) -> None:
         assert self.status == "entered"
-        abspath = self.base_dir / relpath
+        # Callers pass both relative and absolute paths; track them the same way.
+        relpath = self._relpath(relpath)
         abspath = self.base_dir / relpath
         if relpath not in self.old_versions:
             with open(abspath, "r") as f:
@@ -51,21 +54,64 @@ class FsSandbox:
         if self.old_versions[relpath] == new_text:
             del self.old_versions[relpath]
             del self.cur_hashes[relpath]
+        for listener in self.write_listeners:
+            listener(relpath)
+
+    def write_files(self, new_texts: dict[Path, str]) -> None:
+        """Write several files, or none of them: if a write fails, the files already
+        written are restored before the error is raised."""
+        previous = {path: self.read_file(path) for path in new_texts}
+        written = []
+        try:
+            for path, new_text in new_texts.items():
+                self.write_file(path, new_text)
+                written.append(path)
+        except BaseException:
+            for path in written:
+                self.write_file(path, previous[path])
+            raise
+
+    def add_write_listener(self, listener: Callable[[Path], None]) -> None:
+        """Call `listener` with the path, relative to `base_dir`, of every file written."""
+        self.write_listeners.append(listener)
+
+    def content_hash(self, relpath: Path) -> Optional[str]:
+        """The hash of a file's current contents, or None if it's unmodified."""
+        return self.cur_hashes.get(self._relpath(relpath))
+
+    def modified_files(self) -> list[Path]:
+        """Paths, relative to `base_dir`, of the files whose contents were changed."""
+        return sorted(self.old_versions)
+
+    def original_text(self, relpath: Path) -> str:
+        """A file's contents from before any edits."""
+        old_text = self.old_versions.get(self._relpath(relpath))
+        return old_text if old_text is not None else self.read_file(relpath)
+
+    def _relpath(self, path: Path) -> Path:
+        return (self.base_dir / path).relative_to(self.base_dir)
 
     def persist(self, relpath: Path) -> None:
         assert self.status == "entered"
-        if relpath in self.old_versions:
-            del self.old_versions[relpath]
+        self.old_versions.pop(self._relpath(relpath), None)
 
     def persist_all(self) -> None:
         assert self.status == "entered"
         self.old_versions = {}
 
     def version(self) -> FsVersion:
-        hasher = hashlib.sha256()
-        for relpath in sorted(self.cur_hashes.keys()):
-            hasher.update(relpath.as_posix().encode())
-            hasher.update(b"\0")
-            hasher.update(self.cur_hashes[relpath].encode())
-            hasher.update(b"\0")
-        return FsVersion(hash=hasher.hexdigest()[:8])
+        return _hash_version(self.cur_hashes)
+
+    def base_version(self) -> FsVersion:
+        """The version of the tree before any edits were applied."""
+        return _hash_version({})
+
+
+def _hash_version(cur_hashes: dict[Path, str]) -> FsVersion:
+    hasher = hashlib.sha256()
+    for relpath in sorted(cur_hashes.keys()):
+        hasher.update(relpath.as_posix().encode())
+        hasher.update(b"\0")
+        hasher.update(cur_hashes[relpath].encode())
+        hasher.update(b"\0")
+    return FsVersion(hash=hasher.hexdigest()[:8])
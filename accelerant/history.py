@@ -0,0 +1,182 @@
+import json
+from typing import Any, Optional
+
+from agents import TResponseInputItem
+from agents.run_config import CallModelData, ModelInputData
+
+# Rough size of a token in characters, for budgeting without a tokenizer.
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 60_000
+
+# Tools whose output describes the whole program as of when they ran, so a later
+# call of the same tool makes an earlier one obsolete.
+WHOLE_PROGRAM_TOOLS = {
+    "check_codebase_for_errors",
+    "run_perf_profiler",
+    "get_live_hotspots",
+    "run_benchmarks",
+    "run_offcpu_profiler",
+    "get_top_allocating_lines",
+    "compare_workloads",
+    "get_profile_phases",
+    "get_thread_utilization",
+}
+# Tools whose output quotes source code, so an edit to one of the files involved
+# makes it stale.
+CODE_TOOLS = {
+    "get_info",
+    "get_references",
+    "get_surrounding_code",
+    "get_annotated_hot_code",
+    "get_annotated_assembly",
+}
+EDIT_TOOLS = {"edit_code", "edit_code_batch"}
+
+
+def _estimate_tokens(item: Any) -> int:
+    text = item if isinstance(item, str) else json.dumps(item, default=str)
+    return len(text) // CHARS_PER_TOKEN
+
+
+def _parse_args(arguments: str) -> Any:
+    try:
+        return json.loads(arguments)
+    except json.JSONDecodeError:
+        return {}
+
+
+def _filenames(args: Any) -> set[str]:
+    """Every `filename` value in a tool call's (possibly nested) arguments."""
+    if isinstance(args, dict):
+        found = {args["filename"]} if isinstance(args.get("filename"), str) else set()
+        for value in args.values():
+            found |= _filenames(value)
+        return found
+    if isinstance(args, list):
+        return set().union(*(_filenames(value) for value in args))
+    return set()
+
+
+def _with_output(item: Any, note: str) -> Any:
+    return {**item, "output": note}
+
+
+class HistoryManager:
+    """Compacts the conversation before each model call.
+
+    Used as the run's `call_model_input_filter`. Outputs of tool calls that later
+    calls superseded, like older profiles and code from files edited since, are
+    replaced with one-line notes. If the input still exceeds `token_budget`, the
+    oldest remaining tool outputs are elided too, except those of the latest turn.
+    The call items themselves are kept so the model can see what it already tried.
+    """
+
+    token_budget: int
+    # Size of the last input sent to the model, after compaction, and how many tool
+    # outputs were replaced in it.
+    last_input_tokens: int
+    last_compacted_outputs: int
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET) -> None:
+        self.token_budget = token_budget
+        self.last_input_tokens = 0
+        self.last_compacted_outputs = 0
+
+    def __call__(self, data: CallModelData[Any]) -> ModelInputData:
+        items = self.compact(data.model_data.input)
+        return ModelInputData(input=items, instructions=data.model_data.instructions)
+
+    def compact(self, input: list[TResponseInputItem]) -> list[TResponseInputItem]:
+        # Items are TypedDicts of many shapes; only tool calls and outputs matter here.
+        items: list[Any] = list(input)
+        calls: dict[str, tuple[str, str]] = {}
+        outputs: list[int] = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            if item.get("type") == "function_call":
+                calls[item["call_id"]] = (item["name"], item["arguments"])
+            elif item.get("type") == "function_call_output":
+                outputs.append(i)
+
+        # The latest outputs are left alone: the model has not seen them yet.
+        latest_turn = self._latest_turn(items)
+        notes = {
+            i: note
+            for i, note in self._superseded(items, outputs, calls).items()
+            if i < latest_turn
+        }
+        compacted = list(items)
+        for i, note in notes.items():
+            compacted[i] = _with_output(items[i], note)
+
+        total = sum(_estimate_tokens(item) for item in compacted)
+        elided = 0
+        for i in outputs:
+            if total <= self.token_budget:
+                break
+            if i >= latest_turn or i in notes:
+                continue
+            name = calls.get(compacted[i]["call_id"], ("tool", ""))[0]
+            note = (
+                f"[{name} output elided to save context; call the tool again if needed]"
+            )
+            before = _estimate_tokens(compacted[i])
+            after = _estimate_tokens(_with_output(compacted[i], note))
+            if after >= before:
+                continue
+            compacted[i] = _with_output(compacted[i], note)
+            total -= before - after
+            elided += 1
+
+        self.last_input_tokens = total
+        self.last_compacted_outputs = len(notes) + elided
+        return compacted
+
+    def _superseded(
+        self,
+        items: list[Any],
+        outputs: list[int],
+        calls: dict[str, tuple[str, str]],
+    ) -> dict[int, str]:
+        """Notes to replace the outputs of calls made obsolete by later ones."""
+        notes: dict[int, str] = {}
+        later_tools: set[str] = set()
+        later_calls: set[tuple[str, str]] = set()
+        edited_later: set[str] = set()
+        for i in reversed(outputs):
+            item = items[i]
+            name, arguments = calls.get(item["call_id"], ("", "{}"))
+            args = _parse_args(arguments)
+            output = item.get("output")
+            output_text = output if isinstance(output, str) else json.dumps(output)
+            note: Optional[str] = None
+            if (name, arguments) in later_calls:
+                note = f"[{name} output omitted: the same call was repeated later]"
+            elif name in WHOLE_PROGRAM_TOOLS and name in later_tools:
+                note = f"[{name} output omitted: superseded by a later {name} call]"
+            elif name in CODE_TOOLS:
+                stale = sorted(
+                    f
+                    for f in edited_later
+                    if f in _filenames(args) or f'"{f}"' in output_text
+                )
+                if stale:
+                    note = f"[{name} output omitted: {', '.join(stale)} edited since]"
+            if note is not None and _estimate_tokens(note) < _estimate_tokens(output):
+                notes[i] = note
+            later_tools.add(name)
+            later_calls.add((name, arguments))
+            if name in EDIT_TOOLS:
+                edited_later |= _filenames(args)
+        return notes
+
+    def _latest_turn(self, items: list[Any]) -> int:
+        """Index of the first of the trailing tool outputs."""
+        i = len(items)
+        while i > 0:
+            item = items[i - 1]
+            if not isinstance(item, dict) or item.get("type") != "function_call_output":
+                break
+            i -= 1
+        return i
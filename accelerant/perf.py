@@ -1,25 +1,304 @@
+import math
 from pathlib import Path
-from typing import List, Optional
-from perfparser import get_perf_data, LineLoc
+import threading
+from typing import Callable, List, Literal, Optional
+from perfparser import (
+    get_alloc_data,
+    get_offcpu_data,
+    get_perf_data,
+    LineLoc,
+    reads_perf_data_directly,
+)
 
-from perfparser import AttributedPerf
+from perfparser import AttributedAllocs, AttributedPerf, Phase, ThreadUtilization
+
+# "cpu" profiles count sampled cycles (and any other hardware events recorded);
+# "offcpu" profiles count nanoseconds blocked.
+PerfMode = Literal["cpu", "offcpu"]
+# "alloc" recordings are attributed to `AllocData` rather than `PerfData`.
+ProfileMode = Literal[PerfMode, "alloc"]
+# Which line samples in inlined code are charged to: the innermost project line, the
+# call site it was inlined at, or half to each.
+AttributionPolicy = Literal["innermost", "outermost", "split"]
 
 
 class PerfData:
     _path: Path
-    _data: AttributedPerf
+    # The attributed profile and the per-workload ones, published together so that a
+    # progressive load can swap both at once while tools read them.
+    _state: tuple[AttributedPerf, dict[str, "PerfData"]]
+    # Cleared while a progressive load is refining the profile in the background.
+    _refined: threading.Event
+    # Why refining failed, if it did; the profile then stays preliminary.
+    _refine_error: Optional[Exception]
 
-    def __init__(self, perf_data_path: Path, project_root: Path):
+    def __init__(
+        self,
+        perf_data_path: Path,
+        data: AttributedPerf,
+        workloads: Optional[dict[str, "PerfData"]] = None,
+    ):
         self._path = perf_data_path
-        self._data = get_perf_data(str(perf_data_path), str(project_root))
+        self._state = (data, workloads or {})
+        self._refined = threading.Event()
+        self._refined.set()
+        self._refine_error = None
+
+    @property
+    def _data(self) -> AttributedPerf:
+        return self._state[0]
+
+    @property
+    def _workloads(self) -> dict[str, "PerfData"]:
+        return self._state[1]
+
+    @staticmethod
+    def load(
+        perf_data_path: Path,
+        project_root: Path,
+        mode: PerfMode = "cpu",
+        policy: AttributionPolicy = "innermost",
+        fraction: float = 1.0,
+    ) -> "PerfData":
+        """Attribute a recording, or in "cpu" mode a uniform `fraction` of its
+        events."""
+        if mode == "offcpu":
+            data = get_offcpu_data(str(perf_data_path), str(project_root))
+        else:
+            data = get_perf_data(
+                str(perf_data_path), str(project_root), policy, fraction
+            )
+        return PerfData(perf_data_path, data)
+
+    @staticmethod
+    def subsamples_cheaply(perf_data_path: Path) -> bool:
+        """Whether loading a `fraction` of the recording's events costs about that
+        fraction of loading all of them, which recordings perfparser has to read
+        through `perf script` don't."""
+        return reads_perf_data_directly(str(perf_data_path))
+
+    @staticmethod
+    def load_progressive(
+        load: Callable[[float], "PerfData"], fraction: float
+    ) -> "PerfData":
+        """A preliminary profile from a `fraction` of the events, which a background
+        thread replaces with the full profile once it's attributed.
+
+        `load` attributes the given fraction of the events. If it fails on all of
+        them, the profile stays preliminary, and `wait_until_final` raises the error.
+        """
+        perf_data = load(fraction)
+        perf_data._refined.clear()
+
+        def refine() -> None:
+            try:
+                final = load(1.0)
+                perf_data._state = final._state
+            except Exception as e:
+                perf_data._refine_error = e
+            finally:
+                perf_data._refined.set()
+
+        threading.Thread(target=refine, daemon=True).start()
+        return perf_data
+
+    @staticmethod
+    def merge_repetitions(runs: List["PerfData"]) -> "PerfData":
+        """Average several recordings of the same workload into one profile."""
+        assert runs, "need at least one run to merge"
+        if len(runs) == 1:
+            return runs[0]
+        weight = 1.0 / len(runs)
+        data = AttributedPerf.merge([(run._data, weight) for run in runs])
+        return PerfData(runs[0].data_path(), data)
+
+    @staticmethod
+    def merge_workloads(parts: dict[str, tuple["PerfData", float]]) -> "PerfData":
+        """Combine per-workload profiles into one weighted profile.
+
+        Each workload's hits are scaled by its weight. The unweighted per-workload
+        profiles stay available through `workloads()`.
+        """
+        assert parts, "need at least one workload to merge"
+        if len(parts) == 1:
+            [(name, (perf_data, _))] = parts.items()
+            return PerfData(perf_data.data_path(), perf_data._data, {name: perf_data})
+        data = AttributedPerf.merge(
+            [(perf_data._data, weight) for perf_data, weight in parts.values()]
+        )
+        # Tools like flamegraphs need a single recording; use the heaviest workload.
+        primary, _ = max(parts.values(), key=lambda p: p[1])
+        return PerfData(
+            primary.data_path(),
+            data,
+            {name: perf_data for name, (perf_data, _) in parts.items()},
+        )
 
     def data_path(self) -> Path:
         return self._path
 
-    def lookup_pct_time(self, loc: LineLoc) -> Optional[float]:
-        if loc not in self._data.hit_count:
+    def total_hits(self, event: Optional[str] = None) -> int:
+        """Hits of an event kind, estimated from the subsample if not final."""
+        return round(self._data.total_event_hits(event) / self._data.sampled_fraction)
+
+    def is_final(self) -> bool:
+        """Whether every recorded event was attributed, rather than a subsample."""
+        return self._data.sampled_fraction >= 1.0
+
+    def wait_until_final(self, timeout: Optional[float] = None) -> bool:
+        """Wait for a progressive load to finish refining the profile.
+
+        Raises RuntimeError if refining it failed.
+        """
+        self._refined.wait(timeout)
+        if self._refine_error is not None:
+            raise RuntimeError("refining the profile failed") from self._refine_error
+        return self.is_final()
+
+    def refine_error(self) -> Optional[Exception]:
+        """Why a progressive load failed to refine the profile, if it did."""
+        return self._refine_error
+
+    def pct_time_error(
+        self, pct_time: float, event: Optional[str] = None, z: float = 1.96
+    ) -> float:
+        """Half-width of the confidence interval (95% by default) around a line's
+        share of the hits, as measured in a subsample; 0 for final profiles.
+
+        Treats events as drawn independently with equal hits, so it's a normal
+        approximation, corrected for sampling a finite recording.
+        """
+        if self.is_final():
+            return 0.0
+        n = self._data.sample_count(event)
+        if n == 0:
+            return 1.0
+        unsampled = 1.0 - self._data.sampled_fraction
+        return z * math.sqrt(pct_time * (1.0 - pct_time) / n * unsampled)
+
+    def event_kinds(self) -> List[str]:
+        """Kinds of events recorded, like `cycles` or `cache-misses`.
+
+        Methods taking an `event` default to cycles, or to the only kind recorded.
+        """
+        return self._data.event_kinds
+
+    def primary_event(self) -> Optional[str]:
+        """The kind methods taking an `event` default to."""
+        return self._data.primary_event
+
+    def workloads(self) -> dict[str, "PerfData"]:
+        return self._workloads
+
+    def lookup_pct_time(
+        self, loc: LineLoc, event: Optional[str] = None
+    ) -> Optional[float]:
+        hits = self._data.lookup_hits(loc, event)
+        if hits is None:
             return None
-        return self._data.hit_count[loc] / self._data.total_hits
+        return hits / self._data.total_event_hits(event)
+
+    def lookup_pct_time_by_workload(
+        self, loc: LineLoc, event: Optional[str] = None
+    ) -> dict[str, Optional[float]]:
+        return {
+            name: perf_data.lookup_pct_time(loc, event)
+            for name, perf_data in self._workloads.items()
+        }
+
+    def lookup_per_kilo_instruction(self, loc: LineLoc, event: str) -> Optional[float]:
+        """Events like cache or branch misses per thousand instructions at a line."""
+        instructions = self._data.lookup_hits(loc, "instructions")
+        if not instructions:
+            return None
+        return 1000 * (self._data.lookup_hits(loc, event) or 0) / instructions
+
+    def tabulate(self, event: Optional[str] = None) -> List[tuple[LineLoc, float]]:
+        return self._data.tabulate(event)
+
+    def tabulate_per_kilo_instruction(self, event: str) -> List[tuple[LineLoc, float]]:
+        return self._data.ratio(event, "instructions", 1000.0)
+
+    def instruction_hits(
+        self, symbol: str, event: Optional[str] = None
+    ) -> dict[int, int]:
+        """Hits per offset into a symbol, from the sampled instruction of each event."""
+        return self._data.instruction_hits(symbol, event)
+
+    def total_instruction_hits(self, event: Optional[str] = None) -> int:
+        """Hits over every sampled instruction, in the project or not, as counted in
+        the subsample if not final; the total `instruction_hits` are shares of."""
+        return self._data.total_instruction_hits(event)
+
+    def symbol_hits(self, event: Optional[str] = None) -> dict[str, int]:
+        return self._data.symbol_hits(event)
+
+    def inlined_into(
+        self, loc: LineLoc, event: Optional[str] = None
+    ) -> List[tuple[LineLoc, float]]:
+        """Call sites a line was inlined at, with the share of all hits it got at
+        each, most first."""
+        total = self._data.total_event_hits(event)
+        return [
+            (site, hits / total) for site, hits in self._data.inlined_into(loc, event)
+        ]
+
+    def thread_utilization(self) -> ThreadUtilization:
+        """Busy versus idle threads, load imbalance and serial fraction of the run.
+
+        Empty for profiles merged from several recordings, like `phases()`.
+        """
+        return self._data.thread_utilization()
+
+    def tabulate_thread(self, tid: int) -> List[tuple[LineLoc, float]]:
+        return self._data.tabulate_thread(tid)
+
+    def phases(self) -> List[Phase]:
+        """Phases of the run with distinct hotspots, in time order.
+
+        Empty for profiles merged from several recordings; use `workloads()` to get
+        at the phases of each workload.
+        """
+        return self._data.phases()
+
+    def top_lines_in_phase(self, phase: int, k: int) -> List[tuple[LineLoc, float]]:
+        return self._data.top_lines_in_phase(phase, k)
+
+    def top_lines_in_range(
+        self, start_secs: float, end_secs: float, k: int
+    ) -> List[tuple[LineLoc, float]]:
+        """The `k` hottest lines between two offsets from the start of the run."""
+        return self._data.top_lines_in_range(
+            int(start_secs * 1e9), int(end_secs * 1e9), k
+        )
+
+
+class AllocData:
+    _data: AttributedAllocs
+
+    def __init__(self, data: AttributedAllocs):
+        self._data = data
+
+    @staticmethod
+    def load(perf_data_path: Path, project_root: Path) -> "AllocData":
+        return AllocData(get_alloc_data(str(perf_data_path), str(project_root)))
+
+    @staticmethod
+    def merge(parts: List[tuple["AllocData", float]]) -> "AllocData":
+        """Combine allocation profiles, scaling each by its weight."""
+        assert parts, "need at least one profile to merge"
+        if len(parts) == 1 and parts[0][1] == 1.0:
+            return parts[0][0]
+        return AllocData(
+            AttributedAllocs.merge([(data._data, weight) for data, weight in parts])
+        )
+
+    def total_bytes(self) -> int:
+        return self._data.total_bytes
+
+    def total_count(self) -> int:
+        return self._data.total_count
 
-    def tabulate(self) -> List[tuple[LineLoc, float]]:
-        return self._data.tabulate()
+    def tabulate(self, by_count: bool = False) -> List[tuple[LineLoc, int, int]]:
+        """Lines with their allocated bytes and allocation count, biggest first."""
+        return self._data.tabulate(by_count)
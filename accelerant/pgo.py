@@ -0,0 +1,188 @@
+from dataclasses import dataclass, replace
+from pathlib import Path
+import shutil
+import subprocess
+from typing import Optional
+
+from accelerant.project import Project
+
+
+# How BOLT lays out the PGO build: hot blocks and functions together, and cold code
+# split off.
+BOLT_LAYOUT_ARGS = [
+    "-reorder-blocks=ext-tsp",
+    "-reorder-functions=hfsort",
+    "-split-functions",
+    "-split-all-cold",
+]
+
+
+@dataclass
+class PgoReport:
+    baseline_secs: float
+    pgo_secs: float
+    # Runtime after BOLT's layout optimization of the PGO build, if it was applied.
+    bolt_secs: Optional[float]
+    # The fastest build, copied out of the build directories.
+    binary: Path
+    # Profile data to rebuild the PGO build with.
+    profdata: Path
+    # BOLT's profile of the PGO build, if it was applied.
+    bolt_data: Optional[Path] = None
+
+    def best_secs(self) -> float:
+        return min(self.pgo_secs, self.bolt_secs or self.pgo_secs)
+
+    def is_bolted(self) -> bool:
+        """Whether the fastest build is the PGO build reordered by BOLT."""
+        return self.bolt_secs is not None and self.bolt_secs < self.pgo_secs
+
+    def summary(self) -> str:
+        lines = [
+            f"Release build: {self.baseline_secs:.3f}s.",
+            f"PGO build: {self.pgo_secs:.3f}s"
+            f" ({self.baseline_secs / self.pgo_secs:.3f}x).",
+        ]
+        if self.bolt_secs is not None:
+            lines.append(
+                f"PGO and BOLT: {self.bolt_secs:.3f}s"
+                f" ({self.baseline_secs / self.bolt_secs:.3f}x)."
+            )
+        if self.best_secs() >= self.baseline_secs:
+            lines.append("Neither beat the release build; keep building as before.")
+        elif self.is_bolted():
+            lines.append(
+                f"The fastest build is at {self.binary}. To rebuild it, build with"
+                f' RUSTFLAGS="-Cprofile-use={self.profdata}'
+                ' -Clink-args=-Wl,--emit-relocs", then re-run BOLT on the result:'
+                f" llvm-bolt BINARY -o BINARY.bolt -data={self.bolt_data}"
+                f" {' '.join(BOLT_LAYOUT_ARGS)}."
+            )
+        else:
+            lines.append(
+                f"The fastest build is at {self.binary}. To rebuild it, build with"
+                f' RUSTFLAGS="-Cprofile-use={self.profdata}".'
+            )
+        return "\n".join(lines)
+
+
+def _find_llvm_tool(name: str) -> str:
+    """An LLVM tool from the Rust toolchain's `llvm-tools` component if installed,
+    since it matches rustc's LLVM version, or from PATH otherwise."""
+    sysroot = subprocess.run(
+        ["rustc", "--print", "sysroot"], check=True, capture_output=True, text=True
+    ).stdout.strip()
+    for tool in Path(sysroot, "lib", "rustlib").glob(f"*/bin/{name}"):
+        return str(tool)
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(
+            f"{name} not found; run `rustup component add llvm-tools` or install LLVM"
+        )
+    return path
+
+
+def build_with_pgo(project: Project, bolt: bool = False, runs: int = 3) -> PgoReport:
+    """Build the current version with profile-guided optimization, trained on the
+    project's workloads, and measure it against a plain release build.
+
+    With `bolt`, BOLT then reorders the PGO build's code by a perf recording of it
+    running the workloads.
+    """
+    pgo_dir = project.root() / "target" / "accelerant-pgo"
+    raw_dir = pgo_dir / "profraw"
+    shutil.rmtree(raw_dir, ignore_errors=True)
+    raw_dir.mkdir(parents=True)
+    profdata = pgo_dir / "merged.profdata"
+
+    baseline = project.build_release([], "", pgo_dir / "baseline")
+    baseline_secs = project.time_binary(baseline, runs)
+
+    instrumented = project.build_release(
+        [], f"-Cprofile-generate={raw_dir}", pgo_dir / "instrumented"
+    )
+    for workload in project.workloads():
+        project.run_workload(replace(workload, binary=instrumented))
+    subprocess.run(
+        [_find_llvm_tool("llvm-profdata"), "merge", "-o", str(profdata), str(raw_dir)],
+        check=True,
+    )
+
+    # BOLT needs relocations to move functions around.
+    link_args = " -Clink-args=-Wl,--emit-relocs" if bolt else ""
+    optimized = project.build_release(
+        [], f"-Cprofile-use={profdata}{link_args}", pgo_dir / "optimized"
+    )
+    pgo_secs = project.time_binary(optimized, runs)
+
+    report = PgoReport(
+        baseline_secs, pgo_secs, None, pgo_dir / project.target_binary().name, profdata
+    )
+    best = optimized
+    if bolt:
+        bolted, report.bolt_data = _optimize_layout(
+            project, optimized, pgo_dir / "bolt"
+        )
+        report.bolt_secs = project.time_binary(bolted, runs)
+        if report.is_bolted():
+            best = bolted
+
+    shutil.copy2(best, report.binary)
+    return report
+
+
+def _optimize_layout(
+    project: Project, binary: Path, work_dir: Path
+) -> tuple[Path, Path]:
+    """Reorder a binary's functions and blocks with BOLT, by a perf recording of it
+    running each workload. Returns the reordered binary and BOLT's profile.
+
+    The recordings the project already has are of its profiling build, whose
+    addresses don't match this binary, so it's recorded afresh.
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    fdata_paths = []
+    for i, workload in enumerate(project.workloads()):
+        perf_data = work_dir / f"perf-{i}.data"
+        fdata = work_dir / f"perf-{i}.fdata"
+        project.run_workload(
+            replace(workload, binary=binary),
+            ["perf", "record", "-e", "cycles:u", "-o", str(perf_data)],
+        )
+        # Without branch records (`-nl`), so that CPUs without LBR work too.
+        subprocess.run(
+            [
+                _find_llvm_tool("perf2bolt"),
+                "-nl",
+                "-p",
+                str(perf_data),
+                "-o",
+                str(fdata),
+                str(binary),
+            ],
+            check=True,
+            capture_output=True,
+        )
+        fdata_paths.append(fdata)
+
+    merged = work_dir / "merged.fdata"
+    with open(merged, "wb") as f:
+        subprocess.run(
+            [_find_llvm_tool("merge-fdata"), *map(str, fdata_paths)],
+            check=True,
+            stdout=f,
+        )
+    bolted = work_dir / binary.name
+    subprocess.run(
+        [
+            _find_llvm_tool("llvm-bolt"),
+            str(binary),
+            "-o",
+            str(bolted),
+            f"-data={merged}",
+            *BOLT_LAYOUT_ARGS,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return bolted, merged
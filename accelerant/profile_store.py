@@ -0,0 +1,334 @@
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from perfparser import LineLoc
+
+from accelerant.fs_sandbox import FsVersion
+from accelerant.perf import PerfData, PerfMode
+
+_SCHEMA = """
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    git_commit TEXT,
+    fs_version TEXT NOT NULL,
+    -- Whether the tree had uncommitted edits, e.g. the agent's.
+    edited INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    event TEXT NOT NULL,
+    -- Whether `event` is the kind the profile's hotspots are ranked by.
+    is_primary INTEGER NOT NULL,
+    recorded_at REAL NOT NULL,
+    total_hits INTEGER NOT NULL,
+    UNIQUE (project, fs_version, mode, event)
+);
+CREATE INDEX IF NOT EXISTS profiles_by_commit
+    ON profiles (project, mode, event, edited, recorded_at);
+
+CREATE TABLE IF NOT EXISTS line_hits (
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (profile_id, path, line)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS line_hits_by_line ON line_hits (path, line);
+
+CREATE TABLE IF NOT EXISTS symbol_hits (
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    symbol TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (profile_id, symbol)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS symbol_hits_by_symbol ON symbol_hits (symbol);
+
+-- perf.data files a profile was attributed from, deleted along with it.
+CREATE TABLE IF NOT EXISTS recordings (
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_by_profile ON recordings (profile_id);
+
+CREATE TABLE IF NOT EXISTS runtimes (
+    project TEXT NOT NULL,
+    git_commit TEXT,
+    fs_version TEXT NOT NULL,
+    edited INTEGER NOT NULL,
+    recorded_at REAL NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (project, fs_version)
+);
+"""
+
+# The profile of each commit's unedited tree, with the commit before it. Parameters
+# are the project, mode and event (or NULL for the primary event).
+_COMMIT_PROFILES = """
+WITH latest AS (
+    SELECT id, git_commit, total_hits, MAX(recorded_at) AS recorded_at
+    FROM profiles
+    WHERE project = ? AND mode = ? AND edited = 0 AND git_commit IS NOT NULL
+        AND (event = ? OR (? IS NULL AND is_primary = 1))
+    GROUP BY git_commit
+)
+SELECT id, git_commit, total_hits,
+    LAG(id) OVER by_time AS prev_id,
+    LAG(git_commit) OVER by_time AS prev_commit,
+    LAG(total_hits) OVER by_time AS prev_total_hits
+FROM latest
+WINDOW by_time AS (ORDER BY recorded_at)
+"""
+
+
+@dataclass
+class HistoryPoint:
+    git_commit: Optional[str]
+    fs_version: str
+    edited: bool
+    recorded_at: float
+    # Share of the profile's hits, or of the runtime for `runtime_history`.
+    value: float
+
+
+@dataclass
+class Regression:
+    git_commit: str
+    prev_commit: str
+    loc: LineLoc
+    prev_pct: float
+    pct: float
+
+
+def default_store_path() -> Path:
+    data_home = os.environ.get("XDG_DATA_HOME")
+    base = Path(data_home) if data_home else Path.home() / ".local" / "share"
+    return base / "accelerant" / "profiles.sqlite3"
+
+
+class ProfileStore:
+    """Attributed profiles and runtimes of every version of a project profiled so
+    far, kept in SQLite across sessions.
+
+    Profiles are keyed by project root, git commit and `FsVersion`, so the history of
+    a line or function can be followed across commits and agent edits alike.
+    """
+
+    _conn: sqlite3.Connection
+    # Agents on project copies may share a store from several threads.
+    _lock: threading.Lock
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        path = path or default_store_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def add_profile(
+        self,
+        project: str,
+        git_commit: Optional[str],
+        version: FsVersion,
+        edited: bool,
+        mode: PerfMode,
+        perf_data: PerfData,
+        recordings: Optional[list[Path]] = None,
+    ) -> None:
+        """Store a profile's hits per line and per symbol, for every event kind,
+        replacing any earlier profile of the same version."""
+        primary = perf_data.primary_event()
+        recorded_at = time.time()
+        with self._lock, self._conn:
+            for event in perf_data.event_kinds():
+                total = perf_data.total_hits(event)
+                self._conn.execute(
+                    "DELETE FROM profiles"
+                    " WHERE project = ? AND fs_version = ? AND mode = ? AND event = ?",
+                    (project, version.hash, mode, event),
+                )
+                profile_id = self._conn.execute(
+                    "INSERT INTO profiles (project, git_commit, fs_version, edited,"
+                    " mode, event, is_primary, recorded_at, total_hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        project,
+                        git_commit,
+                        version.hash,
+                        edited,
+                        mode,
+                        event,
+                        event == primary,
+                        recorded_at,
+                        total,
+                    ),
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT INTO line_hits VALUES (?, ?, ?, ?)",
+                    [
+                        (profile_id, loc.path, loc.line, round(pct * total))
+                        for loc, pct in perf_data.tabulate(event)
+                    ],
+                )
+                self._conn.executemany(
+                    "INSERT INTO symbol_hits VALUES (?, ?, ?)",
+                    [
+                        (profile_id, symbol, hits)
+                        for symbol, hits in perf_data.symbol_hits(event).items()
+                    ],
+                )
+                self._conn.executemany(
+                    "INSERT INTO recordings VALUES (?, ?)",
+                    [(profile_id, str(path)) for path in recordings or []],
+                )
+
+    def add_runtime(
+        self,
+        project: str,
+        git_commit: Optional[str],
+        version: FsVersion,
+        edited: bool,
+        seconds: float,
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO runtimes VALUES (?, ?, ?, ?, ?, ?)",
+                (project, git_commit, version.hash, edited, time.time(), seconds),
+            )
+
+    def line_history(
+        self,
+        project: str,
+        loc: LineLoc,
+        mode: PerfMode = "cpu",
+        event: Optional[str] = None,
+    ) -> list[HistoryPoint]:
+        """A line's share of the hits in each stored profile, oldest first.
+
+        `event` defaults to the kind each profile's hotspots were ranked by.
+        """
+        return self._history(
+            "SELECT p.git_commit, p.fs_version, p.edited, p.recorded_at,"
+            " COALESCE(h.hits, 0) * 1.0 / MAX(p.total_hits, 1)"
+            " FROM profiles p LEFT JOIN line_hits h"
+            " ON h.profile_id = p.id AND h.path = ? AND h.line = ?"
+            " WHERE p.project = ? AND p.mode = ?"
+            " AND (p.event = ? OR (? IS NULL AND p.is_primary = 1))"
+            " ORDER BY p.recorded_at",
+            (loc.path, loc.line, project, mode, event, event),
+        )
+
+    def function_history(
+        self,
+        project: str,
+        symbol: str,
+        mode: PerfMode = "cpu",
+        event: Optional[str] = None,
+    ) -> list[HistoryPoint]:
+        """Like `line_history`, for a symbol's sampled instructions."""
+        return self._history(
+            "SELECT p.git_commit, p.fs_version, p.edited, p.recorded_at,"
+            " COALESCE(h.hits, 0) * 1.0 / MAX(p.total_hits, 1)"
+            " FROM profiles p LEFT JOIN symbol_hits h"
+            " ON h.profile_id = p.id AND h.symbol = ?"
+            " WHERE p.project = ? AND p.mode = ?"
+            " AND (p.event = ? OR (? IS NULL AND p.is_primary = 1))"
+            " ORDER BY p.recorded_at",
+            (symbol, project, mode, event, event),
+        )
+
+    def runtime_history(self, project: str) -> list[HistoryPoint]:
+        """Measured runtimes in seconds, oldest first."""
+        return self._history(
+            "SELECT git_commit, fs_version, edited, recorded_at, seconds"
+            " FROM runtimes WHERE project = ? ORDER BY recorded_at",
+            (project,),
+        )
+
+    def regressions(
+        self,
+        project: str,
+        min_increase: float = 0.02,
+        mode: PerfMode = "cpu",
+        event: Optional[str] = None,
+    ) -> list[Regression]:
+        """Lines whose share of the hits grew by at least `min_increase` from one
+        commit's profile to the next, biggest growth first.
+
+        Only profiles of unedited trees count, and the latest one of each commit.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                WITH pairs AS ({_COMMIT_PROFILES})
+                SELECT pairs.git_commit, pairs.prev_commit, cur.path, cur.line,
+                    COALESCE(prev.hits, 0) * 1.0 / MAX(pairs.prev_total_hits, 1),
+                    cur.hits * 1.0 / MAX(pairs.total_hits, 1) AS pct
+                FROM pairs
+                JOIN line_hits cur ON cur.profile_id = pairs.id
+                LEFT JOIN line_hits prev ON prev.profile_id = pairs.prev_id
+                    AND prev.path = cur.path AND prev.line = cur.line
+                WHERE pairs.prev_id IS NOT NULL
+                """,
+                (project, mode, event, event),
+            ).fetchall()
+        found = [
+            Regression(commit, prev_commit, LineLoc(path, line), prev_pct, pct)
+            for commit, prev_commit, path, line, prev_pct, pct in rows
+            if pct - prev_pct >= min_increase
+        ]
+        found.sort(key=lambda r: r.prev_pct - r.pct)
+        return found
+
+    def prune(
+        self, max_age_days: float = 90.0, max_edited_age_days: float = 7.0
+    ) -> int:
+        """Drop profiles older than `max_age_days`, or than `max_edited_age_days` for
+        edited versions that were never committed, along with any of their
+        recordings still on disk. Returns the number of profiles dropped."""
+        now = time.time()
+        cutoff = now - max_age_days * 86400
+        edited_cutoff = now - max_edited_age_days * 86400
+        with self._lock, self._conn:
+            stale = "recorded_at < ? OR (edited = 1 AND recorded_at < ?)"
+            paths = [
+                Path(path)
+                for (path,) in self._conn.execute(
+                    "SELECT DISTINCT path FROM recordings WHERE profile_id IN"
+                    f" (SELECT id FROM profiles WHERE {stale})",
+                    (cutoff, edited_cutoff),
+                )
+            ]
+            dropped = self._conn.execute(
+                f"DELETE FROM profiles WHERE {stale}", (cutoff, edited_cutoff)
+            ).rowcount
+            self._conn.execute(
+                f"DELETE FROM runtimes WHERE {stale}", (cutoff, edited_cutoff)
+            )
+        for path in paths:
+            path.unlink(missing_ok=True)
+        return dropped
+
+    def compact(self) -> None:
+        """Reclaim the space of pruned profiles and refresh the query planner's
+        statistics."""
+        with self._lock:
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA optimize")
+
+    def _history(self, query: str, params: tuple) -> list[HistoryPoint]:
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            HistoryPoint(commit, fs_version, bool(edited), recorded_at, value)
+            for commit, fs_version, edited, recorded_at, value in rows
+        ]
@@ -1,5 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+import math
 import os
+import re
 import shutil
+from statistics import fmean
 import subprocess
 import time
 from multilspy.lsp_protocol_handler import lsp_types
@@ -7,10 +12,70 @@ from multilspy.lsp_protocol_handler import lsp_types
 
 from pathlib import Path
 from typing import List, Optional
+from perfparser import LiveProfile, start_live_profile
 
+from accelerant.benches import BenchEstimate, build_bench, list_benches, run_bench
+from accelerant.disasm import build_id
 from accelerant.fs_sandbox import FsSandbox, FsVersion
 from accelerant.lsp import LSP
-from accelerant.perf import PerfData
+from accelerant.profile_store import ProfileStore
+from accelerant.perf import (
+    AllocData,
+    AttributionPolicy,
+    PerfData,
+    PerfMode,
+    ProfileMode,
+)
+from accelerant.workload import DEFAULT_WORKLOAD_NAME, Workload, default_workloads
+
+
+# Keep frame pointers and unwind tables so that perf can walk every stack.
+PROFILING_RUSTFLAGS = "-C force-unwind-tables=yes -C force-frame-pointers=yes"
+
+# How perf unwinds call stacks, for recordings and live profiles alike. DWARF
+# unwinding keeps the project callers of standard library code, which is built
+# without frame pointers; perfparser unwinds the stack dumps when reading them.
+CALL_GRAPH = "dwarf"
+
+# How long to run each bench under the profiler, without criterion's analysis.
+BENCH_PROFILE_SECS = 5
+
+# What `perf record` samples in each profiling mode.
+PROFILER_EVENT_ARGS: dict[ProfileMode, list[str]] = {
+    "cpu": ["-F997"],
+    # Every switch off a CPU with its stack, plus side-band records of switches back
+    # on, to measure how long each thread stayed blocked.
+    "offcpu": ["-e", "sched:sched_switch", "--switch-events"],
+    "alloc": [
+        arg
+        for probe in ["malloc", "calloc", "realloc", "posix_memalign"]
+        for arg in ["-e", f"accelerant:{probe}"]
+    ],
+}
+
+# CPU recordings at least this big in total are first attributed from a subsample,
+# and refined to the full profile in the background, if the subsample is cheaper.
+PROGRESSIVE_MIN_BYTES = 512 * 1024 * 1024
+PRELIMINARY_FRACTION = 0.05
+
+# Names of the recordings `Project` makes, which it may delete once they're stale.
+OWN_RECORDING_RE = re.compile(r"perf\d+-.*\.data")
+
+# How long to record processes that were already running when profiling started.
+ATTACH_DURATION_SECS = 10.0
+
+# Live profiles of long-running targets keep this much of the most recent samples,
+# in buckets of `LIVE_BUCKET_SECS`.
+LIVE_WINDOW_SECS = 30.0
+LIVE_BUCKET_SECS = 1.0
+
+# Uprobes on the C allocator, which Rust's default global allocator calls into.
+ALLOC_PROBES = [
+    "accelerant:malloc=malloc size=%di:u64",
+    "accelerant:calloc=calloc nmemb=%di:u64 size=%si:u64",
+    "accelerant:realloc=realloc size=%si:u64",
+    "accelerant:posix_memalign=posix_memalign size=%dx:u64",
+]
 
 
 class Project:
@@ -20,45 +85,246 @@ class Project:
     _lang: str
     _fs: FsSandbox
     _lsp: Optional[LSP]
-    _perf_per_version: dict[FsVersion, Path]
-    _perf_data_map: dict[Path, PerfData]
+    _workloads: list[Workload]
+    # Hardware events to sample in "cpu" mode, like `cache-misses`; perf's default
+    # (cycles) if empty.
+    _events: list[str]
+    # Which line samples in inlined code are charged to in "cpu" profiles.
+    _attribution: AttributionPolicy
+    # Recorded perf.data files, per workload, for each version and profiling mode.
+    _perf_per_version: dict[tuple[FsVersion, ProfileMode], dict[str, list[Path]]]
+    _perf_data_map: dict[tuple[FsVersion, PerfMode], PerfData]
+    _alloc_data_map: dict[FsVersion, AllocData]
+    # Weighted wall time of one pass over the workloads, for each version.
+    _runtimes: dict[FsVersion, float]
+    # Whether the target is a service that runs until stopped, so it's profiled live
+    # rather than run to completion.
+    _long_running: bool
+    # The running target, its live profile, and the version it was built from.
+    _live_target: Optional[subprocess.Popen]
+    _live_profile: Optional[LiveProfile]
+    _live_version: Optional[FsVersion]
+    # Where profiles and runtimes are kept across sessions, if anywhere.
+    _store: Optional[ProfileStore]
+    _stored: set[tuple[FsVersion, PerfMode]]
+    # Criterion bench targets whose estimates are the objective instead of the
+    # workloads' runtimes, if any; they're also what gets profiled.
+    _benches: list[str]
+    # Estimates by benchmark ID, for each version.
+    _bench_results: dict[FsVersion, dict[str, BenchEstimate]]
 
-    def __init__(self, root: Path, target_binary: Path, lang: str) -> None:
+    def __init__(
+        self,
+        root: Path,
+        target_binary: Path,
+        lang: str,
+        workloads: Optional[List[Workload]] = None,
+        events: Optional[List[str]] = None,
+        attribution: AttributionPolicy = "innermost",
+        long_running: bool = False,
+        store: Optional[ProfileStore] = None,
+        benches: Optional[List[str]] = None,
+    ) -> None:
         self._root = root
         self._target_binary = target_binary
         self._lang = lang
         self._fs = FsSandbox(root)
         self._lsp = None
+        self._workloads = workloads or default_workloads()
+        self._events = events or []
+        self._attribution = attribution
         self._perf_per_version = {}
         self._perf_data_map = {}
+        self._alloc_data_map = {}
+        self._runtimes = {}
+        self._long_running = long_running
+        self._live_target = None
+        self._live_profile = None
+        self._live_version = None
+        self._store = store
+        self._stored = set()
+        self._benches = benches or []
+        self._bench_results = {}
+
+    def copy_to(self, root: Path) -> "Project":
+        """Copy the project's current files to `root`, and return a project there
+        with its own sandbox, LSP and profiles.
+
+        Build outputs and recorded profiles are left behind, and the copy doesn't
+        add to the profile store.
+        """
+        shutil.copytree(
+            self._root, root, ignore=shutil.ignore_patterns("target", "perf*.data")
+        )
+        target_binary = (
+            root / self._target_binary.relative_to(self._root)
+            if self._target_binary.is_absolute()
+            else self._target_binary
+        )
+        return Project(
+            root,
+            target_binary,
+            self._lang,
+            self._workloads,
+            self._events,
+            self._attribution,
+            self._long_running,
+            benches=self._benches,
+        )
+
+    def root(self) -> Path:
+        return self._root
 
     def target_binary(self) -> Path:
         return self._target_binary
 
+    def workloads(self) -> List[Workload]:
+        return self._workloads
+
+    def events(self) -> List[str]:
+        return self._events
+
+    def benches(self) -> List[str]:
+        return self._benches
+
+    def available_benches(self) -> List[str]:
+        """Names of the project's bench targets."""
+        path_env_var = os.environ.get("PATH")
+        assert path_env_var is not None, "PATH environment variable is not set"
+        return list_benches(self._root, path_env_var)
+
+    def long_running(self) -> bool:
+        return self._long_running
+
     def lsp(self) -> LSP:
         if self._lsp is None:
             self._lsp = LSP(self._root, self._lang)
         return self._lsp
 
-    def perf_data(self, version: Optional[FsVersion] = None) -> Optional[PerfData]:
-        perf_data_path = self.perf_data_path(version)
-        if perf_data_path is None:
+    def perf_data(
+        self, version: Optional[FsVersion] = None, mode: PerfMode = "cpu"
+    ) -> Optional[PerfData]:
+        if version is None:
+            version = self.fs_sandbox().version()
+        key = (version, mode)
+        runs = self._perf_per_version.get(key)
+        if runs is None:
             return None
 
-        if perf_data_path not in self._perf_data_map:
-            self._perf_data_map[perf_data_path] = PerfData(perf_data_path, self._root)
-        return self._perf_data_map[perf_data_path]
+        if key not in self._perf_data_map:
+            weights = {w.name: w.weight for w in self._workloads}
+
+            def load(fraction: float) -> PerfData:
+                per_workload = {
+                    name: (
+                        PerfData.merge_repetitions(
+                            [
+                                PerfData.load(
+                                    path, self._root, mode, self._attribution, fraction
+                                )
+                                for path in paths
+                            ]
+                        ),
+                        weights.get(name, 1.0),
+                    )
+                    for name, paths in runs.items()
+                }
+                return PerfData.merge_workloads(per_workload)
+
+            recordings = [path for paths in runs.values() for path in paths]
+            size = sum(path.stat().st_size for path in recordings)
+            if (
+                mode == "cpu"
+                and size >= PROGRESSIVE_MIN_BYTES
+                and all(PerfData.subsamples_cheaply(path) for path in recordings)
+            ):
+                self._perf_data_map[key] = PerfData.load_progressive(
+                    load, PRELIMINARY_FRACTION
+                )
+            else:
+                self._perf_data_map[key] = load(1.0)
+        perf_data = self._perf_data_map[key]
+        # Preliminary profiles are stored once they're refined.
+        if self._store is not None and key not in self._stored and perf_data.is_final():
+            self._stored.add(key)
+            self._store.add_profile(
+                str(self._root),
+                self._git_commit(),
+                version,
+                version != self._fs.base_version(),
+                mode,
+                perf_data,
+                [
+                    path
+                    for paths in runs.values()
+                    for path in paths
+                    if path.parent == self._root
+                    and OWN_RECORDING_RE.fullmatch(path.name)
+                ],
+            )
+        return perf_data
+
+    def _git_commit(self) -> Optional[str]:
+        """The commit checked out in the project root, if it's a git repository."""
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=str(self._root),
+            capture_output=True,
+            text=True,
+        )
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    def profiles_final(self) -> bool:
+        """Whether every profile loaded so far is final, rather than a preliminary one
+        still being refined."""
+        return all(
+            perf_data.is_final() for perf_data in list(self._perf_data_map.values())
+        )
 
-    def perf_data_path(self, version: Optional[FsVersion] = None) -> Optional[Path]:
+    def perf_data_path(
+        self, version: Optional[FsVersion] = None, mode: PerfMode = "cpu"
+    ) -> Optional[Path]:
+        perf_data = self.perf_data(version, mode)
+        if perf_data is None:
+            return None
+        return perf_data.data_path()
+
+    def alloc_data(self, version: Optional[FsVersion] = None) -> Optional[AllocData]:
         if version is None:
             version = self.fs_sandbox().version()
-        if version not in self._perf_per_version:
+        runs = self._perf_per_version.get((version, "alloc"))
+        if runs is None:
             return None
-        perf_data_path = self._perf_per_version[version]
-        return perf_data_path
 
-    def add_perf_data(self, version: FsVersion, perf_data_path: Path) -> None:
-        self._perf_per_version[version] = perf_data_path
+        if version not in self._alloc_data_map:
+            weights = {w.name: w.weight for w in self._workloads}
+            self._alloc_data_map[version] = AllocData.merge(
+                [
+                    (
+                        AllocData.load(path, self._root),
+                        weights.get(name, 1.0) / len(paths),
+                    )
+                    for name, paths in runs.items()
+                    for path in paths
+                ]
+            )
+        return self._alloc_data_map[version]
+
+    def add_perf_data(
+        self,
+        version: FsVersion,
+        perf_data_path: Path,
+        workload: str = DEFAULT_WORKLOAD_NAME,
+        mode: ProfileMode = "cpu",
+    ) -> None:
+        runs = self._perf_per_version.setdefault((version, mode), {})
+        runs.setdefault(workload, []).append(perf_data_path)
+        if mode == "alloc":
+            self._alloc_data_map.pop(version, None)
+        else:
+            self._perf_data_map.pop((version, mode), None)
+            # Let the profile with this recording in it be stored too.
+            self._stored.discard((version, mode))
 
     def build_for_profiling(self) -> None:
         if self._lang != "rust":
@@ -83,42 +349,437 @@ class Project:
             ],
             check=True,
             cwd=str(self._root),
-            env={
-                "PATH": path_env_var,
-                "RUSTFLAGS": "-C force-unwind-tables=yes -C force-frame-pointers=yes",
-            },
+            env={"PATH": path_env_var, "RUSTFLAGS": PROFILING_RUSTFLAGS},
         )
 
-    def run_profiler(
-        self,
-    ) -> None:
+    def run_profiler(self, mode: ProfileMode = "cpu") -> None:
+        """Record every workload, or every selected bench, sampling on-CPU time or,
+        in "offcpu" mode, the time threads spend blocked, or, in "alloc" mode, every
+        heap allocation."""
         if self._lang != "rust":
             raise NotImplementedError(
                 f"Profiler run not implemented for language: {self._lang}"
             )
 
-        perf_data_path = self._root / f"perf{time.time_ns()}.data"
+        path_env_var = os.environ.get("PATH")
+        assert path_env_var is not None, "PATH environment variable is not set"
+
+        if mode == "alloc":
+            self._add_alloc_probes(path_env_var)
+
+        timestamp = time.time_ns()
+        jobs = [
+            (
+                workload,
+                self._root / f"perf{timestamp}-{mode}-{workload.name}-{rep}.data",
+            )
+            for workload in self._profiled_workloads(path_env_var)
+            for rep in range(workload.repetitions)
+        ]
+        # Leave a core per job for perf itself, which unwinds and writes samples
+        # alongside the target.
+        max_workers = max(1, min(len(jobs), (os.cpu_count() or 1) // 2))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self._record_workload, workload, perf_data_path, path_env_var, mode
+                )
+                for workload, perf_data_path in jobs
+            ]
+            for future in futures:
+                future.result()
+
+        version = self.fs_sandbox().version()
+        for workload, perf_data_path in jobs:
+            self.add_perf_data(version, perf_data_path, workload.name, mode)
+
+    def _profiled_workloads(self, path_env_var: str) -> list[Workload]:
+        """The configured workloads or, with benches selected, each bench's
+        executable, running its benchmarks without analysis."""
+        if not self._benches:
+            return self._workloads
+        env = {"PATH": path_env_var, "RUSTFLAGS": PROFILING_RUSTFLAGS}
+        return [
+            Workload(
+                name=f"bench-{bench}",
+                args=["--bench", "--profile-time", str(BENCH_PROFILE_SECS)],
+                binary=build_bench(self._root, bench, env),
+            )
+            for bench in self._benches
+        ]
+
+    def run_benches(
+        self, version: Optional[FsVersion] = None
+    ) -> dict[str, BenchEstimate]:
+        """Criterion's estimates of the selected benches by benchmark ID, run on the
+        current version once per version, or those of an earlier `version` if it
+        was run."""
+        current = self.fs_sandbox().version()
+        if version is None:
+            version = current
+        if version not in self._bench_results:
+            if version != current:
+                return {}
+            path_env_var = os.environ.get("PATH")
+            assert path_env_var is not None, "PATH environment variable is not set"
+            env = {"PATH": path_env_var, "RUSTFLAGS": PROFILING_RUSTFLAGS}
+            results = {}
+            for bench in self._benches:
+                # A baseline per bench target and version, so estimates saved by other
+                # targets or versions aren't picked up.
+                baseline = f"accelerant-{version.hash}-{bench}"
+                for estimate in run_bench(self._root, bench, baseline, env):
+                    results[estimate.id] = estimate
+            self._bench_results[version] = results
+        return self._bench_results[version]
+
+    def measurement_noise(self) -> float:
+        """How far off `measure_runtime` may be for the current version, relative to
+        its result: the widest confidence interval among the benches' estimates, or
+        0 for workloads."""
+        estimates = self.run_benches().values() if self._benches else []
+        return max((estimate.noise() for estimate in estimates), default=0.0)
+
+    def record_running(
+        self,
+        pid: Optional[int] = None,
+        cgroup: Optional[str] = None,
+        duration_secs: float = ATTACH_DURATION_SECS,
+        mode: PerfMode = "cpu",
+    ) -> Path:
+        """Record a process that's already running, or every process in a cgroup
+        (relative to the cgroup v2 root), for `duration_secs`, and add the recording
+        as a profile of the current version.
+
+        The running target must be the build of the current version, so that samples
+        are attributed to the source it was built from; otherwise this raises
+        ValueError. Returns the path of the recording.
+        """
+        if (pid is None) == (cgroup is None):
+            raise ValueError("give exactly one of pid and cgroup")
 
         path_env_var = os.environ.get("PATH")
         assert path_env_var is not None, "PATH environment variable is not set"
 
+        self.build_for_profiling()
+        expected = build_id(self._root / self._target_binary)
+        if pid is not None:
+            pids = [pid]
+            target_args = [*self._profiler_event_args(mode), "-p", str(pid)]
+            workload = f"pid-{pid}"
+        else:
+            assert cgroup is not None
+            pids = self._cgroup_target_pids(cgroup)
+            if not pids:
+                raise ValueError(f"no process in cgroup {cgroup} runs the target")
+            target_args = ["-a", *self._cgroup_event_args(mode, cgroup)]
+            workload = f"cgroup-{cgroup.strip('/').replace('/', '-')}"
+        for running_pid in pids:
+            running = build_id(Path(f"/proc/{running_pid}/exe"))
+            if running != expected:
+                raise ValueError(
+                    f"process {running_pid} runs build {running}, but the current"
+                    f" version of {self._target_binary} is build {expected}"
+                )
+
+        perf_data_path = self._root / f"perf{time.time_ns()}-{mode}-{workload}.data"
         subprocess.run(
             [
                 "perf",
                 "record",
-                "-F997",
+                *target_args,
                 "--call-graph",
-                "dwarf",
+                CALL_GRAPH,
+                "--sample-cpu",
                 "-o",
                 str(perf_data_path),
-                str(self._target_binary),
+                "--",
+                "sleep",
+                str(duration_secs),
             ],
             check=True,
             cwd=str(self._root),
             env={"PATH": path_env_var},
         )
+        self.add_perf_data(self.fs_sandbox().version(), perf_data_path, workload, mode)
+        return perf_data_path
+
+    def _cgroup_event_args(self, mode: PerfMode, cgroup: str) -> list[str]:
+        """Like `_profiler_event_args`, but counting only processes in a cgroup."""
+        if mode == "offcpu":
+            return ["-e", "sched:sched_switch", "-G", cgroup, "--switch-events"]
+        events = self._events or ["cycles"]
+        # `-G` takes one cgroup per event.
+        cgroups = ",".join([cgroup] * len(events))
+        return ["-e", ",".join(events), "-G", cgroups, *PROFILER_EVENT_ARGS[mode]]
+
+    def _cgroup_target_pids(self, cgroup: str) -> list[int]:
+        """Processes in a cgroup or its descendants that run the target binary."""
+        cgroup_dir = Path("/sys/fs/cgroup") / cgroup.strip("/")
+        if not cgroup_dir.is_dir():
+            raise ValueError(f"no cgroup {cgroup}")
+        pids = []
+        for procs in cgroup_dir.rglob("cgroup.procs"):
+            for line in procs.read_text().split():
+                try:
+                    exe = os.readlink(f"/proc/{line}/exe")
+                except OSError:
+                    # Exited since, or not ours to inspect.
+                    continue
+                if (
+                    Path(exe.removesuffix(" (deleted)")).name
+                    == self._target_binary.name
+                ):
+                    pids.append(int(line))
+        return pids
+
+    def measure_runtime(self, runs: int = 3) -> float:
+        """Build the current version and time every workload, without a profiler.
+
+        Returns the sum over workloads of the fastest of `runs` runs, in seconds,
+        scaled by each workload's weight. With benches selected, returns the
+        geometric mean of their benchmarks' mean times instead, so that halving any
+        benchmark's time counts the same. Measured once per version.
+        """
         version = self.fs_sandbox().version()
-        self.add_perf_data(version, perf_data_path)
+        if version in self._runtimes:
+            return self._runtimes[version]
+        total = self._bench_objective() if self._benches else self._time_workloads(runs)
+        self._runtimes[version] = total
+        if self._store is not None:
+            self._store.add_runtime(
+                str(self._root),
+                self._git_commit(),
+                version,
+                version != self._fs.base_version(),
+                total,
+            )
+        return total
+
+    def _time_workloads(self, runs: int) -> float:
+        self.build_for_profiling()
+        return self.time_binary(self._target_binary, runs)
+
+    def time_binary(
+        self, binary: Path, runs: int = 3, env: Optional[dict[str, str]] = None
+    ) -> float:
+        """Time every workload on a build of the target, like `measure_runtime`, with
+        `env` added to each workload's environment."""
+        path_env_var = os.environ.get("PATH")
+        assert path_env_var is not None, "PATH environment variable is not set"
+        total = 0.0
+        # One run at a time, so that workloads don't compete for cores.
+        for workload in self._workloads:
+            workload = replace(
+                workload, binary=binary, env={**workload.env, **(env or {})}
+            )
+            fastest = float("inf")
+            for _ in range(runs):
+                start = time.perf_counter()
+                self._run_workload(workload, [], path_env_var, subprocess.DEVNULL)
+                fastest = min(fastest, time.perf_counter() - start)
+            total += workload.weight * fastest
+        return total
+
+    def build_release(
+        self, cargo_args: list[str], rustflags: str, target_dir: Path
+    ) -> Path:
+        """Build the current version in release mode into `target_dir`, with extra
+        cargo arguments and rustflags, and return the target binary's path there."""
+        path_env_var = os.environ.get("PATH")
+        assert path_env_var is not None, "PATH environment variable is not set"
+        subprocess.run(
+            [
+                "cargo",
+                "build",
+                "--release",
+                "--target-dir",
+                str(target_dir),
+                *cargo_args,
+            ],
+            check=True,
+            cwd=str(self._root),
+            env={"PATH": path_env_var, "RUSTFLAGS": rustflags},
+            stdout=subprocess.DEVNULL,
+        )
+        default_target_dir = self._root / "target"
+        return target_dir / (self._root / self._target_binary).relative_to(
+            default_target_dir
+        )
+
+    def _bench_objective(self) -> float:
+        estimates = self.run_benches().values()
+        if not estimates:
+            raise RuntimeError(f"benches {self._benches} produced no estimates")
+        return math.exp(
+            fmean(math.log(estimate.mean_ns / 1e9) for estimate in estimates)
+        )
+
+    def live_profile(self) -> Optional[LiveProfile]:
+        return self._live_profile
+
+    def live_profile_version(self) -> Optional[FsVersion]:
+        """The version the live-profiled target was built from."""
+        return self._live_version
+
+    def start_live_profiling(self) -> LiveProfile:
+        """Build the current version and (re)start the target on its first workload,
+        profiling it live until `stop_live_profiling`."""
+        if self._lang != "rust":
+            raise NotImplementedError(
+                f"Live profiling not implemented for language: {self._lang}"
+            )
+
+        self.stop_live_profiling()
+        path_env_var = os.environ.get("PATH")
+        assert path_env_var is not None, "PATH environment variable is not set"
+        self.build_for_profiling()
+
+        self._live_target = self._start_workload(
+            self._workloads[0], [], path_env_var, subprocess.DEVNULL
+        )
+        self._live_profile = start_live_profile(
+            self._live_target.pid,
+            str(self._root),
+            self._attribution,
+            LIVE_WINDOW_SECS,
+            LIVE_BUCKET_SECS,
+            CALL_GRAPH,
+        )
+        self._live_version = self.fs_sandbox().version()
+        return self._live_profile
+
+    def check_live_target(self) -> None:
+        """Raise CalledProcessError if the live-profiled target exited with an error,
+        like a workload run would."""
+        if self._live_target is None:
+            return
+        returncode = self._live_target.poll()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, self._live_target.args)
+
+    def stop_live_profiling(self) -> None:
+        """Stop the live profile, if any, and the target it was profiling."""
+        if self._live_profile is not None:
+            self._live_profile.stop()
+            self._live_profile = None
+        if self._live_target is not None:
+            self._live_target.terminate()
+            try:
+                self._live_target.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._live_target.kill()
+                self._live_target.wait()
+            self._live_target = None
+        self._live_version = None
+
+    def _add_alloc_probes(self, path_env_var: str) -> None:
+        libc_path = self._find_linked_library("libc.so")
+        # Replace probes left over from an earlier run, which may point at another libc.
+        subprocess.run(
+            ["perf", "probe", "--quiet", "--del", "accelerant:*"],
+            cwd=str(self._root),
+            env={"PATH": path_env_var},
+            capture_output=True,
+        )
+        for probe in ALLOC_PROBES:
+            subprocess.run(
+                ["perf", "probe", "--quiet", "-x", str(libc_path), "--add", probe],
+                check=True,
+                cwd=str(self._root),
+                env={"PATH": path_env_var},
+            )
+
+    def _find_linked_library(self, name: str) -> Path:
+        result = subprocess.run(
+            ["ldd", str(self._target_binary)],
+            check=True,
+            cwd=str(self._root),
+            capture_output=True,
+            text=True,
+        )
+        # Lines look like `libc.so.6 => /lib/x86_64-linux-gnu/libc.so.6 (0x...)`.
+        for line in result.stdout.splitlines():
+            soname, _, rest = line.strip().partition(" => ")
+            if soname.startswith(name) and rest:
+                return Path(rest.split(" (")[0])
+        raise RuntimeError(f"{self._target_binary} is not dynamically linked to {name}")
+
+    def _profiler_event_args(self, mode: ProfileMode) -> list[str]:
+        if mode == "cpu" and self._events:
+            return ["-e", ",".join(self._events), *PROFILER_EVENT_ARGS[mode]]
+        return PROFILER_EVENT_ARGS[mode]
+
+    def _record_workload(
+        self,
+        workload: Workload,
+        perf_data_path: Path,
+        path_env_var: str,
+        mode: ProfileMode,
+    ) -> None:
+        self._run_workload(
+            workload,
+            [
+                "perf",
+                "record",
+                *self._profiler_event_args(mode),
+                "--call-graph",
+                CALL_GRAPH,
+                "--sample-cpu",
+                "-o",
+                str(perf_data_path),
+            ],
+            path_env_var,
+        )
+
+    def run_workload(
+        self, workload: Workload, wrapper: Optional[list[str]] = None
+    ) -> None:
+        """Run a workload once, under `wrapper` if given, discarding its output."""
+        path_env_var = os.environ.get("PATH")
+        assert path_env_var is not None, "PATH environment variable is not set"
+        self._run_workload(workload, wrapper or [], path_env_var, subprocess.DEVNULL)
+
+    def _run_workload(
+        self,
+        workload: Workload,
+        wrapper: list[str],
+        path_env_var: str,
+        stdout: Optional[int] = None,
+    ) -> None:
+        """Run the target binary on a workload, under `wrapper` if not empty."""
+        process = self._start_workload(workload, wrapper, path_env_var, stdout)
+        returncode = process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, process.args)
+
+    def _start_workload(
+        self,
+        workload: Workload,
+        wrapper: list[str],
+        path_env_var: str,
+        stdout: Optional[int] = None,
+    ) -> subprocess.Popen:
+        """Start the target binary on a workload, under `wrapper` if not empty,
+        without waiting for it."""
+        stdin_file = (
+            open(self._root / workload.stdin_path, "rb")
+            if workload.stdin_path is not None
+            else None
+        )
+        binary = workload.binary or self._target_binary
+        try:
+            return subprocess.Popen(
+                [*wrapper, str(binary), *workload.args],
+                cwd=str(self._root),
+                env={"PATH": path_env_var, **workload.env},
+                stdin=stdin_file if stdin_file is not None else subprocess.DEVNULL,
+                stdout=stdout,
+            )
+        finally:
+            # The child has its own copy of the file descriptor.
+            if stdin_file is not None:
+                stdin_file.close()
 
     def fs_sandbox(self) -> FsSandbox:
         return self._fs
@@ -0,0 +1,213 @@
+import json
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional
+
+from agents import (
+    AgentOutputSchemaBase,
+    Handoff,
+    Model,
+    ModelProvider,
+    ModelResponse,
+    ModelSettings,
+    ModelTracing,
+    MultiProvider,
+    Tool,
+    TResponseInputItem,
+    Usage,
+    generation_span,
+)
+from agents.items import TResponseStreamEvent
+from openai.types.responses import ResponseOutputItem
+from openai.types.responses.response_prompt_param import ResponsePromptParam
+from pydantic import TypeAdapter
+
+# A recording is a JSONL file with one line per model call:
+#
+#   {"output": [...], "usage": {...}, "tool_outputs": {"call_id": "...", ...}}
+#
+# `output` holds the response items in OpenAI Responses format, tool calls included.
+# `tool_outputs` holds what the tools called in the previous response returned, so
+# a replay can tell when the tools no longer behave as they did when recording.
+
+_OUTPUT_ITEM: TypeAdapter[ResponseOutputItem] = TypeAdapter(ResponseOutputItem)
+
+
+def _tool_calls(output: list[dict]) -> list[str]:
+    return [item["call_id"] for item in output if item.get("type") == "function_call"]
+
+
+def _tool_outputs(
+    input: str | list[TResponseInputItem], call_ids: list[str]
+) -> dict[str, str]:
+    if isinstance(input, str):
+        return {}
+    outputs = {}
+    for item in input:
+        if not isinstance(item, dict) or item.get("type") != "function_call_output":
+            continue
+        call_id = item.get("call_id")
+        if call_id in call_ids:
+            output = item.get("output")
+            outputs[call_id] = output if isinstance(output, str) else json.dumps(output)
+    return outputs
+
+
+class _Recording:
+    path: Path
+    prev_calls: list[str]
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.prev_calls = []
+        path.write_text("")
+
+    def append(
+        self, input: str | list[TResponseInputItem], response: ModelResponse
+    ) -> None:
+        output = [item.model_dump(mode="json") for item in response.output]
+        call = {
+            "output": output,
+            "usage": {
+                "requests": response.usage.requests,
+                "input_tokens": response.usage.input_tokens,
+                "output_tokens": response.usage.output_tokens,
+                "total_tokens": response.usage.total_tokens,
+            },
+            "tool_outputs": _tool_outputs(input, self.prev_calls),
+        }
+        # Append as we go so that a crashed run still leaves a usable prefix.
+        with open(self.path, "a") as f:
+            f.write(json.dumps(call) + "\n")
+        self.prev_calls = _tool_calls(output)
+
+
+class RecordingModel(Model):
+    """Wraps a live model, saving each of its responses to a recording."""
+
+    _model: Model
+    _recording: _Recording
+
+    def __init__(self, model: Model, recording: _Recording) -> None:
+        self._model = model
+        self._recording = recording
+
+    async def get_response(
+        self,
+        system_instructions: Optional[str],
+        input: str | list[TResponseInputItem],
+        model_settings: ModelSettings,
+        tools: list[Tool],
+        output_schema: Optional[AgentOutputSchemaBase],
+        handoffs: list[Handoff],
+        tracing: ModelTracing,
+        *,
+        previous_response_id: Optional[str],
+        conversation_id: Optional[str],
+        prompt: Optional[ResponsePromptParam],
+    ) -> ModelResponse:
+        response = await self._model.get_response(
+            system_instructions,
+            input,
+            model_settings,
+            tools,
+            output_schema,
+            handoffs,
+            tracing,
+            previous_response_id=previous_response_id,
+            conversation_id=conversation_id,
+            prompt=prompt,
+        )
+        self._recording.append(input, response)
+        return response
+
+    def stream_response(
+        self, *args: Any, **kwargs: Any
+    ) -> AsyncIterator[TResponseStreamEvent]:
+        raise NotImplementedError("streamed runs can't be recorded")
+
+
+class RecordingModelProvider(ModelProvider):
+    """Serves live models, like the default provider, and records their responses."""
+
+    _provider: ModelProvider
+    _recording: _Recording
+
+    def __init__(self, path: Path) -> None:
+        self._provider = MultiProvider()
+        self._recording = _Recording(path)
+
+    def get_model(self, model_name: Optional[str]) -> Model:
+        return RecordingModel(self._provider.get_model(model_name), self._recording)
+
+
+class ReplayModel(Model):
+    """Serves the responses of a recording in order, without calling any model.
+
+    Tools still run for real, so replaying a session against the project it was
+    recorded on exercises the same builds, profiler runs and LSP queries.
+    """
+
+    _path: Path
+    _calls: list[dict]
+    _next: int
+    diverged_calls: int
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        with open(path) as f:
+            self._calls = [json.loads(line) for line in f if line.strip()]
+        self._next = 0
+        self.diverged_calls = 0
+
+    async def get_response(
+        self,
+        system_instructions: Optional[str],
+        input: str | list[TResponseInputItem],
+        model_settings: ModelSettings,
+        tools: list[Tool],
+        output_schema: Optional[AgentOutputSchemaBase],
+        handoffs: list[Handoff],
+        tracing: ModelTracing,
+        *,
+        previous_response_id: Optional[str],
+        conversation_id: Optional[str],
+        prompt: Optional[ResponsePromptParam],
+    ) -> ModelResponse:
+        if self._next >= len(self._calls):
+            raise RuntimeError(
+                f"{self._path} has no response left for model call {self._next + 1}"
+            )
+        call = self._calls[self._next]
+        if self._next > 0 and "tool_outputs" in call:
+            prev_calls = _tool_calls(self._calls[self._next - 1]["output"])
+            if _tool_outputs(input, prev_calls) != call["tool_outputs"]:
+                self.diverged_calls += 1
+        self._next += 1
+        # Report the recorded usage, so that traces of replays count tokens too.
+        with generation_span(
+            model=f"replay:{self._path.name}",
+            usage=call.get("usage"),
+            disabled=tracing.is_disabled(),
+        ):
+            return ModelResponse(
+                output=[_OUTPUT_ITEM.validate_python(item) for item in call["output"]],
+                usage=Usage(**call.get("usage", {})),
+                response_id=None,
+            )
+
+    def stream_response(
+        self, *args: Any, **kwargs: Any
+    ) -> AsyncIterator[TResponseStreamEvent]:
+        raise NotImplementedError("streamed runs can't be replayed")
+
+
+class ReplayModelProvider(ModelProvider):
+    """Serves one recording for whatever model the agent asks for."""
+
+    model: ReplayModel
+
+    def __init__(self, path: Path) -> None:
+        self.model = ReplayModel(path)
+
+    def get_model(self, model_name: Optional[str]) -> Model:
+        return self.model
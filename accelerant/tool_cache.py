@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Hashable, Optional
+
+from accelerant.fs_sandbox import FsSandbox
+
+
+@dataclass
+class _Entry:
+    result: Any
+    # Content hash of each file the result was derived from, or None for results that
+    # any edit can change.
+    deps: Optional[dict[Path, Optional[str]]]
+
+
+@dataclass
+class ToolCacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+
+class ToolCache:
+    """Results of read-only agent tools, reused until the files they came from change.
+
+    Entries are keyed by tool name and arguments, and remember the content hashes of
+    the files they depend on. Writes through the sandbox evict the entries that
+    depend on the written file.
+    """
+
+    _fs: FsSandbox
+    _entries: dict[tuple[str, Hashable], _Entry]
+    _stats: dict[str, ToolCacheStats]
+
+    def __init__(self, fs: FsSandbox) -> None:
+        self._fs = fs
+        self._entries = {}
+        self._stats = {}
+        fs.add_write_listener(self.invalidate)
+
+    def lookup(self, tool: str, args: Hashable) -> tuple[bool, Any]:
+        stats = self._stats.setdefault(tool, ToolCacheStats())
+        entry = self._entries.get((tool, args))
+        if entry is None or not self._is_fresh(entry):
+            stats.misses += 1
+            return False, None
+        stats.hits += 1
+        return True, entry.result
+
+    def store(
+        self, tool: str, args: Hashable, result: Any, deps: Optional[list[str]]
+    ) -> None:
+        """Remember a result derived from the files in `deps`, or from the whole
+        tree if `deps` is None."""
+        self._entries[(tool, args)] = _Entry(
+            result,
+            None
+            if deps is None
+            else {Path(dep): self._fs.content_hash(Path(dep)) for dep in deps},
+        )
+
+    def invalidate(self, relpath: Path) -> None:
+        self._entries = {
+            key: entry
+            for key, entry in self._entries.items()
+            if entry.deps is not None and relpath not in entry.deps
+        }
+
+    def stats(self) -> dict[str, ToolCacheStats]:
+        return self._stats
+
+    def _is_fresh(self, entry: _Entry) -> bool:
+        if entry.deps is None:
+            return True
+        return all(
+            self._fs.content_hash(path) == content_hash
+            for path, content_hash in entry.deps.items()
+        )
@@ -1,24 +1,87 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import functools
+import inspect
 from itertools import islice
 from pathlib import Path
 import shutil
 import subprocess
-from typing import Optional
+import time
+from typing import Any, Callable, Optional, TypeVar
 from agents import RunContextWrapper, ToolOutputImage, function_tool
 from llm_utils import number_group_of_lines
 from perfparser import LineLoc
 
 from accelerant.chat_interface import CodeSuggestion
+from accelerant.disasm import Instruction, annotate, load_disassembly
 from accelerant.flamegraph import make_flamegraph_png, png_to_data_url
 from accelerant.lsp import TOP_LEVEL_SYMBOL_KINDS, uri_to_relpath
-from accelerant.perf import PerfData
-from accelerant.util import find_symbol, truncate_for_llm
+from accelerant.perf import AllocData, PerfData, PerfMode
+from accelerant.util import (
+    custom_number_group_of_lines,
+    find_symbol,
+    truncate_for_llm,
+)
 from accelerant.project import Project
+from accelerant.tool_cache import ToolCache
 
 
 @dataclass
 class AgentContext:
     project: Project
+    tool_cache: ToolCache = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.tool_cache = ToolCache(self.project.fs_sandbox())
+
+
+T = TypeVar("T")
+
+
+def _memoize_tool(
+    depends_on: Callable[[dict, Any], Optional[list[str]]],
+) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Serve repeated calls of a read-only tool from the context's `tool_cache`.
+
+    `depends_on` gets the call's arguments and result, and returns the files the
+    result was derived from, or None if editing any file could change it.
+    """
+
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(ctx: RunContextWrapper[AgentContext], *args, **kwargs) -> T:
+            call_args = signature.bind(ctx, *args, **kwargs).arguments
+            del call_args["ctx"]
+            key = tuple(sorted(call_args.items()))
+            cache = ctx.context.tool_cache
+            hit, result = cache.lookup(func.__name__, key)
+            if hit:
+                return result
+            result = func(ctx, *args, **kwargs)
+            # Results derived from preliminary profiles go stale once they're refined.
+            if ctx.context.project.profiles_final():
+                cache.store(func.__name__, key, result, depends_on(call_args, result))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _apply_suggestion(text: str, sugg: CodeSuggestion) -> str:
+    start = text.find(sugg.old_code)
+    if start == -1:
+        raise ValueError(
+            f"Old code snippet not found in {sugg.filename} when applying suggestion."
+        )
+    # Looking for a second match from just past the first's start stops the scan
+    # early, unlike counting every match.
+    if text.find(sugg.old_code, start + 1) != -1:
+        raise ValueError(
+            f"Old code snippet is not unique in {sugg.filename} when applying suggestion."
+        )
+    return text[:start] + sugg.new_code + text[start + len(sugg.old_code) :]
 
 
 @function_tool
@@ -35,28 +98,56 @@ def edit_code(
     fs = project.fs_sandbox()
 
     abspath = Path(project._root, sugg.filename)
-    old_text = fs.read_file(abspath)
-    count = old_text.count(sugg.old_code)
-    if count == 0:
-        raise ValueError(
-            f"Old code snippet not found in {sugg.filename} when applying suggestion."
-        )
-    elif count > 1:
-        raise ValueError(
-            f"Old code snippet is not unique in {sugg.filename} when applying suggestion."
-        )
-    new_text = old_text.replace(sugg.old_code, sugg.new_code)
+    new_text = _apply_suggestion(fs.read_file(abspath), sugg)
     fs.write_file(Path(abspath), new_text)
 
 
 @function_tool
-def check_codebase_for_errors(
+def edit_code_batch(
     ctx: RunContextWrapper[AgentContext],
+    suggs: list[CodeSuggestion],
 ) -> str:
-    """Check the codebase for errors using the appropriate build tool."""
-    assert ctx.context.project._lang == "rust", (
-        "Only Rust is supported for code checking"
-    )
+    """Apply several code suggestions, possibly across files, as one change, then check and build the codebase once. If any suggestion doesn't apply, or the result doesn't build, none of them are kept.
+
+    Args:
+        suggs: The code suggestions to apply, in order. Each old code snippet must be unique within its file once the earlier suggestions for that file are applied.
+    """
+    project = ctx.context.project
+    fs = project.fs_sandbox()
+
+    new_texts: dict[Path, str] = {}
+    errors = []
+    for i, sugg in enumerate(suggs):
+        abspath = Path(project._root, sugg.filename)
+        if abspath not in new_texts:
+            new_texts[abspath] = fs.read_file(abspath)
+        try:
+            new_texts[abspath] = _apply_suggestion(new_texts[abspath], sugg)
+        except ValueError as e:
+            errors.append(f"suggestion {i}: {e}")
+    if errors:
+        raise ValueError(
+            "No suggestions were applied, because some don't apply:\n"
+            + "\n".join(errors)
+        )
+
+    old_texts = {abspath: fs.read_file(abspath) for abspath in new_texts}
+    fs.write_files(new_texts)
+    error = _check_codebase(project)
+    if error is None:
+        try:
+            project.build_for_profiling()
+        except subprocess.CalledProcessError as e:
+            error = f"ERROR: Build failed:\n\n{e}"
+    if error is not None:
+        fs.write_files(old_texts)
+        return f"{error}\n\nAll {len(suggs)} suggestions were rolled back."
+    return f"OK: Applied {len(suggs)} suggestions; the codebase builds."
+
+
+def _check_codebase(project: Project) -> Optional[str]:
+    """An error message if the codebase doesn't pass `cargo check`, else None."""
+    assert project._lang == "rust", "Only Rust is supported for code checking"
 
     cargo_path = shutil.which("cargo")
     assert cargo_path is not None, "cargo not found in PATH"
@@ -64,52 +155,131 @@ def check_codebase_for_errors(
         subprocess.run(
             [cargo_path, "check", "--all-targets"],
             check=True,
-            cwd=str(ctx.context.project._root),
+            cwd=str(project._root),
         )
     except subprocess.CalledProcessError as e:
         return f"ERROR: Codebase has errors:\n\n{e}"
+    return None
+
+
+@function_tool
+def check_codebase_for_errors(
+    ctx: RunContextWrapper[AgentContext],
+) -> str:
+    """Check the codebase for errors using the appropriate build tool."""
+    error = _check_codebase(ctx.context.project)
+    if error is not None:
+        return error
     return "OK: Codebase has no errors!"
 
 
-def _shared_build_and_run_perf(project: Project) -> PerfData:
+def _shared_build_and_run_perf(project: Project, mode: PerfMode = "cpu") -> PerfData:
     version = project.fs_sandbox().version()
-    perf_data = project.perf_data(version)
+    perf_data = project.perf_data(version, mode)
     if perf_data is None:
         project.build_for_profiling()
-        project.run_profiler()
-        perf_data = project.perf_data(version)
+        project.run_profiler(mode)
+        perf_data = project.perf_data(version, mode)
     assert perf_data is not None, "perf data should be available after profiling"
     return perf_data
 
 
+def _select_workload(perf_data: PerfData, workload: Optional[str]) -> PerfData:
+    if workload is not None:
+        if workload not in perf_data.workloads():
+            raise ValueError(f"unknown workload {workload}")
+        return perf_data.workloads()[workload]
+    elif len(perf_data.workloads()) > 1:
+        raise ValueError(
+            f"several workloads were profiled; pick one of {list(perf_data.workloads())}"
+        )
+    return perf_data
+
+
+def _get_parent_region(project: Project, loc: LineLoc) -> Optional[str]:
+    parent_sym = project.lsp().syncexec(
+        project.lsp().request_nearest_parent_symbol(
+            loc.path, loc.line - 1, TOP_LEVEL_SYMBOL_KINDS
+        ),
+    )
+    if parent_sym is None:
+        return None
+    return parent_sym["name"]
+
+
 @function_tool
 def run_perf_profiler(
     ctx: RunContextWrapper[AgentContext],
+    event: Optional[str] = None,
 ) -> list[dict]:
-    """Run a performance profiler on the target binary and return the top hotspots."""
+    """Run a performance profiler on the target binary and return the top hotspots.
+
+    If several hardware events were recorded, each hotspot also shows its share of
+    every event, and cache and branch misses per thousand instructions. Hotspots in
+    code the compiler inlined list the call sites it was inlined at. For very large
+    recordings, the first call may rank hotspots from a subsample of the events,
+    giving a 95% confidence interval for each one's share of the time; later calls
+    give exact numbers once the whole recording is attributed.
+
+    Args:
+        event: The recorded event to rank hotspots by, like "cache-misses".
+            Defaults to cycles.
+    """
     project = ctx.context.project
     perf_data = _shared_build_and_run_perf(project)
-    perf_tabulated = perf_data.tabulate()
+    perf_tabulated = perf_data.tabulate(event)
+    event_kinds = perf_data.event_kinds()
     NUM_HOTSPOTS = 5
-
-    def get_parent_region(loc: LineLoc) -> Optional[str]:
-        parent_sym = project.lsp().syncexec(
-            project.lsp().request_nearest_parent_symbol(
-                loc.path, loc.line - 1, TOP_LEVEL_SYMBOL_KINDS
-            ),
-        )
-        if parent_sym is None:
-            return None
-        return parent_sym["name"]
+    NUM_CALL_SITES = 3
+
+    def describe_hotspot(loc: LineLoc, pct_time: float) -> dict:
+        hotspot = {
+            "parent_region": _get_parent_region(project, loc) or "<unknown>",
+            "loc": loc,
+            "pct_time": round(pct_time * 100, 1),
+        }
+        if not perf_data.is_final():
+            error = perf_data.pct_time_error(pct_time, event)
+            hotspot["pct_time_ci"] = [
+                round(max(pct_time - error, 0.0) * 100, 1),
+                round(min(pct_time + error, 1.0) * 100, 1),
+            ]
+            if (refine_error := perf_data.refine_error()) is not None:
+                hotspot["preliminary"] = (
+                    "only a subsample of the profile could be attributed:"
+                    f" {refine_error}"
+                )
+        if inlined_into := perf_data.inlined_into(loc, event)[:NUM_CALL_SITES]:
+            hotspot["inlined_into"] = [
+                {"loc": site, "pct_time": round(pct * 100, 1)}
+                for site, pct in inlined_into
+            ]
+        if len(perf_data.workloads()) > 1:
+            hotspot["pct_time_by_workload"] = {
+                name: round((pct or 0.0) * 100, 1)
+                for name, pct in perf_data.lookup_pct_time_by_workload(
+                    loc, event
+                ).items()
+            }
+        if len(event_kinds) > 1:
+            hotspot["pct_by_event"] = {
+                kind: round((perf_data.lookup_pct_time(loc, kind) or 0.0) * 100, 1)
+                for kind in event_kinds
+            }
+            if "instructions" in event_kinds:
+                hotspot["per_kilo_instruction"] = {
+                    kind: round(mpki, 2)
+                    for kind in event_kinds
+                    if kind.endswith("-misses")
+                    and (mpki := perf_data.lookup_per_kilo_instruction(loc, kind))
+                    is not None
+                }
+        return hotspot
 
     hotspots = list(
         islice(
             map(
-                lambda x: {
-                    "parent_region": get_parent_region(x[0]) or "<unknown>",
-                    "loc": x[0],
-                    "pct_time": round(x[1] * 100, 1),
-                },
+                lambda x: describe_hotspot(x[0], x[1]),
                 filter(lambda x: x[0].line > 0, perf_tabulated),
             ),
             NUM_HOTSPOTS,
@@ -118,6 +288,242 @@ def run_perf_profiler(
     return hotspots
 
 
+@function_tool
+def get_live_hotspots(
+    ctx: RunContextWrapper[AgentContext],
+    restart: bool = False,
+) -> dict:
+    """Profile the long-running target binary as it runs, and return the top hotspots over the last few seconds.
+
+    The target is started on the first call and keeps running between calls, so
+    later calls see its current behaviour, e.g. once caches have warmed up. Edits only
+    take effect once it's restarted.
+
+    Args:
+        restart: Rebuild the target with the current edits and restart it first.
+    """
+    project = ctx.context.project
+    NUM_HOTSPOTS = 5
+    WARMUP_SECS = 5
+
+    live_profile = project.live_profile()
+    if live_profile is None or restart:
+        live_profile = project.start_live_profiling()
+        time.sleep(WARMUP_SECS)
+    project.check_live_target()
+    hotspots = [
+        {
+            "parent_region": _get_parent_region(project, loc) or "<unknown>",
+            "loc": loc,
+            "pct_time": round(pct_time * 100, 1),
+        }
+        for loc, pct_time in live_profile.top_lines(NUM_HOTSPOTS * 2)
+        if loc.line > 0
+    ][:NUM_HOTSPOTS]
+    return {
+        "window_secs": live_profile.covered_ns / 1e9,
+        "target_running": live_profile.is_running(),
+        "includes_current_edits": project.live_profile_version()
+        == project.fs_sandbox().version(),
+        "hotspots": hotspots,
+    }
+
+
+@function_tool
+def run_benchmarks(
+    ctx: RunContextWrapper[AgentContext],
+) -> list[dict]:
+    """Run the project's selected criterion benchmarks on the current code, and return each benchmark's mean time per iteration with its 95% confidence interval and its change from the original code. These benchmarks are what your edits are judged by."""
+    project = ctx.context.project
+    fs = project.fs_sandbox()
+    estimates = project.run_benches()
+    baseline = project.run_benches(fs.base_version())
+
+    results = []
+    for bench_id, estimate in estimates.items():
+        result: dict = {
+            "benchmark": bench_id,
+            "mean_ns": round(estimate.mean_ns, 1),
+            "mean_ns_ci": [round(estimate.lower_ns, 1), round(estimate.upper_ns, 1)],
+        }
+        if bench_id in baseline:
+            change = estimate.mean_ns / baseline[bench_id].mean_ns - 1.0
+            result["pct_change_from_original"] = round(change * 100, 1)
+        results.append(result)
+    return results
+
+
+@function_tool
+def run_offcpu_profiler(
+    ctx: RunContextWrapper[AgentContext],
+) -> list[dict]:
+    """Profile where the target binary's threads block off-CPU (waiting on locks, syscalls or I/O) and return the lines with the most blocked wall-clock time, next to their share of CPU time if the CPU profiler has been run."""
+    project = ctx.context.project
+    offcpu_data = _shared_build_and_run_perf(project, "offcpu")
+    cpu_data = project.perf_data()
+    NUM_HOTSPOTS = 5
+
+    hotspots = []
+    for loc, pct_blocked in offcpu_data.tabulate():
+        if loc.line <= 0:
+            continue
+        blocked_ns = offcpu_data.total_hits() * pct_blocked
+        hotspot: dict = {
+            "parent_region": _get_parent_region(project, loc) or "<unknown>",
+            "loc": loc,
+            "blocked_ms": round(blocked_ns / 1e6, 1),
+            "pct_blocked_time": round(pct_blocked * 100, 1),
+        }
+        if cpu_data is not None:
+            hotspot["pct_cpu_time"] = round(
+                (cpu_data.lookup_pct_time(loc) or 0.0) * 100, 1
+            )
+        hotspots.append(hotspot)
+        if len(hotspots) == NUM_HOTSPOTS:
+            break
+    return hotspots
+
+
+def _shared_build_and_run_alloc_profiler(project: Project) -> AllocData:
+    version = project.fs_sandbox().version()
+    alloc_data = project.alloc_data(version)
+    if alloc_data is None:
+        project.build_for_profiling()
+        project.run_profiler("alloc")
+        alloc_data = project.alloc_data(version)
+    assert alloc_data is not None, "alloc data should be available after profiling"
+    return alloc_data
+
+
+@function_tool
+def get_top_allocating_lines(
+    ctx: RunContextWrapper[AgentContext], by_count: bool = False
+) -> list[dict]:
+    """Profile heap allocations of the target binary and return the lines of the project that allocate the most, with bytes and number of allocations.
+
+    Args:
+        by_count: Rank lines by number of allocations instead of bytes allocated.
+    """
+    project = ctx.context.project
+    alloc_data = _shared_build_and_run_alloc_profiler(project)
+    NUM_HOTSPOTS = 10
+
+    hotspots = []
+    for loc, num_bytes, count in alloc_data.tabulate(by_count):
+        if loc.line <= 0:
+            continue
+        hotspots.append(
+            {
+                "parent_region": _get_parent_region(project, loc) or "<unknown>",
+                "loc": loc,
+                "bytes": num_bytes,
+                "allocations": count,
+                "pct_bytes": round(
+                    num_bytes / max(alloc_data.total_bytes(), 1) * 100, 1
+                ),
+                "pct_allocations": round(
+                    count / max(alloc_data.total_count(), 1) * 100, 1
+                ),
+            }
+        )
+        if len(hotspots) == NUM_HOTSPOTS:
+            break
+    return hotspots
+
+
+@function_tool
+def compare_workloads(
+    ctx: RunContextWrapper[AgentContext],
+) -> list[dict]:
+    """Compare the profiled cost of each workload in the current version of the code against the original code, so that regressions on any single input are visible."""
+    project = ctx.context.project
+    perf_data = _shared_build_and_run_perf(project)
+    baseline = project.perf_data(project.fs_sandbox().base_version())
+
+    results = []
+    for name, workload_perf in perf_data.workloads().items():
+        result: dict = {"workload": name, "cycles": workload_perf.total_hits()}
+        baseline_perf = baseline.workloads().get(name) if baseline else None
+        if baseline_perf is not None and baseline_perf.total_hits() > 0:
+            result["baseline_cycles"] = baseline_perf.total_hits()
+            result["pct_change"] = round(
+                (workload_perf.total_hits() / baseline_perf.total_hits() - 1) * 100,
+                1,
+            )
+        results.append(result)
+    return results
+
+
+@function_tool
+def get_profile_phases(
+    ctx: RunContextWrapper[AgentContext], workload: Optional[str] = None
+) -> list[dict]:
+    """Split the profiled run into phases with distinct hotspots (e.g. loading, indexing, querying) and return the top lines of each phase.
+
+    Args:
+        workload: The workload whose run to split. Required when several workloads are configured.
+    """
+    project = ctx.context.project
+    perf_data = _select_workload(_shared_build_and_run_perf(project), workload)
+
+    NUM_LINES_PER_PHASE = 3
+    total_hits = perf_data.total_hits()
+    return [
+        {
+            "phase": phase.index,
+            "start_secs": round(phase.start_ns / 1e9, 3),
+            "end_secs": round(phase.end_ns / 1e9, 3),
+            "pct_time": round(phase.total_hits / total_hits * 100, 1),
+            "top_lines": [
+                {"loc": loc, "pct_time_in_phase": round(pct * 100, 1)}
+                for loc, pct in perf_data.top_lines_in_phase(
+                    phase.index, NUM_LINES_PER_PHASE
+                )
+            ],
+        }
+        for phase in perf_data.phases()
+    ]
+
+
+@function_tool
+def get_thread_utilization(
+    ctx: RunContextWrapper[AgentContext], workload: Optional[str] = None
+) -> dict:
+    """Show how busy each thread of the profiled run was, how unevenly work was spread across threads, and how much of the run was serial, with the top lines of the busiest threads.
+
+    Args:
+        workload: The workload whose run to inspect. Required when several workloads are configured.
+    """
+    project = ctx.context.project
+    perf_data = _select_workload(_shared_build_and_run_perf(project), workload)
+    utilization = perf_data.thread_utilization()
+
+    NUM_THREADS = 8
+    NUM_LINES_PER_THREAD = 3
+    return {
+        "duration_secs": round(utilization.duration_ns / 1e9, 3),
+        "busy_threads": utilization.busy_threads,
+        "idle_threads": utilization.idle_threads,
+        "imbalance": round(utilization.imbalance, 2),
+        "pct_serial": round(utilization.serial_fraction * 100, 1),
+        "threads": [
+            {
+                "tid": thread.tid,
+                "name": thread.comm,
+                "pct_busy": round(thread.utilization * 100, 1),
+                "top_lines": [
+                    {"loc": loc, "pct_time_in_thread": round(pct * 100, 1)}
+                    for loc, pct in perf_data.tabulate_thread(thread.tid)[
+                        :NUM_LINES_PER_THREAD
+                    ]
+                ],
+            }
+            for thread in utilization.threads[:NUM_THREADS]
+        ],
+        "hits_by_cpu": utilization.cpu_hits,
+    }
+
+
 @function_tool
 def generate_flamegraph(
     ctx: RunContextWrapper[AgentContext],
@@ -160,6 +566,9 @@ def lookup_executable_symbol(ctx: RunContextWrapper[AgentContext], symbol: str)
 
 
 @function_tool
+@_memoize_tool(
+    lambda args, result: [args["filename"], *(loc["filename"] for loc in result)]
+)
 def get_info(
     ctx: RunContextWrapper[AgentContext], filename: str, line: int, symbol: str
 ) -> list[dict]:
@@ -198,6 +607,8 @@ def get_info(
 
 
 @function_tool
+# New references can appear in any file.
+@_memoize_tool(lambda args, result: None)
 def get_references(
     ctx: RunContextWrapper[AgentContext], filename: str, line: int, symbol: str
 ) -> list[dict]:
@@ -290,6 +701,7 @@ def get_hover(project: Project, filename: str, line: int, column: int):
 
 
 @function_tool
+@_memoize_tool(lambda args, result: [args["filename"]])
 def get_surrounding_code(
     ctx: RunContextWrapper[AgentContext], filename: str, line: int
 ) -> dict:
@@ -315,3 +727,166 @@ def get_surrounding_code(
         "region_name": parent_sym["name"],
         "code": number_group_of_lines(lines, max(sline, 1)),
     }
+
+
+@function_tool
+@_memoize_tool(lambda args, result: None)
+def get_annotated_hot_code(
+    ctx: RunContextWrapper[AgentContext],
+    filename: str,
+    line: int,
+    event: Optional[str] = None,
+) -> dict:
+    """Get the function around a given line, with each line's share of the profile.
+
+    Lines with no samples far from any sampled line are collapsed, and lines above
+    a few percent are marked as hot, so this shows where time goes inside a hotspot
+    from run_perf_profiler.
+
+    Args:
+        filename: The filename
+        line: A 1-based line number inside the function
+        event: The recorded event to annotate with, like "cache-misses".
+            Defaults to cycles.
+    """
+    project = ctx.context.project
+    perf_data = _shared_build_and_run_perf(project)
+    HOT_PCT = 5.0
+    CONTEXT_LINES = 2
+
+    parent_sym = project.lsp().syncexec(
+        project.lsp().request_nearest_parent_symbol(
+            filename, line - 1, TOP_LEVEL_SYMBOL_KINDS
+        ),
+    )
+    if parent_sym is None:
+        raise ValueError(f"no surrounding top-level symbol found at {filename}:{line}")
+    sline = max(parent_sym["range"]["start"]["line"] + 1, 1)
+    lines = project.get_range(filename, parent_sym["range"])
+    pcts = {
+        sline + i: (perf_data.lookup_pct_time(LineLoc(filename, sline + i), event) or 0)
+        * 100
+        for i in range(len(lines))
+    }
+
+    def note(lineno: int) -> str:
+        pct = pcts[lineno]
+        if pct >= HOT_PCT:
+            return f"  // HOT {pct:.1f}%"
+        if pct > 0:
+            return f"  // {pct:.1f}%"
+        return ""
+
+    # Keep the signature, the closing line, and lines near sampled ones.
+    eline = sline + len(lines) - 1
+    shown = [
+        lineno in (sline, eline)
+        or any(
+            pcts.get(lineno + d, 0) > 0
+            for d in range(-CONTEXT_LINES, CONTEXT_LINES + 1)
+        )
+        for lineno in range(sline, eline + 1)
+    ]
+    numbered = custom_number_group_of_lines(
+        lines, sline, strip=False, with_note=note
+    ).split("\n")
+    chunks = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j < len(lines) and shown[j] == shown[i]:
+            j += 1
+        if shown[i]:
+            chunks.extend(numbered[i:j])
+        else:
+            chunks.append(f"... ({j - i} lines with no samples) ...")
+        i = j
+    return {
+        "filename": filename,
+        "region_name": parent_sym["name"],
+        "pct_time": round(sum(pcts.values()), 1),
+        "hot_lines": [lineno for lineno, pct in pcts.items() if pct >= HOT_PCT],
+        "code": "\n".join(chunks),
+    }
+
+
+@function_tool
+@_memoize_tool(lambda args, result: None)
+def get_annotated_assembly(
+    ctx: RunContextWrapper[AgentContext],
+    filename: Optional[str] = None,
+    line: Optional[int] = None,
+    symbol: Optional[str] = None,
+    event: Optional[str] = None,
+) -> dict:
+    """Get the machine code of a hot source line or function, with each instruction's
+    share of the profile, to see whether a loop was vectorized or where it stalls.
+
+    Pass either a filename and line, or a symbol name as reported by
+    lookup_executable_symbol or the profiler.
+
+    Args:
+        filename: The filename of the line to show
+        line: The 1-based line number to show
+        symbol: The function to show in full, instead of a line
+        event: The recorded event to annotate with, like "cache-misses".
+            Defaults to cycles.
+    """
+    project = ctx.context.project
+    perf_data = _shared_build_and_run_perf(project)
+    disasm = load_disassembly(project.target_binary())
+    # Instruction hits count every sampled instruction, library code included, so
+    # they're shares of their own total rather than of the project's hits.
+    total_hits = perf_data.total_instruction_hits(event)
+    MAX_CHARS = 8000
+
+    if symbol is not None:
+        if symbol not in disasm.symbols:
+            raise ValueError(f"symbol {symbol} not found in the target binary")
+        instructions = disasm.symbols[symbol]
+    elif filename is not None and line is not None:
+        by_symbol = disasm.instructions_at(project._root / filename, line)
+        if not by_symbol:
+            raise ValueError(
+                f"no machine code for {filename}:{line} (optimized out or not built?)"
+            )
+
+        # Of the copies of the line, show the one that was sampled the most.
+        def line_hits(item: tuple[str, list[Instruction]]) -> int:
+            offsets = perf_data.instruction_hits(item[0], event)
+            return sum(offsets.get(instr.offset, 0) for instr in item[1])
+
+        symbol, line_instructions = max(by_symbol.items(), key=line_hits)
+        # The line's instructions can be scattered; show everything in between.
+        first, last = line_instructions[0].offset, line_instructions[-1].offset
+        instructions = [
+            instr for instr in disasm.symbols[symbol] if first <= instr.offset <= last
+        ]
+    else:
+        raise ValueError("pass either filename and line, or symbol")
+
+    hits = perf_data.instruction_hits(symbol, event)
+    hottest = sorted(
+        (instr for instr in instructions if instr.offset in hits),
+        key=lambda instr: -hits[instr.offset],
+    )[:5]
+    return {
+        "symbol": symbol,
+        "pct_time": round(
+            100 * sum(hits.get(i.offset, 0) for i in instructions) / total_hits, 1
+        )
+        if total_hits
+        else 0.0,
+        "hottest_instructions": [
+            {
+                "offset": hex(instr.offset),
+                "instruction": instr.text,
+                "pct_time": round(100 * hits[instr.offset] / total_hits, 1),
+                "line": instr.line,
+            }
+            for instr in hottest
+        ],
+        "assembly": truncate_for_llm(
+            annotate(instructions, hits, total_hits, project._root), MAX_CHARS
+        ),
+    }
@@ -1,21 +1,128 @@
+from dataclasses import asdict, dataclass, field
 import json
-from agents import TracingProcessor
+from pathlib import Path
+import resource
+import statistics
+import time
+from typing import Any, Optional, TextIO
+from agents import (
+    GenerationSpanData,
+    ResponseSpanData,
+    Span,
+    Trace,
+    TracingProcessor,
+)
 from rich import print
 
+from accelerant.tool_cache import ToolCache
+
+# Upper bounds, in seconds, of the buckets of the per-tool latency histograms.
+HISTOGRAM_BUCKETS = [0.1, 1.0, 10.0, 60.0, float("inf")]
+
+
+@dataclass
+class SpanRecord:
+    """Timing and resource use of one span, as written to the trace file."""
+
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    type: str
+    name: str
+    # Seconds since the start of the trace.
+    start_secs: float
+    duration_secs: float
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    # CPU time and peak RSS of child processes (cargo, perf, ...) that exited during
+    # the span. Spans that overlap, like parallel tool calls, share these.
+    child_cpu_secs: float = 0.0
+    child_max_rss_kb: Optional[int] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _OpenSpan:
+    start: float
+    child_usage: resource.struct_rusage
+
+
+@dataclass
+class ToolHistogram:
+    """Latencies of one tool's calls."""
+
+    durations: list[float] = field(default_factory=list)
+
+    def bucket_counts(self) -> list[int]:
+        """How many calls fell in each of `HISTOGRAM_BUCKETS`."""
+        counts = [0] * len(HISTOGRAM_BUCKETS)
+        for duration in self.durations:
+            i = next(i for i, bound in enumerate(HISTOGRAM_BUCKETS) if duration < bound)
+            counts[i] += 1
+        return counts
+
+    def quantile(self, q: float) -> float:
+        if len(self.durations) == 1:
+            return self.durations[0]
+        return statistics.quantiles(self.durations, n=100, method="inclusive")[
+            round(q * 100) - 1
+        ]
+
+
+def _span_name(data: Any) -> str:
+    name = getattr(data, "name", None)
+    if name:
+        return name
+    model = getattr(data, "model", None)
+    return model or data.type
+
+
+def _span_tokens(data: Any) -> tuple[Optional[int], Optional[int]]:
+    if isinstance(data, ResponseSpanData):
+        usage = data.response.usage if data.response is not None else None
+        if usage is not None:
+            return usage.input_tokens, usage.output_tokens
+    elif isinstance(data, GenerationSpanData) and data.usage:
+        return data.usage.get("input_tokens"), data.usage.get("output_tokens")
+    return None, None
+
 
 class LoggingTracingProcessor(TracingProcessor):
     def __init__(
         self,
+        tool_cache: Optional[ToolCache] = None,
+        trace_path: Optional[Path] = None,
     ):
-        pass
+        self.tool_cache = tool_cache
+        self.trace_file: Optional[TextIO] = (
+            open(trace_path, "a") if trace_path is not None else None
+        )
+        self.trace_starts: dict[str, float] = {}
+        self.open_spans: dict[str, _OpenSpan] = {}
+        self.records: dict[str, list[SpanRecord]] = {}
+
+    def on_trace_start(self, trace: Trace):
+        self.trace_starts[trace.trace_id] = time.perf_counter()
+        self.records[trace.trace_id] = []
 
-    def on_trace_start(self, trace):
-        pass
+    def on_trace_end(self, trace: Trace):
+        start = self.trace_starts.pop(trace.trace_id, None)
+        records = self.records.pop(trace.trace_id, [])
+        if start is not None:
+            self.print_breakdown(time.perf_counter() - start, records)
+        if self.tool_cache is None:
+            return
+        for tool, stats in sorted(self.tool_cache.stats().items()):
+            print(
+                f"[bold]Tool cache:[/bold] {tool}: {stats.hits}/{stats.hits + stats.misses}"
+                f" calls cached ({stats.hit_rate():.0%})"
+            )
 
-    def on_trace_end(self, trace):
-        pass
+    def on_span_start(self, span: Span[Any]):
+        self.open_spans[span.span_id] = _OpenSpan(
+            time.perf_counter(), resource.getrusage(resource.RUSAGE_CHILDREN)
+        )
 
-    def on_span_start(self, span):
         data = span.span_data.export()
         if data["type"] == "agent":
             print(f"[bold blue]Starting[/bold blue] agent: {data.get('name', '')}")
@@ -26,7 +133,9 @@ class LoggingTracingProcessor(TracingProcessor):
         else:
             print(f"[bold blue]Starting[/bold blue] span of type: {data['type']}")
 
-    def on_span_end(self, span):
+    def on_span_end(self, span: Span[Any]):
+        record = self.record_span(span)
+
         data = span.span_data.export()
         if data["type"] == "agent":
             print(f"[bold green]Finished[/bold green] agent: {data.get('name', '')}")
@@ -49,9 +158,99 @@ class LoggingTracingProcessor(TracingProcessor):
                 print(f"  {output}")
         else:
             print(f"[bold green]Finished[/bold green] span of type: {data['type']}")
+        if record is not None:
+            print(f"  [dim]took {record.duration_secs:.2f}s[/dim]")
+
+    def record_span(self, span: Span[Any]) -> Optional[SpanRecord]:
+        opened = self.open_spans.pop(span.span_id, None)
+        if opened is None:
+            return None
+        end = time.perf_counter()
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        input_tokens, output_tokens = _span_tokens(span.span_data)
+        error = span.error
+        record = SpanRecord(
+            trace_id=span.trace_id,
+            span_id=span.span_id,
+            parent_id=span.parent_id,
+            type=span.span_data.type,
+            name=_span_name(span.span_data),
+            start_secs=opened.start
+            - self.trace_starts.get(span.trace_id, opened.start),
+            duration_secs=end - opened.start,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            child_cpu_secs=(child_usage.ru_utime + child_usage.ru_stime)
+            - (opened.child_usage.ru_utime + opened.child_usage.ru_stime),
+            # The peak over all children so far; it only moves if a child that
+            # exited during this span set a new one.
+            child_max_rss_kb=child_usage.ru_maxrss
+            if child_usage.ru_maxrss > opened.child_usage.ru_maxrss
+            else None,
+            error=error["message"] if error is not None else None,
+        )
+        self.records.setdefault(span.trace_id, []).append(record)
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps(asdict(record)) + "\n")
+            self.trace_file.flush()
+        return record
+
+    def tool_histograms(
+        self, records: Optional[list[SpanRecord]] = None
+    ) -> dict[str, ToolHistogram]:
+        """Latencies of each tool, over `records` or every span of open traces."""
+        if records is None:
+            records = [r for trace in self.records.values() for r in trace]
+        histograms: dict[str, ToolHistogram] = {}
+        for record in records:
+            if record.type == "function":
+                histograms.setdefault(record.name, ToolHistogram()).durations.append(
+                    record.duration_secs
+                )
+        return histograms
+
+    def print_breakdown(self, wall_secs: float, records: list[SpanRecord]) -> None:
+        model = [r for r in records if r.type in ("response", "generation")]
+        model_secs = sum(r.duration_secs for r in model)
+        input_tokens = sum(r.input_tokens or 0 for r in model)
+        output_tokens = sum(r.output_tokens or 0 for r in model)
+        histograms = self.tool_histograms(records)
+        tool_secs = sum(sum(h.durations) for h in histograms.values())
+
+        def pct(secs: float) -> str:
+            return f"{secs / wall_secs:.0%}" if wall_secs > 0 else "-"
+
+        print(f"[bold]Session took {wall_secs:.1f}s:[/bold]")
+        print(
+            f"  model: {model_secs:.1f}s ({pct(model_secs)}) in {len(model)} calls,"
+            f" {input_tokens} tokens in, {output_tokens} out"
+        )
+        for tool, histogram in sorted(
+            histograms.items(), key=lambda item: -sum(item[1].durations)
+        ):
+            secs = sum(histogram.durations)
+            child_cpu_secs = sum(
+                r.child_cpu_secs
+                for r in records
+                if r.type == "function" and r.name == tool
+            )
+            buckets = " ".join(
+                f"<{bound:g}s:{count}" if bound != float("inf") else f"more:{count}"
+                for bound, count in zip(HISTOGRAM_BUCKETS, histogram.bucket_counts())
+            )
+            print(
+                f"  {tool}: {secs:.1f}s ({pct(secs)}) in {len(histogram.durations)} calls,"
+                f" p50 {histogram.quantile(0.5):.2f}s, max {max(histogram.durations):.2f}s,"
+                f" child CPU {child_cpu_secs:.1f}s [{buckets}]"
+            )
+        other_secs = max(0.0, wall_secs - model_secs - tool_secs)
+        print(f"  other: {other_secs:.1f}s ({pct(other_secs)})")
 
     def shutdown(self):
-        pass
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
 
     def force_flush(self):
-        pass
+        if self.trace_file is not None:
+            self.trace_file.flush()
@@ -62,6 +62,8 @@ def custom_number_group_of_lines(
         group (List[str]): The lines to number.
         first (int): The number for the first line.
         strip (bool): Whether to strip leading and trailing blank lines.
+        with_note (Callable[[int], str]): Gives text to append to each line, by
+            line number.
 
     Returns:
         A string concatenation of the numbered lines.
@@ -0,0 +1,114 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+import subprocess
+from typing import Optional
+
+from accelerant.project import Project
+
+# Edits must beat the baseline by this factor to count as an improvement, so that
+# measurement noise isn't mistaken for a speedup.
+MIN_SPEEDUP = 1.02
+
+
+@dataclass
+class VerificationReport:
+    baseline_secs: float
+    # Baseline runtime divided by the runtime with every edit, or None if that
+    # version failed to build or run.
+    speedup: Optional[float]
+    # The edited files whose edits were kept.
+    kept: list[Path] = field(default_factory=list)
+    # Speedup of each edited file's edits on their own, if the edits were bisected.
+    impacts: dict[Path, Optional[float]] = field(default_factory=dict)
+    kept_speedup: Optional[float] = None
+    # The speedup edits had to give to be kept: `MIN_SPEEDUP`, or more if the
+    # runtime was measured with more noise.
+    min_speedup: float = MIN_SPEEDUP
+
+    def summary(self) -> str:
+        if self.speedup is not None and self.speedup >= self.min_speedup:
+            return (
+                f"Measured speedup: {self.speedup:.3f}x over {self.baseline_secs:.3f}s."
+            )
+        lines = [
+            f"The edits together did not measurably speed up the program"
+            f" ({_describe(self.speedup)} over {self.baseline_secs:.3f}s),"
+            " so each edited file was measured on its own:"
+        ]
+        for path, impact in self.impacts.items():
+            kept = "kept" if path in self.kept else "reverted"
+            lines.append(f"- {path}: {_describe(impact)}, {kept}")
+        if self.kept:
+            lines.append(
+                f"The kept edits give {_describe(self.kept_speedup)} together."
+            )
+        else:
+            lines.append("No subset of the edits helped, so all were reverted.")
+        return "\n".join(lines)
+
+
+def _describe(speedup: Optional[float]) -> str:
+    return f"{speedup:.3f}x" if speedup is not None else "failed to build or run"
+
+
+def keep_improving_edits(project: Project) -> VerificationReport:
+    """Measure the sandbox's edits against the original tree, and revert the ones
+    that don't give a speedup.
+
+    If all the edits together aren't faster, the edited files are bisected: each
+    half is searched for its best subset, and the two subsets are combined if
+    that's faster still. The edits that remain are left unpersisted in the sandbox.
+    """
+    fs = project.fs_sandbox()
+    edited = fs.modified_files()
+    final_texts = {path: fs.read_file(path) for path in edited}
+    original_texts = {path: fs.original_text(path) for path in edited}
+
+    def runtime_with(subset: list[Path]) -> Optional[float]:
+        for path in edited:
+            fs.write_file(
+                path, final_texts[path] if path in subset else original_texts[path]
+            )
+        try:
+            return project.measure_runtime()
+        except subprocess.CalledProcessError:
+            return None
+
+    baseline_secs = runtime_with([])
+    assert baseline_secs is not None, "the original tree should build and run"
+
+    def speedup_with(subset: list[Path]) -> Optional[float]:
+        runtime = runtime_with(subset)
+        return baseline_secs / runtime if runtime is not None else None
+
+    # Bench estimates come with confidence intervals; a speedup within them is noise.
+    min_speedup = max(MIN_SPEEDUP, 1.0 + project.measurement_noise())
+
+    report = VerificationReport(baseline_secs, speedup_with(edited))
+    report.min_speedup = min_speedup
+    if report.speedup is not None and report.speedup >= min_speedup:
+        report.kept = edited
+        report.kept_speedup = report.speedup
+        return report
+
+    def bisect(files: list[Path]) -> tuple[list[Path], float]:
+        """The subset of `files` with the best speedup, and that speedup."""
+        if len(files) == 1:
+            impact = report.impacts[files[0]] = speedup_with(files)
+            if impact is not None and impact >= min_speedup:
+                return files, impact
+            return [], 1.0
+        mid = len(files) // 2
+        left, left_speedup = bisect(files[:mid])
+        right, right_speedup = bisect(files[mid:])
+        best = max([(left, left_speedup), (right, right_speedup)], key=lambda c: c[1])
+        if left and right:
+            both = speedup_with(left + right)
+            if both is not None and both > best[1]:
+                best = (left + right, both)
+        return best
+
+    report.kept, kept_speedup = bisect(edited)
+    report.kept_speedup = kept_speedup if report.kept else None
+    speedup_with(report.kept)
+    return report
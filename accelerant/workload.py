@@ -0,0 +1,65 @@
+from dataclasses import dataclass, field
+import json
+from pathlib import Path
+from typing import Optional
+
+
+DEFAULT_WORKLOAD_NAME = "default"
+
+
+@dataclass(frozen=True)
+class Workload:
+    """
+    One representative way of running the target binary.
+
+    Hits recorded for a workload are scaled by its weight when profiles are merged,
+    so the weight should reflect how often this input occurs in production.
+    """
+
+    name: str
+    args: list[str] = field(default_factory=list)
+    # Relative to the project root.
+    stdin_path: Optional[Path] = None
+    env: dict[str, str] = field(default_factory=dict)
+    repetitions: int = 1
+    weight: float = 1.0
+    # Run instead of the project's target binary, like a bench executable.
+    binary: Optional[Path] = None
+
+
+def default_workloads() -> list[Workload]:
+    return [Workload(name=DEFAULT_WORKLOAD_NAME)]
+
+
+def load_workloads(path: Path) -> list[Workload]:
+    """Load workload specs from a JSON file containing a list of objects.
+
+    Each object must have a ``name`` and may have ``args``, ``stdin``, ``env``,
+    ``repetitions`` and ``weight``.
+    """
+    with open(path, "r") as f:
+        specs = json.load(f)
+    if not isinstance(specs, list):
+        raise ValueError(f"workload file {path} must contain a JSON list")
+
+    workloads = []
+    for spec in specs:
+        stdin = spec.get("stdin")
+        workload = Workload(
+            name=spec["name"],
+            args=[str(a) for a in spec.get("args", [])],
+            stdin_path=Path(stdin) if stdin is not None else None,
+            env={str(k): str(v) for k, v in spec.get("env", {}).items()},
+            repetitions=int(spec.get("repetitions", 1)),
+            weight=float(spec.get("weight", 1.0)),
+        )
+        if workload.repetitions < 1:
+            raise ValueError(f"workload {workload.name} must have repetitions >= 1")
+        if workload.weight < 0:
+            raise ValueError(f"workload {workload.name} must have weight >= 0")
+        workloads.append(workload)
+
+    names = [w.name for w in workloads]
+    if len(set(names)) != len(names):
+        raise ValueError(f"workload names in {path} must be unique")
+    return workloads
@@ -1,12 +1,18 @@
 import asyncio
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, cast, get_args
 from flask import Flask, request
 from perfparser import LineLoc
 
 from accelerant.agent import AgentConfig, AgentInput, run_agent
-from accelerant.project import Project
+from accelerant.build_search import search_build_config
+from accelerant.fanout import run_fanout
+from accelerant.perf import AttributionPolicy
+from accelerant.pgo import build_with_pgo
+from accelerant.profile_store import ProfileStore
+from accelerant.project import ATTACH_DURATION_SECS, Project
 from accelerant.startup import setup_prereqs
+from accelerant.workload import load_workloads
 
 app = Flask(__name__)
 
@@ -24,25 +30,96 @@ def route_optimize() -> str:
     filename = request.args.get("filename")
     lineno = request.args.get("line", type=int)
     perf_data_path = request.args.get("perfDataPath", type=Path)
+    workloads_path = request.args.get("workloads", type=Path)
+    events = request.args.get("events")
     model_id = request.args.get("modelId", "gpt-4.1")
+    fanout = request.args.get("fanout", type=int)
+    attribution = request.args.get("attribution", "innermost")
+    if attribution not in get_args(AttributionPolicy):
+        raise Exception(f"invalid attribution policy {attribution}")
+    long_running = request.args.get("longRunning", "0") == "1"
+    attach_pid = request.args.get("attachPid", type=int)
+    attach_cgroup = request.args.get("attachCgroup")
+    attach_secs = request.args.get("attachSecs", ATTACH_DURATION_SECS, type=float)
+    history = request.args.get("history", "1") == "1"
+    benches = request.args.get("benches")
 
     response = optimize(
-        project, target_binary, filename, lineno, perf_data_path, model_id
+        project,
+        target_binary,
+        filename,
+        lineno,
+        perf_data_path,
+        workloads_path,
+        events.split(",") if events else None,
+        model_id,
+        fanout,
+        cast(AttributionPolicy, attribution),
+        long_running,
+        attach_pid,
+        attach_cgroup,
+        attach_secs,
+        history,
+        benches.split(",") if benches else None,
     )
     return response
 
 
+@app.route("/search-build-config")
+def route_search_build_config() -> str:
+    project = request.args.get("project", type=Path)
+    if project is None:
+        raise Exception("invalid project path")
+    target_binary = request.args.get("targetBinary", type=Path)
+    if target_binary is None:
+        raise Exception("invalid target binary path")
+    assert "release" in str(target_binary), "target binary must be a release build"
+    workloads_path = request.args.get("workloads", type=Path)
+
+    workloads = load_workloads(workloads_path) if workloads_path else None
+    report = search_build_config(Project(project, target_binary, "rust", workloads))
+    return report.summary()
+
+
+@app.route("/pgo")
+def route_pgo() -> str:
+    project = request.args.get("project", type=Path)
+    if project is None:
+        raise Exception("invalid project path")
+    target_binary = request.args.get("targetBinary", type=Path)
+    if target_binary is None:
+        raise Exception("invalid target binary path")
+    assert "release" in str(target_binary), "target binary must be a release build"
+    workloads_path = request.args.get("workloads", type=Path)
+    bolt = request.args.get("bolt", "0") == "1"
+
+    workloads = load_workloads(workloads_path) if workloads_path else None
+    report = build_with_pgo(Project(project, target_binary, "rust", workloads), bolt)
+    return report.summary()
+
+
 def optimize(
     project_root: Path,
     target_binary: Path,
     filename: Optional[str],
     lineno: Optional[int],
     perf_data_path: Optional[Path],
+    workloads_path: Optional[Path],
+    events: Optional[List[str]],
     model_id: str,
+    fanout: Optional[int] = None,
+    attribution: AttributionPolicy = "innermost",
+    long_running: bool = False,
+    attach_pid: Optional[int] = None,
+    attach_cgroup: Optional[str] = None,
+    attach_secs: float = ATTACH_DURATION_SECS,
+    history: bool = False,
+    benches: Optional[List[str]] = None,
 ) -> str:
     # Ensure an asyncio event loop exists in this (Flask request) thread.
     # Needed for OpenAI agents SDK.
     created_loop: Optional[asyncio.AbstractEventLoop] = None
+    store: Optional[ProfileStore] = None
     try:
         try:
             # If a loop is already running in this thread, do nothing.
@@ -58,9 +135,30 @@ def optimize(
                 asyncio.set_event_loop(loop)
                 created_loop = loop
 
-        project = Project(project_root, target_binary, "rust")
+        workloads = load_workloads(workloads_path) if workloads_path else None
+        if history:
+            store = ProfileStore()
+            if store.prune() > 0:
+                store.compact()
+        project = Project(
+            project_root,
+            target_binary,
+            "rust",
+            workloads,
+            events,
+            attribution,
+            long_running,
+            store,
+            benches,
+        )
+        unknown_benches = set(project.benches()) - set(project.available_benches())
+        if unknown_benches:
+            raise Exception(f"unknown benches {sorted(unknown_benches)}")
         if perf_data_path is not None:
             project.add_perf_data(project.fs_sandbox().version(), perf_data_path)
+        if attach_pid is not None or attach_cgroup is not None:
+            print("Recording the running target")
+            project.record_running(attach_pid, attach_cgroup, attach_secs)
         print("Starting LSP server")
         with project.lsp().start_server():
             with project.fs_sandbox():
@@ -72,13 +170,18 @@ def optimize(
                     else None,
                 }
                 ag_config: AgentConfig = {"model_id": model_id}
-                results = run_agent(
-                    project,
-                    ag_input,
-                    ag_config,
-                )
+                if fanout is not None:
+                    results = run_fanout(project, ag_input, ag_config, fanout)
+                else:
+                    results = run_agent(
+                        project,
+                        ag_input,
+                        ag_config,
+                    )
                 return results["final_message"]
     finally:
+        if store is not None:
+            store.close()
         if created_loop is not None and not created_loop.is_closed():
             created_loop.close()
 
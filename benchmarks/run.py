@@ -0,0 +1,194 @@
+"""Benchmark perfparser and the attribution pipeline on synthetic profiles.
+
+    $ python -m benchmarks.run                   # run, and compare to the baseline
+    $ python -m benchmarks.run --save-baseline   # run, and make this the baseline
+
+Each scenario is generated once, then measured in fresh processes so that peak
+memory is per scenario: the `perfparser` crate's `throughput` example for raw
+`Parser` throughput, and a Python worker for `parse_and_attribute`, `tabulate` and
+`PerfData.lookup_pct_time` through the `perfparser` extension module.
+"""
+
+import argparse
+import json
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+from benchmarks.synth import PROJECT_ROOT, SynthConfig, write_perf_script
+
+SCENARIOS: dict[str, SynthConfig] = {
+    "baseline": SynthConfig(num_events=20_000, stack_depth=16, unique_frames=1_000),
+    "deep_stacks": SynthConfig(num_events=5_000, stack_depth=128, unique_frames=2_000),
+    "many_frames": SynthConfig(num_events=20_000, stack_depth=16, unique_frames=50_000),
+    "multi_event": SynthConfig(
+        num_events=20_000,
+        stack_depth=16,
+        unique_frames=1_000,
+        event_kinds=("cycles:u", "instructions:u", "cache-misses:u"),
+    ),
+    "combined_lines": SynthConfig(
+        num_events=200_000, stack_depth=1, unique_frames=1_000, combined_lines=True
+    ),
+}
+
+# Metrics where a bigger number is an improvement; for the rest, smaller is better.
+HIGHER_IS_BETTER = {"events_per_sec", "mb_per_sec"}
+# Metrics that describe the input rather than performance.
+NOT_COMPARED = {"events", "frames", "bytes", "lines", "lookups"}
+
+PERFPARSER_DIR = Path(__file__).resolve().parent.parent / "perfparser"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+
+def _best_of(repeats: int, f: Callable[[], object]) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_python_worker(script_path: Path, repeats: int) -> dict:
+    """Measure the Python-facing pipeline on one script, in this process."""
+    from perfparser import get_perf_data_from_script
+
+    from accelerant.perf import PerfData
+
+    parse_secs = _best_of(
+        repeats, lambda: get_perf_data_from_script(str(script_path), PROJECT_ROOT)
+    )
+    perf_data = PerfData(
+        script_path, get_perf_data_from_script(str(script_path), PROJECT_ROOT)
+    )
+    tabulate_secs = _best_of(repeats, perf_data.tabulate)
+    locs = [loc for loc, _ in perf_data.tabulate()]
+    lookup_secs = _best_of(
+        repeats, lambda: [perf_data.lookup_pct_time(loc) for loc in locs]
+    )
+    return {
+        "lines": len(locs),
+        "attribute_secs": parse_secs,
+        "tabulate_secs": tabulate_secs,
+        "lookup_us": lookup_secs / max(len(locs), 1) * 1e6,
+        "py_peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def build_throughput_example() -> Path:
+    subprocess.run(
+        ["cargo", "build", "--quiet", "--release", "--example", "throughput"],
+        check=True,
+        cwd=PERFPARSER_DIR,
+    )
+    return PERFPARSER_DIR / "target" / "release" / "examples" / "throughput"
+
+
+def run_scenario(throughput_bin: Path, script_path: Path, repeats: int) -> dict:
+    parser_result = subprocess.run(
+        [str(throughput_bin), str(script_path), str(repeats)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    results = json.loads(parser_result.stdout)
+    worker_result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.run",
+            "--worker",
+            str(script_path),
+            "--repeats",
+            str(repeats),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).resolve().parent.parent,
+    )
+    results.update(json.loads(worker_result.stdout))
+    return results
+
+
+def compare(
+    results: dict[str, dict], baseline: dict[str, dict], threshold: float
+) -> list[str]:
+    """Describe each metric that got worse than the baseline by more than `threshold`."""
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(scenario, {}).get(metric)
+            if metric in NOT_COMPARED or not old:
+                continue
+            change = value / old - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > threshold:
+                regressions.append(
+                    f"{scenario}.{metric}: {old:.4g} -> {value:.4g} ({change:+.0%})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="fail if a metric is worse than the baseline by more than this fraction",
+    )
+    parser.add_argument("--worker", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_python_worker(args.worker, args.repeats)))
+        return
+
+    throughput_bin = build_throughput_example()
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for name in args.scenario or SCENARIOS:
+            script_path = Path(scratch_dir) / f"{name}.txt"
+            write_perf_script(script_path, SCENARIOS[name])
+            results[name] = run_scenario(throughput_bin, script_path, args.repeats)
+            script_path.unlink()
+            metrics = results[name]
+            print(
+                f"{name}: {metrics['events_per_sec']:,.0f} events/s "
+                f"({metrics['mb_per_sec']:.0f} MB/s, peak {metrics['peak_rss_kb'] // 1024} MiB), "
+                f"attribute {metrics['attribute_secs'] * 1000:.1f} ms, "
+                f"tabulate {metrics['tabulate_secs'] * 1000:.2f} ms, "
+                f"lookup {metrics['lookup_us']:.2f} us/line "
+                f"(peak {metrics['py_peak_rss_kb'] // 1024} MiB)"
+            )
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save-baseline to make one")
+        return
+    regressions = compare(
+        results, json.loads(args.baseline.read_text()), args.threshold
+    )
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
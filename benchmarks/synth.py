@@ -0,0 +1,106 @@
+"""Synthetic `perf script -F+pid,+srcline --full-source-path` output for benchmarks."""
+
+from dataclasses import dataclass
+from pathlib import Path
+import random
+from typing import Optional
+
+PROJECT_ROOT = "/bench/proj"
+BINARY = f"{PROJECT_ROOT}/target/release/bench"
+
+
+@dataclass(frozen=True)
+class SynthConfig:
+    num_events: int
+    stack_depth: int
+    # Distinct frames that stacks are drawn from; more means more distinct lines.
+    unique_frames: int
+    event_kinds: tuple[str, ...] = ("cycles:u",)
+    # Samples recorded without call graphs: perf puts the sampled frame on the event
+    # line itself, followed by its srcline, and `stack_depth` is ignored.
+    combined_lines: bool = False
+    # Share of frames inside the project; the rest are in the standard library or
+    # have no source line at all.
+    project_fraction: float = 0.5
+    num_threads: int = 4
+    seed: int = 0
+
+
+@dataclass(frozen=True)
+class _Frame:
+    addr: int
+    funcname: str
+    module: str
+    srcline: Optional[str]
+
+
+def _make_frames(config: SynthConfig, rng: random.Random) -> list[_Frame]:
+    frames = []
+    for i in range(config.unique_frames):
+        addr = 0x55D000 + i * 0x40
+        r = rng.random()
+        if r < config.project_fraction:
+            frames.append(
+                _Frame(
+                    addr,
+                    f"bench::mod{i % 50}::func{i}",
+                    BINARY,
+                    f"{PROJECT_ROOT}/src/mod{i % 50}.rs:{10 + i % 500}",
+                )
+            )
+        elif r < config.project_fraction + (1 - config.project_fraction) * 0.8:
+            frames.append(
+                _Frame(
+                    addr,
+                    f"core::iter::adapters::func{i}",
+                    BINARY,
+                    f"/rustc/90b35a6239c3d8bdabc530a6a0816f7ff89a0aaf/library/core/src/iter/mod{i % 20}.rs:{i % 900}",
+                )
+            )
+        else:
+            frames.append(_Frame(addr, "[unknown]", "[unknown]", None))
+    return frames
+
+
+def _write_frame(lines: list[str], frame: _Frame, offset: int) -> None:
+    lines.append(f"\t{frame.addr:>16x} {frame.funcname}+0x{offset:x} ({frame.module})")
+    if frame.srcline is not None:
+        lines.append(f"  {frame.srcline}")
+
+
+def write_perf_script(path: Path, config: SynthConfig) -> None:
+    rng = random.Random(config.seed)
+    frames = _make_frames(config, rng)
+    pid = 4242
+    timestamp_us = 1_000_000_000
+
+    with open(path, "w") as f:
+        for i in range(config.num_events):
+            tid = pid + i % config.num_threads
+            kind = config.event_kinds[i % len(config.event_kinds)]
+            period = rng.randint(10_000, 500_000)
+            timestamp_us += rng.randint(50, 1500)
+            # Skew towards low indices so that some frames are hot, like real profiles.
+            stack = [
+                frames[int(len(frames) * rng.random() ** 3)]
+                for _ in range(1 if config.combined_lines else config.stack_depth)
+            ]
+
+            header = (
+                f"bench {pid}/{tid} [{tid % 8:03d}] "
+                f"{timestamp_us // 1_000_000}.{timestamp_us % 1_000_000:06d}: "
+                f"{period:>10} {kind}:"
+            )
+            if config.combined_lines:
+                leaf = stack[0]
+                lines = [
+                    f"{header}  {leaf.addr:x} {leaf.funcname}+0x{i % 256:x} ({leaf.module})"
+                ]
+                if leaf.srcline is not None:
+                    lines.append(f"  {leaf.srcline}")
+            else:
+                lines = [f"{header} "]
+                for frame in stack:
+                    _write_frame(lines, frame, i % 256)
+                lines.append("")
+            f.write("\n".join(lines) + "\n")
@@ -0,0 +1,26 @@
+//! Fixture project for replaying recorded optimization sessions; see
+//! `replay_session.py`.
+//!
+//! Counts primes by trial division against every smaller number, which gives the
+//! profiler one obvious hotspot.
+
+fn is_prime(n: u64) -> bool {
+    if n < 2 {
+        return false;
+    }
+    for d in 2..n {
+        if n % d == 0 {
+            return false;
+        }
+    }
+    true
+}
+
+fn main() {
+    let limit = std::env::args()
+        .nth(1)
+        .and_then(|arg| arg.parse().ok())
+        .unwrap_or(100_000);
+    let count = (0..limit).filter(|&n| is_prime(n)).count();
+    println!("{count} primes below {limit}");
+}
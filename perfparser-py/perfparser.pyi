@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 class LineLoc:
     path: str
@@ -7,12 +7,131 @@ class LineLoc:
     def __init__(self, path: str, line: int):
         pass
 
+class Phase:
+    index: int
+    start_ns: int
+    end_ns: int
+    total_hits: int
+
+class ThreadSummary:
+    tid: int
+    comm: str
+    samples: int
+    hits: int
+    attributed_hits: int
+    busy_ns: int
+    utilization: float
+
+class ThreadUtilization:
+    duration_ns: int
+    threads: List[ThreadSummary]
+    busy_threads: int
+    idle_threads: int
+    imbalance: float
+    serial_fraction: float
+    cpu_hits: dict[int, int]
+
 class AttributedPerf:
     hit_count: dict[LineLoc, int]
     total_hits: int
+    event_kinds: List[str]
+    primary_event: Optional[str]
+    sampled_fraction: float
 
-    def tabulate(self) -> List[tuple[LineLoc, float]]:
+    def sample_count(self, event: Optional[str] = None) -> int:
+        pass
+    def lookup_hits(self, loc: LineLoc, event: Optional[str] = None) -> Optional[int]:
+        pass
+    def total_event_hits(self, event: Optional[str] = None) -> int:
+        pass
+    def tabulate(self, event: Optional[str] = None) -> List[tuple[LineLoc, float]]:
+        pass
+    def ratio(
+        self, numerator: str, denominator: str, scale: float
+    ) -> List[tuple[LineLoc, float]]:
+        pass
+    def instruction_hits(
+        self, symbol: str, event: Optional[str] = None
+    ) -> dict[int, int]:
+        pass
+    def total_instruction_hits(self, event: Optional[str] = None) -> int:
         pass
+    def symbol_hits(self, event: Optional[str] = None) -> dict[str, int]:
+        pass
+    def inlined_into(
+        self, loc: LineLoc, event: Optional[str] = None
+    ) -> List[tuple[LineLoc, int]]:
+        pass
+    def thread_utilization(self) -> ThreadUtilization:
+        pass
+    def tabulate_thread(self, tid: int) -> List[tuple[LineLoc, float]]:
+        pass
+    def time_window_ns(self) -> int:
+        pass
+    def phases(self) -> List[Phase]:
+        pass
+    def top_lines_in_phase(self, phase: int, k: int) -> List[tuple[LineLoc, float]]:
+        pass
+    def top_lines_in_range(
+        self, start_ns: int, end_ns: int, k: int
+    ) -> List[tuple[LineLoc, float]]:
+        pass
+    @staticmethod
+    def merge(parts: List[tuple[AttributedPerf, float]]) -> AttributedPerf:
+        pass
+
+class LiveProfile:
+    covered_ns: int
+
+    def snapshot(self) -> AttributedPerf:
+        pass
+    def top_lines(self, k: int) -> List[tuple[LineLoc, float]]:
+        pass
+    def is_running(self) -> bool:
+        pass
+    def stop(self) -> None:
+        pass
+
+class AttributedAllocs:
+    bytes: dict[LineLoc, int]
+    count: dict[LineLoc, int]
+    total_bytes: int
+    total_count: int
+
+    def tabulate(self, by_count: bool) -> List[tuple[LineLoc, int, int]]:
+        pass
+    @staticmethod
+    def merge(parts: List[tuple[AttributedAllocs, float]]) -> AttributedAllocs:
+        pass
+
+def get_perf_data(
+    data_path_str: str,
+    project_root_str: str,
+    policy: str = "innermost",
+    fraction: float = 1.0,
+) -> AttributedPerf:
+    pass
+
+def reads_perf_data_directly(data_path_str: str) -> bool:
+    pass
+
+def get_perf_data_from_script(
+    script_path_str: str, project_root_str: str, policy: str = "innermost"
+) -> AttributedPerf:
+    pass
+
+def start_live_profile(
+    pid: int,
+    project_root_str: str,
+    policy: str = "innermost",
+    window_secs: float = 30.0,
+    bucket_secs: float = 1.0,
+    call_graph: str = "dwarf",
+) -> LiveProfile:
+    pass
+
+def get_offcpu_data(data_path_str: str, project_root_str: str) -> AttributedPerf:
+    pass
 
-def get_perf_data(data_path_str: str, project_root_str: str) -> AttributedPerf:
+def get_alloc_data(data_path_str: str, project_root_str: str) -> AttributedAllocs:
     pass
@@ -0,0 +1,116 @@
+use std::cmp;
+use std::collections::HashMap;
+use std::io;
+use std::path::Path;
+
+use perfparser::{Event, Parser};
+use pyo3::{pyclass, pymethods, PyRef};
+
+use crate::perf::attribute_to_line;
+use crate::LineLoc;
+
+/// Allocations recorded through probes on the C allocator, per project line.
+#[pyclass]
+#[derive(Debug, Clone, Default)]
+pub struct AttributedAllocs {
+    #[pyo3(get)]
+    pub bytes: HashMap<LineLoc, u64>,
+    #[pyo3(get)]
+    pub count: HashMap<LineLoc, u64>,
+    #[pyo3(get)]
+    pub total_bytes: u64,
+    #[pyo3(get)]
+    pub total_count: u64,
+}
+
+#[pymethods]
+impl AttributedAllocs {
+    /// Lines with their allocated bytes and allocation count, sorted by bytes, or by
+    /// count if `by_count` is set.
+    pub fn tabulate(&self, by_count: bool) -> Vec<(LineLoc, u64, u64)> {
+        let mut rows: Vec<_> = self
+            .count
+            .iter()
+            .map(|(loc, &count)| {
+                let bytes = self.bytes.get(loc).copied().unwrap_or(0);
+                (loc.clone(), bytes, count)
+            })
+            .collect();
+        if by_count {
+            rows.sort_by_key(|&(_, _, count)| cmp::Reverse(count));
+        } else {
+            rows.sort_by_key(|&(_, bytes, _)| cmp::Reverse(bytes));
+        }
+        rows
+    }
+
+    /// Combine several allocation profiles, scaling each by its weight.
+    #[staticmethod]
+    pub fn merge(parts: Vec<(PyRef<'_, AttributedAllocs>, f64)>) -> Self {
+        let mut bytes: HashMap<LineLoc, f64> = HashMap::new();
+        let mut count: HashMap<LineLoc, f64> = HashMap::new();
+        for (allocs, weight) in &parts {
+            for (loc, n) in &allocs.bytes {
+                *bytes.entry(loc.clone()).or_insert(0.0) += *n as f64 * weight;
+            }
+            for (loc, n) in &allocs.count {
+                *count.entry(loc.clone()).or_insert(0.0) += *n as f64 * weight;
+            }
+        }
+        let round = |m: HashMap<LineLoc, f64>| -> HashMap<LineLoc, u64> {
+            m.into_iter()
+                .map(|(loc, n)| (loc, n.round() as u64))
+                .filter(|&(_, n)| n > 0)
+                .collect()
+        };
+        let bytes = round(bytes);
+        let count = round(count);
+        AttributedAllocs {
+            total_bytes: bytes.values().sum(),
+            total_count: count.values().sum(),
+            bytes,
+            count,
+        }
+    }
+}
+
+/// Size of the allocation an allocator probe event records, from its arguments.
+fn allocation_size(event: &Event) -> Option<u64> {
+    let parse = |name: &str| {
+        let value = event.trace_field(name)?;
+        match value.strip_prefix("0x") {
+            Some(hex) => u64::from_str_radix(hex, 16).ok(),
+            None => value.parse().ok(),
+        }
+    };
+    let (_group, func) = event.kind.rsplit_once(':')?;
+    match func {
+        "calloc" => Some(parse("nmemb")?.saturating_mul(parse("size")?)),
+        _ => parse("size"),
+    }
+}
+
+/// Attribute allocator probe events (see `Project.run_profiler`'s "alloc" mode) to
+/// the first in-project frame of their stacks, like `parse_and_attribute`.
+pub fn parse_and_attribute_allocs<R: io::Read>(
+    r: R,
+    project_root: &Path,
+) -> io::Result<AttributedAllocs> {
+    let parser = Parser::new(r);
+    let mut allocs = AttributedAllocs::default();
+
+    for event in parser {
+        let Some(size) = allocation_size(&event) else {
+            continue;
+        };
+        let Some(lineloc) = attribute_to_line(&event, project_root) else {
+            continue;
+        };
+        *allocs.bytes.entry(lineloc.clone()).or_insert(0) += size;
+        *allocs.count.entry(lineloc).or_insert(0) += 1;
+        allocs.total_bytes += size;
+        allocs.total_count += 1;
+    }
+
+    Ok(allocs)
+}
@@ -0,0 +1,136 @@
+use std::cmp;
+use std::collections::HashMap;
+
+use crate::LineLoc;
+
+/// Per-line counts of every event kind in a recording.
+///
+/// Stored column-wise rather than as one map per kind: each line is interned once in
+/// `locs`, and `counts[k][i]` is the count of `kinds[k]` at `locs[i]`. Recordings of
+/// several events mostly hit the same lines, so this shares the keys between kinds.
+#[derive(Debug, Clone, Default)]
+pub struct EventCounters {
+    kinds: Vec<String>,
+    locs: Vec<LineLoc>,
+    loc_index: HashMap<LineLoc, u32>,
+    counts: Vec<Vec<u64>>,
+    totals: Vec<u64>,
+}
+
+impl EventCounters {
+    /// Event kinds in the order they were first seen.
+    pub fn kinds(&self) -> &[String] {
+        &self.kinds
+    }
+
+    pub fn kind_id(&self, kind: &str) -> Option<usize> {
+        self.kinds.iter().position(|k| k == kind)
+    }
+
+    /// The id of `kind`, adding an empty column for it if it's new.
+    pub fn add_kind(&mut self, kind: &str) -> usize {
+        if let Some(id) = self.kind_id(kind) {
+            return id;
+        }
+        self.kinds.push(kind.to_owned());
+        self.counts.push(vec![0; self.locs.len()]);
+        self.totals.push(0);
+        self.kinds.len() - 1
+    }
+
+    fn add_loc(&mut self, loc: LineLoc) -> usize {
+        if let Some(&id) = self.loc_index.get(&loc) {
+            return id as usize;
+        }
+        let id = self.locs.len();
+        self.loc_index.insert(loc.clone(), id as u32);
+        self.locs.push(loc);
+        for column in &mut self.counts {
+            column.push(0);
+        }
+        id
+    }
+
+    pub fn add(&mut self, kind_id: usize, loc: LineLoc, n: u64) {
+        let loc_id = self.add_loc(loc);
+        self.counts[kind_id][loc_id] += n;
+        self.totals[kind_id] += n;
+    }
+
+    pub fn total(&self, kind_id: usize) -> u64 {
+        self.totals[kind_id]
+    }
+
+    /// The count of a kind at a line, or `None` if the line never saw that kind.
+    pub fn get(&self, kind_id: usize, loc: &LineLoc) -> Option<u64> {
+        let &loc_id = self.loc_index.get(loc)?;
+        let n = self.counts[kind_id][loc_id as usize];
+        (n > 0).then_some(n)
+    }
+
+    /// Lines with a nonzero count of a kind.
+    pub fn column(&self, kind_id: usize) -> impl Iterator<Item = (&LineLoc, u64)> {
+        self.locs
+            .iter()
+            .zip(&self.counts[kind_id])
+            .filter(|&(_, &n)| n > 0)
+            .map(|(loc, &n)| (loc, n))
+    }
+
+    /// Lines with their share of a kind's total, most first.
+    pub fn tabulate(&self, kind_id: usize) -> Vec<(LineLoc, f64)> {
+        let total = self.totals[kind_id] as f64;
+        let mut sorted: Vec<_> = self.column(kind_id).collect();
+        sorted.sort_by_key(|&(_, n)| cmp::Reverse(n));
+        sorted
+            .into_iter()
+            .map(|(loc, n)| (loc.clone(), n as f64 / total))
+            .collect()
+    }
+
+    /// `scale * numerator / denominator` for every line with a nonzero `denominator`
+    /// count, highest first.
+    pub fn ratio(&self, numerator: usize, denominator: usize, scale: f64) -> Vec<(LineLoc, f64)> {
+        let mut rows: Vec<_> = self
+            .locs
+            .iter()
+            .zip(self.counts[numerator].iter().zip(&self.counts[denominator]))
+            .filter(|&(_, (_, &den))| den > 0)
+            .map(|(loc, (&num, &den))| (loc.clone(), scale * num as f64 / den as f64))
+            .collect();
+        rows.sort_by(|(_, a), (_, b)| b.total_cmp(a));
+        rows
+    }
+
+    /// Combine several sets of counters, scaling each by its weight.
+    pub fn merge<'a>(parts: impl IntoIterator<Item = (&'a EventCounters, f64)>) -> Self {
+        let mut kinds: Vec<String> = Vec::new();
+        let mut weighted: HashMap<(usize, &LineLoc), f64> = HashMap::new();
+        for (counters, weight) in parts {
+            for (kind_id, kind) in counters.kinds.iter().enumerate() {
+                let merged_id = match kinds.iter().position(|k| k == kind) {
+                    Some(id) => id,
+                    None => {
+                        kinds.push(kind.clone());
+                        kinds.len() - 1
+                    }
+                };
+                for (loc, n) in counters.column(kind_id) {
+                    *weighted.entry((merged_id, loc)).or_insert(0.0) += n as f64 * weight;
+                }
+            }
+        }
+
+        let mut merged = EventCounters::default();
+        for kind in &kinds {
+            merged.add_kind(kind);
+        }
+        for ((kind_id, loc), n) in weighted {
+            let n = n.round() as u64;
+            if n > 0 {
+                merged.add(kind_id, loc.clone(), n);
+            }
+        }
+        merged
+    }
+}
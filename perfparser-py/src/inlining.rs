@@ -0,0 +1,148 @@
+use std::collections::HashMap;
+use std::path::Path;
+
+use perfparser::{Event, StackFrame};
+use pyo3::exceptions::PyValueError;
+use pyo3::PyResult;
+
+use crate::LineLoc;
+
+/// Which line samples in inlined code are charged to.
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum AttributionPolicy {
+    /// The innermost project line, inside the inlined function.
+    Innermost,
+    /// The call site the code was inlined at, in the function it was compiled into.
+    Outermost,
+    /// Half to each of the two.
+    Split,
+}
+
+impl AttributionPolicy {
+    pub fn from_name(name: &str) -> PyResult<Self> {
+        match name {
+            "innermost" => Ok(Self::Innermost),
+            "outermost" => Ok(Self::Outermost),
+            "split" => Ok(Self::Split),
+            _ => Err(PyValueError::new_err(format!(
+                "unknown attribution policy {name:?}; expected innermost, outermost or split"
+            ))),
+        }
+    }
+
+    /// The lines to charge an event to, with their share of `hits`.
+    pub fn shares(self, chain: Option<(LineLoc, LineLoc)>, hits: u64) -> Vec<(LineLoc, u64)> {
+        let Some((inner, outer)) = chain else {
+            return Vec::new();
+        };
+        match self {
+            Self::Innermost => vec![(inner, hits)],
+            Self::Outermost => vec![(outer, hits)],
+            Self::Split if inner == outer => vec![(inner, hits)],
+            Self::Split => vec![(inner, hits - hits / 2), (outer, hits / 2)],
+        }
+    }
+}
+
+/// A frame's srcline, relative to the project root, if it lies inside the project.
+pub fn project_line(frame: &StackFrame, project_root: &Path) -> Option<LineLoc> {
+    let srcline = frame.srcline.as_ref()?;
+    let path = Path::new(&srcline.path).strip_prefix(project_root).ok()?;
+    Some(LineLoc {
+        path: path.to_str()?.to_owned(),
+        line: srcline.line as u64,
+    })
+}
+
+/// The innermost project line of an event, and the project line it was inlined at.
+///
+/// The second line is the outermost project line among the frames inlined into the
+/// same machine frame as the first, so both are the same line if the first wasn't
+/// inlined into project code.
+pub fn inline_chain(event: &Event, project_root: &Path) -> Option<(LineLoc, LineLoc)> {
+    let (start, inner) = event
+        .stack
+        .iter()
+        .enumerate()
+        .find_map(|(i, frame)| project_line(frame, project_root).map(|loc| (i, loc)))?;
+    let mut outer = inner.clone();
+    for (i, frame) in event.stack.iter().enumerate().skip(start + 1) {
+        // Frames up to and including the first that isn't inlined share a machine
+        // frame with the innermost one.
+        if !event.stack[i - 1].inlined {
+            break;
+        }
+        if let Some(loc) = project_line(frame, project_root) {
+            outer = loc;
+        }
+    }
+    Some((inner, outer))
+}
+
+/// Hits of inlined project lines per call site they were inlined at, for each event
+/// kind.
+#[derive(Debug, Clone, Default)]
+pub struct InlineSites {
+    kinds: Vec<String>,
+    // Indexed like `kinds`.
+    per_kind: Vec<HashMap<LineLoc, HashMap<LineLoc, u64>>>,
+}
+
+impl InlineSites {
+    fn add_kind(&mut self, kind: &str) -> usize {
+        if let Some(id) = self.kinds.iter().position(|k| k == kind) {
+            return id;
+        }
+        self.kinds.push(kind.to_owned());
+        self.per_kind.push(HashMap::new());
+        self.kinds.len() - 1
+    }
+
+    pub fn add(&mut self, kind: &str, inner: &LineLoc, outer: &LineLoc, hits: u64) {
+        let kind_id = self.add_kind(kind);
+        *self.per_kind[kind_id]
+            .entry(inner.clone())
+            .or_default()
+            .entry(outer.clone())
+            .or_insert(0) += hits;
+    }
+
+    /// Hits of a kind at an inlined line per call site, most first.
+    pub fn sites(&self, kind: &str, inner: &LineLoc) -> Vec<(LineLoc, u64)> {
+        let mut sites: Vec<_> = self
+            .kinds
+            .iter()
+            .position(|k| k == kind)
+            .and_then(|kind_id| self.per_kind[kind_id].get(inner))
+            .map(|sites| sites.iter().map(|(loc, &n)| (loc.clone(), n)).collect())
+            .unwrap_or_default();
+        sites.sort_by(|(a_loc, a), (b_loc, b)| {
+            b.cmp(a)
+                .then_with(|| (&a_loc.path, a_loc.line).cmp(&(&b_loc.path, b_loc.line)))
+        });
+        sites
+    }
+
+    /// Combine several sets of call sites, scaling each by its weight.
+    pub fn merge<'a>(parts: impl IntoIterator<Item = (&'a InlineSites, f64)>) -> Self {
+        let mut weighted: HashMap<(&str, &LineLoc, &LineLoc), f64> = HashMap::new();
+        for (sites, weight) in parts {
+            for (kind, inners) in sites.kinds.iter().zip(&sites.per_kind) {
+                for (inner, outers) in inners {
+                    for (outer, &n) in outers {
+                        *weighted.entry((kind, inner, outer)).or_insert(0.0) += n as f64 * weight;
+                    }
+                }
+            }
+        }
+
+        let mut merged = InlineSites::default();
+        for ((kind, inner, outer), n) in weighted {
+            let n = n.round() as u64;
+            if n > 0 {
+                merged.add(kind, inner, outer, n);
+            }
+        }
+        merged
+    }
+}
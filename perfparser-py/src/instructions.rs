@@ -0,0 +1,108 @@
+use std::collections::HashMap;
+
+use perfparser::Event;
+
+/// Hits per sampled instruction, for each event kind.
+///
+/// Instructions are keyed by symbol and offset into it, as perf reports them, rather
+/// than by address, so they line up with a disassembly of the binary no matter where
+/// it was loaded.
+#[derive(Debug, Clone, Default)]
+pub struct InstructionHits {
+    kinds: Vec<String>,
+    // Indexed like `kinds`.
+    per_kind: Vec<HashMap<String, HashMap<u64, u64>>>,
+}
+
+impl InstructionHits {
+    fn add_kind(&mut self, kind: &str) -> usize {
+        if let Some(id) = self.kinds.iter().position(|k| k == kind) {
+            return id;
+        }
+        self.kinds.push(kind.to_owned());
+        self.per_kind.push(HashMap::new());
+        self.kinds.len() - 1
+    }
+
+    /// Charge `hits` to the event's leaf frame, if perf resolved it to a symbol.
+    ///
+    /// Frames inlined into the leaf share its offset, but only the symbol they were
+    /// inlined into is in the binary, so that's the one charged.
+    pub fn add(&mut self, kind: &str, event: &Event, hits: u64) {
+        let Some(leaf) = event.stack.iter().find(|frame| !frame.inlined) else {
+            return;
+        };
+        let Some(offset) = leaf.offset else {
+            return;
+        };
+        let kind_id = self.add_kind(kind);
+        let symbols = &mut self.per_kind[kind_id];
+        // Look up before inserting, to copy the name only for new symbols.
+        if !symbols.contains_key(&leaf.funcname) {
+            symbols.insert(leaf.funcname.clone(), HashMap::new());
+        }
+        let offsets = symbols.get_mut(&leaf.funcname).unwrap();
+        *offsets.entry(offset).or_insert(0) += hits;
+    }
+
+    /// Hits of a kind per offset into `symbol`.
+    pub fn symbol(&self, kind: &str, symbol: &str) -> HashMap<u64, u64> {
+        self.kinds
+            .iter()
+            .position(|k| k == kind)
+            .and_then(|kind_id| self.per_kind[kind_id].get(symbol))
+            .cloned()
+            .unwrap_or_default()
+    }
+
+    /// Hits of a kind per symbol, summed over the symbol's instructions.
+    pub fn symbol_totals(&self, kind: &str) -> HashMap<String, u64> {
+        match self.kinds.iter().position(|k| k == kind) {
+            Some(kind_id) => self.per_kind[kind_id]
+                .iter()
+                .map(|(symbol, offsets)| (symbol.clone(), offsets.values().sum()))
+                .collect(),
+            None => HashMap::new(),
+        }
+    }
+
+    /// Hits of a kind over every sampled instruction, in the project or not.
+    pub fn total(&self, kind: &str) -> u64 {
+        match self.kinds.iter().position(|k| k == kind) {
+            Some(kind_id) => self.per_kind[kind_id]
+                .values()
+                .flat_map(|offsets| offsets.values())
+                .sum(),
+            None => 0,
+        }
+    }
+
+    /// Combine several sets of hits, scaling each by its weight.
+    pub fn merge<'a>(parts: impl IntoIterator<Item = (&'a InstructionHits, f64)>) -> Self {
+        let mut weighted: HashMap<(&str, &str, u64), f64> = HashMap::new();
+        for (hits, weight) in parts {
+            for (kind, symbols) in hits.kinds.iter().zip(&hits.per_kind) {
+                for (symbol, offsets) in symbols {
+                    for (&offset, &n) in offsets {
+                        *weighted.entry((kind, symbol, offset)).or_insert(0.0) += n as f64 * weight;
+                    }
+                }
+            }
+        }
+
+        let mut merged = InstructionHits::default();
+        for ((kind, symbol, offset), n) in weighted {
+            let n = n.round() as u64;
+            if n == 0 {
+                continue;
+            }
+            let kind_id = merged.add_kind(kind);
+            *merged.per_kind[kind_id]
+                .entry(symbol.to_owned())
+                .or_default()
+                .entry(offset)
+                .or_insert(0) += n;
+        }
+        merged
+    }
+}
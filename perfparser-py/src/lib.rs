@@ -1,12 +1,26 @@
+mod alloc;
+mod counters;
+mod inlining;
+mod instructions;
+mod live;
+mod offcpu;
 mod perf;
+mod threads;
+mod timeline;
 
 use std::{
+    fs,
     hash::{DefaultHasher, Hash as _, Hasher as _},
-    path::Path,
+    path::{Path, PathBuf},
 };
 
+use alloc::AttributedAllocs;
+use inlining::AttributionPolicy;
+use live::LiveProfile;
 use perf::AttributedPerf;
 use pyo3::prelude::*;
+use threads::{ThreadSummary, ThreadUtilization};
+use timeline::Phase;
 
 #[pyclass]
 #[derive(Debug, Clone, PartialEq, Eq, Hash)]
@@ -39,13 +53,102 @@ impl LineLoc {
     }
 }
 
-/// Formats the sum of two numbers as string.
+/// Attribute the samples of a perf.data file to lines under `project_root_str`,
+/// with hits kept per event kind, sampled instruction, thread and time window.
+///
+/// `policy` picks which line samples in inlined code are charged to: `"innermost"`,
+/// `"outermost"` (the call site it was inlined at), or `"split"` between the two.
+/// With a `fraction` below 1, only a uniform subsample of that share of the events
+/// is attributed, and the profile's `sampled_fraction` records it. The GIL is
+/// released meanwhile, so other threads can use the profiles loaded so far.
 #[pyfunction]
-fn get_perf_data(data_path_str: &str, project_root_str: &str) -> PyResult<AttributedPerf> {
+#[pyo3(signature = (data_path_str, project_root_str, policy="innermost", fraction=1.0))]
+fn get_perf_data(
+    py: Python<'_>,
+    data_path_str: &str,
+    project_root_str: &str,
+    policy: &str,
+    fraction: f64,
+) -> PyResult<AttributedPerf> {
+    let policy = AttributionPolicy::from_name(policy)?;
     let path = Path::new(data_path_str);
     let project_root = Path::new(project_root_str);
-    let script_output = perf::run_perf_script(path)?;
-    let data = perf::parse_and_attribute(&script_output[..], project_root)?;
+    let data =
+        py.allow_threads(|| perf::load_and_attribute(path, project_root, policy, fraction))?;
+    Ok(data)
+}
+
+/// Whether `get_perf_data` reads the file itself rather than through `perf script`,
+/// in which case a `fraction` below 1 saves most of the work.
+#[pyfunction]
+fn reads_perf_data_directly(data_path_str: &str) -> bool {
+    perf::reads_directly(Path::new(data_path_str))
+}
+
+/// Like `get_perf_data`, but from an already saved
+/// `perf script -F+pid,+srcline --full-source-path --inline` output.
+#[pyfunction]
+#[pyo3(signature = (script_path_str, project_root_str, policy="innermost"))]
+fn get_perf_data_from_script(
+    script_path_str: &str,
+    project_root_str: &str,
+    policy: &str,
+) -> PyResult<AttributedPerf> {
+    let policy = AttributionPolicy::from_name(policy)?;
+    let script = fs::File::open(script_path_str)?;
+    let project_root = Path::new(project_root_str);
+    let data = perf::parse_and_attribute(script, project_root, policy)?;
+    Ok(data)
+}
+
+/// Start profiling a running process, attributing its samples to project lines as
+/// they're recorded.
+///
+/// Only the last `window_secs` of samples are kept, in buckets of `bucket_secs`.
+/// Stacks are unwound as `perf record --call-graph` does with `call_graph`, which
+/// should match how the recordings it's compared with were made.
+#[pyfunction]
+#[pyo3(signature = (pid, project_root_str, policy="innermost", window_secs=30.0, bucket_secs=1.0, call_graph="dwarf"))]
+fn start_live_profile(
+    pid: u32,
+    project_root_str: &str,
+    policy: &str,
+    window_secs: f64,
+    bucket_secs: f64,
+    call_graph: &str,
+) -> PyResult<LiveProfile> {
+    let policy = AttributionPolicy::from_name(policy)?;
+    let profile = LiveProfile::start(
+        pid,
+        PathBuf::from(project_root_str),
+        policy,
+        (window_secs * 1e9) as u64,
+        (bucket_secs * 1e9) as u64,
+        call_graph,
+    )?;
+    Ok(profile)
+}
+
+/// Attribute off-CPU (blocked) time, in nanoseconds, to project lines.
+///
+/// `data_path_str` must be a recording of `sched:sched_switch` with call stacks and
+/// `--switch-events`.
+#[pyfunction]
+fn get_offcpu_data(data_path_str: &str, project_root_str: &str) -> PyResult<AttributedPerf> {
+    let path = Path::new(data_path_str);
+    let project_root = Path::new(project_root_str);
+    let script_output = perf::run_perf_script(path, &["--show-switch-events"])?;
+    let data = offcpu::parse_and_attribute_offcpu(&script_output[..], project_root)?;
+    Ok(data)
+}
+
+/// Attribute allocations recorded by probes on the C allocator to project lines.
+#[pyfunction]
+fn get_alloc_data(data_path_str: &str, project_root_str: &str) -> PyResult<AttributedAllocs> {
+    let path = Path::new(data_path_str);
+    let project_root = Path::new(project_root_str);
+    let script_output = perf::run_perf_script(path, &[])?;
+    let data = alloc::parse_and_attribute_allocs(&script_output[..], project_root)?;
     Ok(data)
 }
 
@@ -54,6 +157,16 @@ fn get_perf_data(data_path_str: &str, project_root_str: &str) -> PyResult<Attrib
 fn perfparser(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<LineLoc>()?;
     m.add_class::<AttributedPerf>()?;
+    m.add_class::<AttributedAllocs>()?;
+    m.add_class::<Phase>()?;
+    m.add_class::<ThreadSummary>()?;
+    m.add_class::<ThreadUtilization>()?;
+    m.add_class::<LiveProfile>()?;
     m.add_function(wrap_pyfunction!(get_perf_data, m)?)?;
+    m.add_function(wrap_pyfunction!(reads_perf_data_directly, m)?)?;
+    m.add_function(wrap_pyfunction!(get_perf_data_from_script, m)?)?;
+    m.add_function(wrap_pyfunction!(start_live_profile, m)?)?;
+    m.add_function(wrap_pyfunction!(get_offcpu_data, m)?)?;
+    m.add_function(wrap_pyfunction!(get_alloc_data, m)?)?;
     Ok(())
 }
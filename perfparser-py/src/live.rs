@@ -0,0 +1,203 @@
+use std::collections::VecDeque;
+use std::io;
+use std::path::{Path, PathBuf};
+use std::process::{Child, Command, Stdio};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+
+use perfparser::{Event, Parser};
+use pyo3::{pyclass, pymethods};
+
+use crate::inlining::AttributionPolicy;
+use crate::perf::{AttributedPerf, AttributedPerfBuilder};
+use crate::LineLoc;
+
+/// The profile of the last few buckets of a live recording.
+///
+/// Only the most recent `max_buckets` completed buckets are kept, so memory stays
+/// bounded however long the target runs.
+struct RollingWindow {
+    bucket_ns: u64,
+    max_buckets: usize,
+    completed: VecDeque<AttributedPerf>,
+    current: AttributedPerfBuilder,
+    current_start_ns: Option<u64>,
+    last_timestamp_ns: u64,
+}
+
+impl RollingWindow {
+    fn new(bucket_ns: u64, max_buckets: usize) -> Self {
+        Self {
+            bucket_ns,
+            max_buckets,
+            completed: VecDeque::with_capacity(max_buckets + 1),
+            current: AttributedPerfBuilder::new(),
+            current_start_ns: None,
+            last_timestamp_ns: 0,
+        }
+    }
+
+    fn add(&mut self, event: &Event, project_root: &Path, policy: AttributionPolicy) {
+        // Events without a timestamp belong with the ones around them.
+        let timestamp_ns = event.timestamp_ns.unwrap_or(self.last_timestamp_ns);
+        self.last_timestamp_ns = timestamp_ns;
+        let start_ns = *self.current_start_ns.get_or_insert(timestamp_ns);
+        let elapsed_ns = timestamp_ns.saturating_sub(start_ns);
+        if elapsed_ns >= self.bucket_ns {
+            self.complete_bucket();
+            // Skip over buckets nothing was sampled in, e.g. while the target idled.
+            let skipped = elapsed_ns / self.bucket_ns;
+            for _ in 1..skipped.min(self.max_buckets as u64 + 1) {
+                self.completed
+                    .push_back(AttributedPerfBuilder::new().finish());
+            }
+            while self.completed.len() > self.max_buckets {
+                self.completed.pop_front();
+            }
+            self.current_start_ns = Some(start_ns + skipped * self.bucket_ns);
+        }
+        self.current.attribute(event, project_root, policy);
+    }
+
+    fn complete_bucket(&mut self) {
+        let builder = std::mem::replace(&mut self.current, AttributedPerfBuilder::new());
+        self.completed.push_back(builder.finish());
+    }
+
+    fn snapshot(&self) -> AttributedPerf {
+        let parts: Vec<_> = self.completed.iter().map(|perf| (perf, 1.0)).collect();
+        AttributedPerf::merge_weighted(&parts)
+    }
+}
+
+/// Spawn `perf record` on a running process, streaming its samples through
+/// `perf script` without writing a perf.data file. `perf script` also unwinds
+/// DWARF call graphs from the streamed stack dumps.
+fn spawn_perf(pid: u32, call_graph: &str) -> io::Result<(Child, Child)> {
+    let mut record = Command::new("perf")
+        .args([
+            "record",
+            "-F997",
+            "--call-graph",
+            call_graph,
+            "-o",
+            "-",
+            "-p",
+        ])
+        .arg(pid.to_string())
+        .stdin(Stdio::null())
+        .stdout(Stdio::piped())
+        .stderr(Stdio::null())
+        .spawn()?;
+    let samples = record.stdout.take().unwrap();
+    let script = Command::new("perf")
+        .args([
+            "script",
+            "-F+pid,+srcline",
+            "--full-source-path",
+            "--inline",
+            "-i",
+            "-",
+        ])
+        .stdin(samples)
+        .stdout(Stdio::piped())
+        .stderr(Stdio::null())
+        .spawn();
+    match script {
+        Ok(script) => Ok((record, script)),
+        Err(err) => {
+            let _ = record.kill();
+            let _ = record.wait();
+            Err(err)
+        }
+    }
+}
+
+/// A profile of a long-running process, attributed as it's recorded.
+///
+/// Samples are bucketed by time, and only the last few buckets are kept, so
+/// `snapshot` always describes the target's recent behaviour.
+#[pyclass]
+pub struct LiveProfile {
+    window: Arc<Mutex<RollingWindow>>,
+    record: Child,
+    script: Child,
+    reader: Option<JoinHandle<()>>,
+}
+
+impl LiveProfile {
+    pub fn start(
+        pid: u32,
+        project_root: PathBuf,
+        policy: AttributionPolicy,
+        window_ns: u64,
+        bucket_ns: u64,
+        call_graph: &str,
+    ) -> io::Result<Self> {
+        let bucket_ns = bucket_ns.max(1);
+        let max_buckets = window_ns.div_ceil(bucket_ns).max(1) as usize;
+        let window = Arc::new(Mutex::new(RollingWindow::new(bucket_ns, max_buckets)));
+        let (record, mut script) = spawn_perf(pid, call_graph)?;
+        let output = script.stdout.take().unwrap();
+        let reader = {
+            let window = Arc::clone(&window);
+            thread::spawn(move || {
+                for event in Parser::new(output) {
+                    window.lock().unwrap().add(&event, &project_root, policy);
+                }
+            })
+        };
+        Ok(Self {
+            window,
+            record,
+            script,
+            reader: Some(reader),
+        })
+    }
+}
+
+#[pymethods]
+impl LiveProfile {
+    /// The profile of the completed buckets in the window, oldest hits first to go.
+    ///
+    /// Empty until the first bucket completes.
+    pub fn snapshot(&self) -> AttributedPerf {
+        self.window.lock().unwrap().snapshot()
+    }
+
+    /// The span the snapshot covers so far, in nanoseconds.
+    #[getter]
+    pub fn covered_ns(&self) -> u64 {
+        let window = self.window.lock().unwrap();
+        window.completed.len() as u64 * window.bucket_ns
+    }
+
+    /// The `k` hottest lines in the window, with their share of its hits.
+    pub fn top_lines(&self, k: usize) -> Vec<(LineLoc, f64)> {
+        let mut lines = self.snapshot().tabulate(None).unwrap_or_default();
+        lines.truncate(k);
+        lines
+    }
+
+    /// Whether perf is still recording, i.e. the target hasn't exited.
+    pub fn is_running(&mut self) -> bool {
+        matches!(self.record.try_wait(), Ok(None))
+    }
+
+    /// Stop recording. The samples attributed so far stay available.
+    pub fn stop(&mut self) {
+        let _ = self.record.kill();
+        let _ = self.record.wait();
+        // perf script exits once it has read everything perf record wrote.
+        let _ = self.script.wait();
+        if let Some(reader) = self.reader.take() {
+            let _ = reader.join();
+        }
+    }
+}
+
+impl Drop for LiveProfile {
+    fn drop(&mut self) {
+        self.stop();
+    }
+}
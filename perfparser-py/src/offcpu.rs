@@ -0,0 +1,53 @@
+use std::collections::HashMap;
+use std::io;
+use std::path::Path;
+
+use perfparser::{Event, Parser, EVENT_SWITCH_IN};
+
+use crate::perf::{attribute_to_line, AttributedPerf, AttributedPerfBuilder};
+
+const EVENT_SCHED_SWITCH: &str = "sched:sched_switch";
+
+/// Attribute the time threads spend blocked off-CPU to the project lines they
+/// blocked at.
+///
+/// Expects a recording of `sched:sched_switch` with stacks plus `--switch-events`
+/// side-band records. A thread is blocked from the `sched_switch` that takes it off
+/// a CPU until the next switch that puts it back on, and that time, in nanoseconds,
+/// is charged to the stack it was switched out with. Preemptions, where the thread
+/// stays runnable, are waiting for a CPU rather than blocking, so they're skipped.
+pub fn parse_and_attribute_offcpu<R: io::Read>(
+    r: R,
+    project_root: &Path,
+) -> io::Result<AttributedPerf> {
+    let parser = Parser::new(r);
+    let mut builder = AttributedPerfBuilder::new();
+    let mut switched_out: HashMap<u32, Event> = HashMap::new();
+
+    for event in parser {
+        let Some(tid) = event.tid else {
+            continue;
+        };
+        if event.kind == EVENT_SCHED_SWITCH {
+            let preempted = event
+                .trace_field("prev_state")
+                .is_some_and(|state| state.starts_with('R'));
+            if preempted {
+                switched_out.remove(&tid);
+            } else {
+                switched_out.insert(tid, event);
+            }
+        } else if event.kind == EVENT_SWITCH_IN {
+            let Some(out_event) = switched_out.remove(&tid) else {
+                continue;
+            };
+            let (Some(out_ns), Some(in_ns)) = (out_event.timestamp_ns, event.timestamp_ns) else {
+                continue;
+            };
+            let lineloc = attribute_to_line(&out_event, project_root);
+            builder.add(&out_event, lineloc, in_ns.saturating_sub(out_ns));
+        }
+    }
+
+    Ok(builder.finish())
+}
@@ -4,14 +4,28 @@ use std::io;
 use std::path::Path;
 use std::process::Command;
 
-use perfparser::Parser;
-use pyo3::{pyclass, pymethods};
+use perfparser::perfdata::PerfDataFile;
+use perfparser::{Event, Parser, Subsample};
+use pyo3::exceptions::{PyIndexError, PyKeyError};
+use pyo3::{pyclass, pymethods, PyRef, PyResult};
 
+use crate::counters::EventCounters;
+use crate::inlining::{inline_chain, project_line, AttributionPolicy, InlineSites};
+use crate::instructions::InstructionHits;
+use crate::threads::{ThreadProfile, ThreadProfileBuilder, ThreadUtilization};
+use crate::timeline::{Phase, Timeline, TimelineBuilder, DEFAULT_WINDOW_NS};
 use crate::LineLoc;
 
-pub fn run_perf_script(data_path: &Path) -> io::Result<Vec<u8>> {
+pub fn run_perf_script(data_path: &Path, extra_args: &[&str]) -> io::Result<Vec<u8>> {
     let output = Command::new("perf")
-        .args(&["script", "-F+srcline", "--full-source-path", "-i"])
+        .args(&[
+            "script",
+            "-F+pid,+srcline",
+            "--full-source-path",
+            "--inline",
+        ])
+        .args(extra_args)
+        .arg("-i")
         .arg(data_path)
         .output()?;
     if output.status.success() {
@@ -21,61 +35,457 @@ pub fn run_perf_script(data_path: &Path) -> io::Result<Vec<u8>> {
     }
 }
 
-pub fn parse_and_attribute<R: io::Read>(r: R, project_root: &Path) -> io::Result<AttributedPerf> {
-    let is_srcline_good = |path: &Path| {
-        path.strip_prefix(project_root)
-            .ok()
-            .and_then(Path::to_str)
-            .map(str::to_owned)
-    };
-    let parser = Parser::new(r);
-    let mut hit_count = HashMap::new();
-
-    for event in parser {
-        let lineloc = event
-            .stack
-            .iter()
-            .filter_map(|frame| frame.srcline.as_ref())
-            .find_map(|srcline| {
-                is_srcline_good(Path::new(&srcline.path)).map(|path| LineLoc {
-                    path,
-                    line: srcline.line as u64,
-                })
-            });
-        if let Some(lineloc) = lineloc {
-            *hit_count.entry(lineloc).or_insert(0) += event.period.unwrap_or(1) as u64;
+/// The project line an event is charged to: the first frame, from the leaf, whose
+/// srcline lies inside the project.
+pub fn attribute_to_line(event: &Event, project_root: &Path) -> Option<LineLoc> {
+    event
+        .stack
+        .iter()
+        .find_map(|frame| project_line(frame, project_root))
+}
+
+/// Event kinds that make the best default view of a profile, most preferred first.
+const PRIMARY_EVENT_KINDS: &[&str] = &["cycles", "cpu-clock", "task-clock"];
+
+/// Whether `load_and_attribute` reads the file itself, so that attributing a fraction
+/// of its samples only costs that fraction of the work. Through `perf script`, every
+/// sample is decoded and unwound whatever the fraction.
+pub fn reads_directly(data_path: &Path) -> bool {
+    PerfDataFile::open(data_path).is_ok()
+}
+
+/// Attribute the samples of a perf.data file, or a uniform `fraction` of them, to
+/// project lines.
+///
+/// The file is read directly when possible, and through `perf script` when the
+/// reader doesn't support it, e.g. when it was recorded with compression. Other
+/// errors, like an unreadable or corrupt file, are returned.
+pub fn load_and_attribute(
+    data_path: &Path,
+    project_root: &Path,
+    policy: AttributionPolicy,
+    fraction: f64,
+) -> io::Result<AttributedPerf> {
+    let subsample = Subsample::new(fraction);
+    let mut data = PerfDataFile::open(data_path)
+        .and_then(|file| {
+            let mut events = file.sampled_events(subsample)?;
+            let data = attribute_events(events.by_ref(), project_root, policy);
+            // A profile cut short by a malformed record is not one to report.
+            match events.take_error() {
+                Some(e) => Err(e),
+                None => Ok(data),
+            }
+        })
+        .or_else(|e| {
+            if e.kind() != io::ErrorKind::Unsupported {
+                return Err(e);
+            }
+            let script_output = run_perf_script(data_path, &[])?;
+            let events = Parser::new(&script_output[..])
+                .enumerate()
+                .filter(|(i, _)| subsample.keeps(*i as u64))
+                .map(|(_, event)| event);
+            Ok::<_, io::Error>(attribute_events(events, project_root, policy))
+        })?;
+    data.sampled_fraction = fraction.min(1.0);
+    Ok(data)
+}
+
+/// Attribute sampled events from `perf script` output to project lines, charging
+/// samples in inlined code according to `policy`.
+pub fn parse_and_attribute<R: io::Read>(
+    r: R,
+    project_root: &Path,
+    policy: AttributionPolicy,
+) -> io::Result<AttributedPerf> {
+    Ok(attribute_events(Parser::new(r), project_root, policy))
+}
+
+fn attribute_events(
+    events: impl Iterator<Item = Event>,
+    project_root: &Path,
+    policy: AttributionPolicy,
+) -> AttributedPerf {
+    let mut builder = AttributedPerfBuilder::new();
+    for event in events {
+        builder.attribute(&event, project_root, policy);
+    }
+    builder.finish()
+}
+
+pub struct AttributedPerfBuilder {
+    counters: EventCounters,
+    instructions: InstructionHits,
+    inline_sites: InlineSites,
+    samples: HashMap<String, u64>,
+    // Indexed like the kinds of `counters`; only the primary kind's are kept.
+    timelines: Vec<TimelineBuilder>,
+    threads: Vec<ThreadProfileBuilder>,
+}
+
+impl AttributedPerfBuilder {
+    pub fn new() -> Self {
+        Self {
+            counters: EventCounters::default(),
+            instructions: InstructionHits::default(),
+            inline_sites: InlineSites::default(),
+            samples: HashMap::new(),
+            timelines: Vec::new(),
+            threads: Vec::new(),
+        }
+    }
+
+    /// Charge an event to project lines, splitting it between inlined code and its
+    /// call site according to `policy`.
+    pub fn attribute(&mut self, event: &Event, project_root: &Path, policy: AttributionPolicy) {
+        let chain = inline_chain(event, project_root);
+        let hits = event.period.unwrap_or(1) as u64;
+        if let Some((inner, outer)) = &chain {
+            if inner != outer {
+                self.inline_sites.add(event.base_kind(), inner, outer, hits);
+            }
+        }
+        self.add_shares(event, &policy.shares(chain, hits), hits);
+    }
+
+    /// Charge `hits` of the event's kind to the line it was attributed to, if any.
+    pub fn add(&mut self, event: &Event, lineloc: Option<LineLoc>, hits: u64) {
+        let shares: Vec<_> = lineloc.into_iter().map(|loc| (loc, hits)).collect();
+        self.add_shares(event, &shares, hits);
+    }
+
+    /// Charge `hits` of the event's kind to several lines, each getting its share.
+    pub fn add_shares(&mut self, event: &Event, shares: &[(LineLoc, u64)], hits: u64) {
+        let kind = event.base_kind();
+        let kind_id = self.counters.add_kind(kind);
+        self.instructions.add(kind, event, hits);
+        if kind_id == self.timelines.len() {
+            self.samples.insert(kind.to_owned(), 0);
+            self.timelines.push(TimelineBuilder::new(DEFAULT_WINDOW_NS));
+            self.threads
+                .push(ThreadProfileBuilder::new(DEFAULT_WINDOW_NS));
+        }
+        *self.samples.get_mut(kind).unwrap() += 1;
+        self.threads[kind_id].add(event, shares, hits);
+        for (lineloc, share) in shares {
+            if let Some(timestamp_ns) = event.timestamp_ns {
+                self.timelines[kind_id].add(timestamp_ns, lineloc, *share);
+            }
+            self.counters.add(kind_id, lineloc.clone(), *share);
         }
     }
 
-    let total_hits = hit_count.values().sum::<u64>();
-    Ok(AttributedPerf {
-        hit_count,
-        total_hits,
-    })
+    pub fn finish(self) -> AttributedPerf {
+        let primary = primary_kind(&self.counters);
+        let (timeline, threads) = match primary {
+            Some(kind_id) => {
+                let timeline = self.timelines.into_iter().nth(kind_id).unwrap();
+                let threads = self.threads.into_iter().nth(kind_id).unwrap();
+                (timeline.finish(), threads.finish())
+            }
+            None => (Timeline::default(), ThreadProfile::default()),
+        };
+        AttributedPerf {
+            counters: self.counters,
+            instructions: self.instructions,
+            inline_sites: self.inline_sites,
+            samples: self.samples,
+            sampled_fraction: 1.0,
+            primary,
+            timeline,
+            threads,
+        }
+    }
 }
 
+/// The kind `hit_count`, `total_hits` and the time and thread breakdowns describe.
+fn primary_kind(counters: &EventCounters) -> Option<usize> {
+    PRIMARY_EVENT_KINDS
+        .iter()
+        .find_map(|kind| counters.kind_id(kind))
+        .or_else(|| (!counters.kinds().is_empty()).then_some(0))
+}
+
+/// Hits attributed to project lines, kept separately for each kind of event recorded.
+///
+/// Methods that take an `event` default to the primary kind: cycles if they were
+/// recorded, otherwise the first kind seen. The timeline and per-thread breakdown
+/// only cover the primary kind.
+///
+/// Profiles of a subsample of a recording count the hits of that subsample only.
 #[pyclass]
 #[derive(Debug)]
 pub struct AttributedPerf {
-    #[pyo3(get)]
-    pub hit_count: HashMap<LineLoc, u64>,
-    #[pyo3(get)]
-    pub total_hits: u64,
+    pub counters: EventCounters,
+    pub instructions: InstructionHits,
+    pub inline_sites: InlineSites,
+    /// Number of events of each kind, as opposed to their hits.
+    pub samples: HashMap<String, u64>,
+    /// Share of the recording's events that were attributed.
+    pub sampled_fraction: f64,
+    pub primary: Option<usize>,
+    pub timeline: Timeline,
+    pub threads: ThreadProfile,
+}
+
+fn tabulate_hits(hit_count: &HashMap<LineLoc, u64>, total_hits: u64) -> Vec<(LineLoc, f64)> {
+    let total_hits = total_hits as f64;
+    let mut sorted: Vec<_> = hit_count
+        .iter()
+        .map(|(loc, hits)| (loc.clone(), *hits))
+        .collect();
+    sorted.sort_by_key(|&(_, hits)| cmp::Reverse(hits));
+    sorted
+        .into_iter()
+        .map(|(loc, hits)| (loc, hits as f64 / total_hits))
+        .collect()
+}
+
+impl AttributedPerf {
+    fn named_kind_id(&self, event: &str) -> PyResult<usize> {
+        self.counters.kind_id(event).ok_or_else(|| {
+            PyKeyError::new_err(format!(
+                "no {event} events recorded; have {:?}",
+                self.counters.kinds()
+            ))
+        })
+    }
+
+    /// The id of an event kind, or of the primary kind if `event` is `None`.
+    ///
+    /// Profiles without any hits have no primary kind.
+    fn kind_id(&self, event: Option<&str>) -> PyResult<Option<usize>> {
+        event
+            .map(|event| self.named_kind_id(event))
+            .transpose()
+            .map(|id| id.or(self.primary))
+    }
 }
 
 #[pymethods]
 impl AttributedPerf {
-    pub fn tabulate(&self) -> Vec<(LineLoc, f64)> {
-        let total_hits = self.total_hits as f64;
-        let mut sorted: Vec<_> = self
-            .hit_count
+    /// Hits of the primary event kind per line.
+    #[getter]
+    pub fn hit_count(&self) -> HashMap<LineLoc, u64> {
+        match self.primary {
+            Some(kind_id) => self
+                .counters
+                .column(kind_id)
+                .map(|(loc, hits)| (loc.clone(), hits))
+                .collect(),
+            None => HashMap::new(),
+        }
+    }
+
+    #[getter]
+    pub fn total_hits(&self) -> u64 {
+        self.primary
+            .map_or(0, |kind_id| self.counters.total(kind_id))
+    }
+
+    /// Kinds of events recorded, with modifiers like `:u` stripped.
+    #[getter]
+    pub fn event_kinds(&self) -> Vec<String> {
+        self.counters.kinds().to_vec()
+    }
+
+    #[getter]
+    pub fn primary_event(&self) -> Option<String> {
+        self.primary
+            .map(|kind_id| self.counters.kinds()[kind_id].clone())
+    }
+
+    /// Hits of an event kind at one line, or `None` if it has none.
+    #[pyo3(signature = (loc, event=None))]
+    pub fn lookup_hits(&self, loc: LineLoc, event: Option<&str>) -> PyResult<Option<u64>> {
+        Ok(self
+            .kind_id(event)?
+            .and_then(|kind_id| self.counters.get(kind_id, &loc)))
+    }
+
+    /// Share of the recorded events that were attributed: 1 unless the profile was
+    /// loaded from a subsample.
+    #[getter]
+    pub fn sampled_fraction(&self) -> f64 {
+        self.sampled_fraction
+    }
+
+    /// Number of events of a kind that were attributed, however many hits each had.
+    #[pyo3(signature = (event=None))]
+    pub fn sample_count(&self, event: Option<&str>) -> PyResult<u64> {
+        Ok(match self.kind_id(event)? {
+            Some(kind_id) => self.samples[&self.counters.kinds()[kind_id]],
+            None => 0,
+        })
+    }
+
+    #[pyo3(signature = (event=None))]
+    pub fn total_event_hits(&self, event: Option<&str>) -> PyResult<u64> {
+        Ok(self
+            .kind_id(event)?
+            .map_or(0, |kind_id| self.counters.total(kind_id)))
+    }
+
+    #[pyo3(signature = (event=None))]
+    pub fn tabulate(&self, event: Option<&str>) -> PyResult<Vec<(LineLoc, f64)>> {
+        Ok(match self.kind_id(event)? {
+            Some(kind_id) => self.counters.tabulate(kind_id),
+            None => Vec::new(),
+        })
+    }
+
+    /// `scale * numerator / denominator` per line, highest first, for lines with
+    /// `denominator` hits; e.g. cache misses per kilo-instruction with a scale of 1000.
+    pub fn ratio(
+        &self,
+        numerator: &str,
+        denominator: &str,
+        scale: f64,
+    ) -> PyResult<Vec<(LineLoc, f64)>> {
+        let numerator = self.named_kind_id(numerator)?;
+        let denominator = self.named_kind_id(denominator)?;
+        Ok(self.counters.ratio(numerator, denominator, scale))
+    }
+
+    /// Hits of an event kind per offset into `symbol`, counting each event's sampled
+    /// instruction only.
+    #[pyo3(signature = (symbol, event=None))]
+    pub fn instruction_hits(
+        &self,
+        symbol: &str,
+        event: Option<&str>,
+    ) -> PyResult<HashMap<u64, u64>> {
+        Ok(match self.kind_id(event)? {
+            Some(kind_id) => self
+                .instructions
+                .symbol(&self.counters.kinds()[kind_id], symbol),
+            None => HashMap::new(),
+        })
+    }
+
+    /// Hits of an event kind over all sampled instructions, whether or not they're
+    /// in the project: the total `instruction_hits` and `symbol_hits` are shares of.
+    #[pyo3(signature = (event=None))]
+    pub fn total_instruction_hits(&self, event: Option<&str>) -> PyResult<u64> {
+        Ok(match self.kind_id(event)? {
+            Some(kind_id) => self.instructions.total(&self.counters.kinds()[kind_id]),
+            None => 0,
+        })
+    }
+
+    /// Hits of an event kind per symbol that contained a sampled instruction.
+    #[pyo3(signature = (event=None))]
+    pub fn symbol_hits(&self, event: Option<&str>) -> PyResult<HashMap<String, u64>> {
+        Ok(match self.kind_id(event)? {
+            Some(kind_id) => self
+                .instructions
+                .symbol_totals(&self.counters.kinds()[kind_id]),
+            None => HashMap::new(),
+        })
+    }
+
+    /// The call sites an inlined line was inlined at, with the hits of an event kind
+    /// it got at each, most first. Empty if the line was never sampled inlined.
+    #[pyo3(signature = (loc, event=None))]
+    pub fn inlined_into(&self, loc: LineLoc, event: Option<&str>) -> PyResult<Vec<(LineLoc, u64)>> {
+        Ok(match self.kind_id(event)? {
+            Some(kind_id) => self
+                .inline_sites
+                .sites(&self.counters.kinds()[kind_id], &loc),
+            None => Vec::new(),
+        })
+    }
+
+    /// How busy each thread of the target was, and how evenly work was spread.
+    pub fn thread_utilization(&self) -> ThreadUtilization {
+        self.threads.utilization.clone()
+    }
+
+    /// Like `tabulate`, but only for the hits of one thread.
+    pub fn tabulate_thread(&self, tid: u32) -> Vec<(LineLoc, f64)> {
+        match self.threads.hit_count.get(&tid) {
+            Some(hit_count) => tabulate_hits(hit_count, hit_count.values().sum()),
+            None => Vec::new(),
+        }
+    }
+
+    /// Width of the time windows hits are bucketed into, in nanoseconds.
+    pub fn time_window_ns(&self) -> u64 {
+        self.timeline.window_ns
+    }
+
+    /// Phases of the recording with distinct hotspots, in time order.
+    pub fn phases(&self) -> Vec<Phase> {
+        self.timeline.phases().to_vec()
+    }
+
+    /// The `k` hottest lines in a phase, with their share of the phase's hits.
+    pub fn top_lines_in_phase(&self, phase: usize, k: usize) -> PyResult<Vec<(LineLoc, f64)>> {
+        self.timeline
+            .top_lines_in_phase(phase, k)
+            .ok_or_else(|| PyIndexError::new_err(format!("no phase {phase}")))
+    }
+
+    /// The `k` hottest lines between two offsets (in nanoseconds) from the start of the
+    /// recording, with their share of the hits in that range.
+    pub fn top_lines_in_range(&self, start_ns: u64, end_ns: u64, k: usize) -> Vec<(LineLoc, f64)> {
+        self.timeline.top_lines_in_range(start_ns, end_ns, k)
+    }
+
+    /// Combine several profiles into one, scaling each profile's hits by its weight.
+    ///
+    /// Separate recordings don't share a clock or thread IDs, so the time windows and
+    /// per-thread breakdown of a merge of several profiles are empty.
+    #[staticmethod]
+    pub fn merge(parts: Vec<(PyRef<'_, AttributedPerf>, f64)>) -> Self {
+        Self::merge_weighted(
+            &parts
+                .iter()
+                .map(|(perf, weight)| (&**perf, *weight))
+                .collect::<Vec<_>>(),
+        )
+    }
+}
+
+impl AttributedPerf {
+    /// Like `merge`, for profiles that aren't owned by Python.
+    pub fn merge_weighted(parts: &[(&AttributedPerf, f64)]) -> Self {
+        let counters =
+            EventCounters::merge(parts.iter().map(|(perf, weight)| (&perf.counters, *weight)));
+        let instructions = InstructionHits::merge(
+            parts
+                .iter()
+                .map(|(perf, weight)| (&perf.instructions, *weight)),
+        );
+        let inline_sites = InlineSites::merge(
+            parts
+                .iter()
+                .map(|(perf, weight)| (&perf.inline_sites, *weight)),
+        );
+        let mut samples = HashMap::new();
+        for (perf, _) in parts {
+            for (kind, n) in &perf.samples {
+                *samples.entry(kind.clone()).or_insert(0) += n;
+            }
+        }
+        let sampled_fraction = parts
             .iter()
-            .map(|(loc, hits)| (loc.clone(), *hits))
-            .collect();
-        sorted.sort_by_key(|&(_, hits)| cmp::Reverse(hits));
-        sorted
-            .into_iter()
-            .map(|(loc, hits)| (loc, hits as f64 / total_hits))
-            .collect()
+            .map(|(perf, _)| perf.sampled_fraction)
+            .fold(1.0, f64::min);
+        let (timeline, threads) = match parts {
+            [(perf, _)] => (perf.timeline.clone(), perf.threads.clone()),
+            _ => (Timeline::default(), ThreadProfile::default()),
+        };
+        AttributedPerf {
+            primary: primary_kind(&counters),
+            counters,
+            instructions,
+            inline_sites,
+            samples,
+            sampled_fraction,
+            timeline,
+            threads,
+        }
     }
 }
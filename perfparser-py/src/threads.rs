@@ -0,0 +1,191 @@
+use std::cmp;
+use std::collections::{HashMap, HashSet};
+
+use perfparser::Event;
+use pyo3::pyclass;
+
+use crate::LineLoc;
+
+/// Threads busy for less than this share of the run count as idle.
+const IDLE_UTILIZATION: f64 = 0.1;
+
+/// How one thread of the target spent the run.
+#[pyclass]
+#[derive(Debug, Clone)]
+pub struct ThreadSummary {
+    #[pyo3(get)]
+    pub tid: u32,
+    #[pyo3(get)]
+    pub comm: String,
+    #[pyo3(get)]
+    pub samples: u64,
+    #[pyo3(get)]
+    pub hits: u64,
+    /// Hits whose stack reached the project's own code.
+    #[pyo3(get)]
+    pub attributed_hits: u64,
+    /// Time covered by the windows in which the thread was sampled at least once.
+    #[pyo3(get)]
+    pub busy_ns: u64,
+    #[pyo3(get)]
+    pub utilization: f64,
+}
+
+/// How evenly the target's work was spread over its threads and CPUs.
+#[pyclass]
+#[derive(Debug, Clone, Default)]
+pub struct ThreadUtilization {
+    #[pyo3(get)]
+    pub duration_ns: u64,
+    /// Busiest first.
+    #[pyo3(get)]
+    pub threads: Vec<ThreadSummary>,
+    #[pyo3(get)]
+    pub busy_threads: usize,
+    #[pyo3(get)]
+    pub idle_threads: usize,
+    /// Hits of the busiest thread over the mean of the busy threads; 1 is perfectly even.
+    #[pyo3(get)]
+    pub imbalance: f64,
+    /// Share of sampled windows in which only one thread was running.
+    #[pyo3(get)]
+    pub serial_fraction: f64,
+    #[pyo3(get)]
+    pub cpu_hits: HashMap<u32, u64>,
+}
+
+#[derive(Debug, Clone, Default)]
+pub struct ThreadProfile {
+    pub utilization: ThreadUtilization,
+    pub hit_count: HashMap<u32, HashMap<LineLoc, u64>>,
+}
+
+#[derive(Default)]
+struct ThreadStats {
+    comm: String,
+    samples: u64,
+    hits: u64,
+    attributed_hits: u64,
+    windows: HashSet<u64>,
+}
+
+pub struct ThreadProfileBuilder {
+    window_ns: u64,
+    start_ns: Option<u64>,
+    end_ns: u64,
+    threads: HashMap<u32, ThreadStats>,
+    cpu_hits: HashMap<u32, u64>,
+    hit_count: HashMap<u32, HashMap<LineLoc, u64>>,
+}
+
+impl ThreadProfileBuilder {
+    pub fn new(window_ns: u64) -> Self {
+        Self {
+            window_ns,
+            start_ns: None,
+            end_ns: 0,
+            threads: HashMap::new(),
+            cpu_hits: HashMap::new(),
+            hit_count: HashMap::new(),
+        }
+    }
+
+    /// Count an event's `hits`, of which `shares` were attributed to project lines.
+    pub fn add(&mut self, event: &Event, shares: &[(LineLoc, u64)], hits: u64) {
+        if let Some(cpu) = event.cpu {
+            *self.cpu_hits.entry(cpu).or_insert(0) += hits;
+        }
+        let Some(tid) = event.tid else {
+            return;
+        };
+        let stats = self.threads.entry(tid).or_default();
+        if stats.comm.is_empty() {
+            stats.comm = event.comm.clone();
+        }
+        stats.samples += 1;
+        stats.hits += hits;
+        if let Some(timestamp_ns) = event.timestamp_ns {
+            let start_ns = *self.start_ns.get_or_insert(timestamp_ns);
+            self.end_ns = cmp::max(self.end_ns, timestamp_ns);
+            stats
+                .windows
+                .insert(timestamp_ns.saturating_sub(start_ns) / self.window_ns);
+        }
+        for (lineloc, share) in shares {
+            stats.attributed_hits += share;
+            *self
+                .hit_count
+                .entry(tid)
+                .or_default()
+                .entry(lineloc.clone())
+                .or_insert(0) += share;
+        }
+    }
+
+    pub fn finish(self) -> ThreadProfile {
+        let duration_ns = match self.start_ns {
+            Some(start_ns) => self.end_ns - start_ns + self.window_ns,
+            None => 0,
+        };
+
+        let mut threads_per_window: HashMap<u64, u32> = HashMap::new();
+        for stats in self.threads.values() {
+            for &window in &stats.windows {
+                *threads_per_window.entry(window).or_insert(0) += 1;
+            }
+        }
+        let serial_windows = threads_per_window.values().filter(|&&n| n == 1).count();
+        let serial_fraction = if threads_per_window.is_empty() {
+            0.0
+        } else {
+            serial_windows as f64 / threads_per_window.len() as f64
+        };
+
+        let mut threads: Vec<ThreadSummary> = self
+            .threads
+            .into_iter()
+            .map(|(tid, stats)| {
+                let busy_ns = stats.windows.len() as u64 * self.window_ns;
+                ThreadSummary {
+                    tid,
+                    comm: stats.comm,
+                    samples: stats.samples,
+                    hits: stats.hits,
+                    attributed_hits: stats.attributed_hits,
+                    busy_ns,
+                    utilization: if duration_ns == 0 {
+                        0.0
+                    } else {
+                        f64::min(1.0, busy_ns as f64 / duration_ns as f64)
+                    },
+                }
+            })
+            .collect();
+        threads.sort_by_key(|t| cmp::Reverse(t.hits));
+
+        let busy: Vec<&ThreadSummary> = threads
+            .iter()
+            .filter(|t| t.utilization >= IDLE_UTILIZATION)
+            .collect();
+        let imbalance = match busy.first() {
+            Some(busiest) => {
+                let mean = busy.iter().map(|t| t.hits as f64).sum::<f64>() / busy.len() as f64;
+                busiest.hits as f64 / mean
+            }
+            None => 1.0,
+        };
+
+        ThreadProfile {
+            utilization: ThreadUtilization {
+                duration_ns,
+                busy_threads: busy.len(),
+                idle_threads: threads.len() - busy.len(),
+                imbalance,
+                serial_fraction,
+                threads,
+                cpu_hits: self.cpu_hits,
+            },
+            hit_count: self.hit_count,
+        }
+    }
+}
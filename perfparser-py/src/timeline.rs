@@ -0,0 +1,263 @@
+use std::cmp;
+use std::collections::HashMap;
+
+use pyo3::pyclass;
+
+use crate::LineLoc;
+
+/// Width of the time windows that hits are bucketed into.
+pub const DEFAULT_WINDOW_NS: u64 = 10_000_000;
+
+/// Phase detection compares blocks of consecutive windows; this bounds how many.
+const MAX_PHASE_BLOCKS: u64 = 100;
+
+/// Two hit distributions whose overlap is below this belong to different phases.
+const PHASE_SIMILARITY: f64 = 0.5;
+
+/// A stretch of the recording whose hotspots stay roughly the same.
+///
+/// Times are offsets from the first sample of the recording.
+#[pyclass]
+#[derive(Debug, Clone)]
+pub struct Phase {
+    #[pyo3(get)]
+    pub index: usize,
+    #[pyo3(get)]
+    pub start_ns: u64,
+    #[pyo3(get)]
+    pub end_ns: u64,
+    #[pyo3(get)]
+    pub total_hits: u64,
+    first_window: usize,
+    end_window: usize,
+}
+
+/// Attributed hits bucketed into fixed-width time windows.
+///
+/// Stored column-wise rather than as one map per window: the entries of window `w`
+/// are `loc_ids[window_offsets[w]..window_offsets[w + 1]]` with the matching `hits`,
+/// and `loc_ids` index into `locs`.
+#[derive(Debug, Clone, Default)]
+pub struct Timeline {
+    pub window_ns: u64,
+    locs: Vec<LineLoc>,
+    window_offsets: Vec<u32>,
+    loc_ids: Vec<u32>,
+    hits: Vec<u64>,
+    phases: Vec<Phase>,
+}
+
+impl Timeline {
+    pub fn num_windows(&self) -> usize {
+        self.window_offsets.len().saturating_sub(1)
+    }
+
+    pub fn phases(&self) -> &[Phase] {
+        &self.phases
+    }
+
+    /// Sum the hits of each location in windows `[first_window, end_window)`.
+    fn hits_in_windows(&self, first_window: usize, end_window: usize) -> HashMap<u32, u64> {
+        let mut totals = HashMap::new();
+        let end_window = cmp::min(end_window, self.num_windows());
+        if first_window >= end_window {
+            return totals;
+        }
+        let start = self.window_offsets[first_window] as usize;
+        let end = self.window_offsets[end_window] as usize;
+        for (&loc_id, &hits) in self.loc_ids[start..end].iter().zip(&self.hits[start..end]) {
+            *totals.entry(loc_id).or_insert(0) += hits;
+        }
+        totals
+    }
+
+    fn top_in_windows(
+        &self,
+        first_window: usize,
+        end_window: usize,
+        k: usize,
+    ) -> Vec<(LineLoc, f64)> {
+        let totals = self.hits_in_windows(first_window, end_window);
+        let total_hits = totals.values().sum::<u64>() as f64;
+        let mut sorted: Vec<_> = totals.into_iter().collect();
+        sorted.sort_by_key(|&(_, hits)| cmp::Reverse(hits));
+        sorted
+            .into_iter()
+            .take(k)
+            .map(|(loc_id, hits)| (self.locs[loc_id as usize].clone(), hits as f64 / total_hits))
+            .collect()
+    }
+
+    /// The `k` hottest lines between two offsets from the start of the recording.
+    pub fn top_lines_in_range(&self, start_ns: u64, end_ns: u64, k: usize) -> Vec<(LineLoc, f64)> {
+        if self.window_ns == 0 {
+            return Vec::new();
+        }
+        let first_window = (start_ns / self.window_ns) as usize;
+        let end_window = end_ns.div_ceil(self.window_ns) as usize;
+        self.top_in_windows(first_window, end_window, k)
+    }
+
+    pub fn top_lines_in_phase(&self, phase: usize, k: usize) -> Option<Vec<(LineLoc, f64)>> {
+        let phase = self.phases.get(phase)?;
+        Some(self.top_in_windows(phase.first_window, phase.end_window, k))
+    }
+
+    /// Split the recording into phases whose hit distributions differ.
+    ///
+    /// Windows are first grouped into blocks holding a minimum share of the hits, so
+    /// that sparsely sampled windows don't look like phase changes. A new phase starts
+    /// when a block's distribution overlaps too little with the current phase's, and
+    /// adjacent phases that turn out similar are merged afterwards.
+    fn detect_phases(&mut self) {
+        let num_windows = self.num_windows();
+        if num_windows == 0 {
+            return;
+        }
+        let total_hits: u64 = self.hits.iter().sum();
+        let min_block_hits = cmp::max(1, total_hits / MAX_PHASE_BLOCKS);
+
+        let mut blocks = Vec::new();
+        let mut block_start = 0;
+        let mut block_hits = 0;
+        for w in 0..num_windows {
+            let start = self.window_offsets[w] as usize;
+            let end = self.window_offsets[w + 1] as usize;
+            block_hits += self.hits[start..end].iter().sum::<u64>();
+            if block_hits >= min_block_hits || w + 1 == num_windows {
+                blocks.push((block_start, w + 1));
+                block_start = w + 1;
+                block_hits = 0;
+            }
+        }
+
+        let mut bounds: Vec<(usize, usize)> = Vec::new();
+        for (first, end) in blocks {
+            let similar = bounds.last().is_some_and(|&(pfirst, pend)| {
+                overlap(
+                    &self.hits_in_windows(pfirst, pend),
+                    &self.hits_in_windows(first, end),
+                ) >= PHASE_SIMILARITY
+            });
+            match bounds.last_mut() {
+                Some(last) if similar => last.1 = end,
+                _ => bounds.push((first, end)),
+            }
+        }
+
+        let mut merged: Vec<(usize, usize)> = Vec::new();
+        for (first, end) in bounds {
+            let similar = merged.last().is_some_and(|&(pfirst, pend)| {
+                overlap(
+                    &self.hits_in_windows(pfirst, pend),
+                    &self.hits_in_windows(first, end),
+                ) >= PHASE_SIMILARITY
+            });
+            match merged.last_mut() {
+                Some(last) if similar => last.1 = end,
+                _ => merged.push((first, end)),
+            }
+        }
+
+        self.phases = merged
+            .into_iter()
+            .enumerate()
+            .map(|(index, (first_window, end_window))| Phase {
+                index,
+                start_ns: first_window as u64 * self.window_ns,
+                end_ns: end_window as u64 * self.window_ns,
+                total_hits: self
+                    .hits_in_windows(first_window, end_window)
+                    .values()
+                    .sum(),
+                first_window,
+                end_window,
+            })
+            .collect();
+    }
+}
+
+/// The shared fraction of two hit distributions: 1 when identical, 0 when disjoint.
+fn overlap(a: &HashMap<u32, u64>, b: &HashMap<u32, u64>) -> f64 {
+    let a_total = a.values().sum::<u64>() as f64;
+    let b_total = b.values().sum::<u64>() as f64;
+    if a_total == 0.0 || b_total == 0.0 {
+        return 1.0;
+    }
+    a.iter()
+        .filter_map(|(loc_id, &a_hits)| {
+            let b_hits = *b.get(loc_id)?;
+            Some(f64::min(a_hits as f64 / a_total, b_hits as f64 / b_total))
+        })
+        .sum()
+}
+
+pub struct TimelineBuilder {
+    window_ns: u64,
+    start_ns: Option<u64>,
+    loc_index: HashMap<LineLoc, u32>,
+    locs: Vec<LineLoc>,
+    cells: HashMap<(u32, u32), u64>,
+}
+
+impl TimelineBuilder {
+    pub fn new(window_ns: u64) -> Self {
+        Self {
+            window_ns,
+            start_ns: None,
+            loc_index: HashMap::new(),
+            locs: Vec::new(),
+            cells: HashMap::new(),
+        }
+    }
+
+    pub fn add(&mut self, timestamp_ns: u64, loc: &LineLoc, hits: u64) {
+        // `perf script` emits samples in time order, so the first one marks the start.
+        let start_ns = *self.start_ns.get_or_insert(timestamp_ns);
+        let window = (timestamp_ns.saturating_sub(start_ns) / self.window_ns) as u32;
+        let loc_id = match self.loc_index.get(loc) {
+            Some(&id) => id,
+            None => {
+                let id = self.locs.len() as u32;
+                self.locs.push(loc.clone());
+                self.loc_index.insert(loc.clone(), id);
+                id
+            }
+        };
+        *self.cells.entry((window, loc_id)).or_insert(0) += hits;
+    }
+
+    pub fn finish(self) -> Timeline {
+        let mut cells: Vec<_> = self.cells.into_iter().collect();
+        cells.sort_unstable_by_key(|&(key, _)| key);
+        let num_windows = cells
+            .last()
+            .map_or(0, |&((window, _), _)| window as usize + 1);
+
+        let mut window_offsets = Vec::with_capacity(num_windows + 1);
+        let mut loc_ids = Vec::with_capacity(cells.len());
+        let mut hits = Vec::with_capacity(cells.len());
+        for ((window, loc_id), cell_hits) in cells {
+            while window_offsets.len() <= window as usize {
+                window_offsets.push(loc_ids.len() as u32);
+            }
+            loc_ids.push(loc_id);
+            hits.push(cell_hits);
+        }
+        window_offsets.push(loc_ids.len() as u32);
+        if num_windows == 0 {
+            window_offsets.clear();
+        }
+
+        let mut timeline = Timeline {
+            window_ns: self.window_ns,
+            locs: self.locs,
+            window_offsets,
+            loc_ids,
+            hits,
+            phases: Vec::new(),
+        };
+        timeline.detect_phases();
+        timeline
+    }
+}
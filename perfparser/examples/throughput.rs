@@ -0,0 +1,46 @@
+//! Parse a saved `perf script` output several times and report, as JSON, the best
+//! time per pass and the process's peak memory. Used by `benchmarks/run.py`.
+
+use std::time::{Duration, Instant};
+use std::{env, fs};
+
+use perfparser::Parser;
+
+fn peak_rss_kb() -> Option<u64> {
+    let status = fs::read_to_string("/proc/self/status").ok()?;
+    let line = status.lines().find(|line| line.starts_with("VmHWM:"))?;
+    line.split_whitespace().nth(1)?.parse().ok()
+}
+
+fn main() {
+    let mut args = env::args().skip(1);
+    let path = args.next().expect("usage: throughput SCRIPT [ITERATIONS]");
+    let iterations: u32 = args
+        .next()
+        .map_or(3, |n| n.parse().expect("bad iteration count"));
+    let script = fs::read(&path).expect("can't read script");
+
+    let mut best = Duration::MAX;
+    let mut events = 0;
+    let mut frames = 0;
+    for _ in 0..iterations {
+        let start = Instant::now();
+        events = 0;
+        frames = 0;
+        for event in Parser::new(&script[..]) {
+            events += 1;
+            frames += event.stack.len();
+        }
+        best = best.min(start.elapsed());
+    }
+
+    let secs = best.as_secs_f64();
+    println!(
+        "{{\"events\": {events}, \"frames\": {frames}, \"bytes\": {}, \"parse_secs\": {secs}, \
+         \"events_per_sec\": {}, \"mb_per_sec\": {}, \"peak_rss_kb\": {}}}",
+        script.len(),
+        events as f64 / secs,
+        script.len() as f64 / 1e6 / secs,
+        peak_rss_kb().unwrap_or(0),
+    );
+}
@@ -3,17 +3,102 @@
 use std::io::{self, BufRead, BufReader};
 use std::mem;
 
+mod mmap;
+pub mod perfdata;
+mod symbols;
+mod unwind;
+
 #[derive(Debug, Clone, Default)]
 pub struct Event {
+    pub comm: String,
+    pub pid: Option<u32>,
+    pub tid: Option<u32>,
+    pub cpu: Option<u32>,
+    /// Sample time in nanoseconds, on perf's clock.
+    pub timestamp_ns: Option<u64>,
     pub period: Option<usize>,
     pub kind: String,
+    /// Arguments of tracepoint and probe events, like `prev_pid=12 prev_state=S`.
+    pub trace: Option<String>,
     pub stack: Vec<StackFrame>,
 }
 
+impl Event {
+    /// Look up a `name=value` argument of a tracepoint or probe event.
+    pub fn trace_field(&self, name: &str) -> Option<&str> {
+        self.trace
+            .as_deref()?
+            .split_whitespace()
+            .find_map(|field| field.strip_prefix(name)?.strip_prefix('='))
+    }
+
+    /// `kind` without event modifiers, so `cycles:u` and `cycles:ppp` are both `cycles`.
+    /// Tracepoint and probe names like `sched:sched_switch` are left alone.
+    pub fn base_kind(&self) -> &str {
+        match self.kind.rsplit_once(':') {
+            Some((base, modifiers))
+                if !modifiers.is_empty()
+                    && modifiers.bytes().all(|b| EVENT_MODIFIERS.contains(&b)) =>
+            {
+                base
+            }
+            _ => &self.kind,
+        }
+    }
+}
+
+/// Flags perf accepts after an event name, like the `u` in `cycles:u`.
+const EVENT_MODIFIERS: &[u8] = b"ukhIGHpPSDWeb";
+
+/// A pseudo-random subset of a recording's samples, picked by each sample's index
+/// so that every pass over the recording keeps the same ones.
+#[derive(Debug, Clone, Copy)]
+pub struct Subsample {
+    threshold: u64,
+}
+
+impl Subsample {
+    /// Keep about `fraction` of the samples, or all of them if it's 1 or more.
+    pub fn new(fraction: f64) -> Self {
+        if fraction >= 1.0 {
+            return Self::all();
+        }
+        Self {
+            threshold: (fraction.max(0.0) * u64::MAX as f64) as u64,
+        }
+    }
+
+    pub fn all() -> Self {
+        Self {
+            threshold: u64::MAX,
+        }
+    }
+
+    pub fn keeps(&self, index: u64) -> bool {
+        self.threshold == u64::MAX || splitmix64(index) < self.threshold
+    }
+}
+
+/// Scramble an index into a uniformly distributed hash.
+fn splitmix64(index: u64) -> u64 {
+    let mut z = index.wrapping_add(0x9e3779b97f4a7c15);
+    z = (z ^ (z >> 30)).wrapping_mul(0xbf58476d1ce4e5b9);
+    z = (z ^ (z >> 27)).wrapping_mul(0x94d049bb133111eb);
+    z ^ (z >> 31)
+}
+
 #[derive(Debug, Clone, Default)]
 pub struct StackFrame {
+    /// The sampled instruction pointer for the leaf frame, the return address for
+    /// callers.
+    pub addr: Option<u64>,
     pub funcname: String,
+    /// How far `addr` is into `funcname`'s symbol, from the `+0x..` suffix.
+    pub offset: Option<u64>,
     pub srcline: Option<SourceLine>,
+    /// Whether this frame was inlined into the next one up the stack (`perf script
+    /// --inline`), so that both are really the same machine frame.
+    pub inlined: bool,
 }
 
 #[derive(Debug, Clone)]
@@ -24,10 +109,17 @@ pub struct SourceLine {
 
 const SPECIAL_UNKNOWN: &str = "[unknown]";
 
+/// `Event::kind` of a task being switched onto a CPU (`--switch-events`).
+pub const EVENT_SWITCH_IN: &str = "switch-in";
+/// `Event::kind` of a task being switched off a CPU (`--switch-events`).
+pub const EVENT_SWITCH_OUT: &str = "switch-out";
+
 pub struct Parser<R> {
     src: BufReader<R>,
     state: ParserState,
     cur_event: Event,
+    /// A line that was read while finishing one event but belongs to the next.
+    pending_line: Option<String>,
 }
 
 impl<R: io::Read> Parser<R> {
@@ -36,47 +128,116 @@ impl<R: io::Read> Parser<R> {
             src: BufReader::new(reader),
             state: ParserState::Start,
             cur_event: Event::default(),
+            pending_line: None,
         }
     }
 
     fn parse_event_line(&mut self, line: &str) -> Result<(), ()> {
-        let mut chunks = line.trim().split(':').filter(|s| !s.is_empty());
-        let _ = chunks.next();
-        let Some(period_and_kind) = chunks.next() else {
+        let Some((header, rest)) = split_event_header(line.trim()) else {
             return Err(());
         };
-        let Some((period_str, kind)) = period_and_kind.trim().split_once(' ') else {
-            return Err(());
+        self.parse_event_header(header);
+        let rest = rest.trim();
+
+        if let Some(switch) = rest.strip_prefix("PERF_RECORD_SWITCH") {
+            // Context switch side-band record (`--switch-events`), which has no stack.
+            let switch = switch.trim_start_matches("_CPU_WIDE").trim_start();
+            self.cur_event.kind = if switch.starts_with("OUT") {
+                EVENT_SWITCH_OUT
+            } else {
+                EVENT_SWITCH_IN
+            }
+            .to_owned();
+            self.state = ParserState::AfterSidebandLine;
+            return Ok(());
+        }
+
+        let (period, rest) = match rest.split_once(char::is_whitespace) {
+            Some((period_str, rest)) if period_str.bytes().all(|b| b.is_ascii_digit()) => {
+                (period_str.parse().ok(), rest.trim_start())
+            }
+            _ => (None, rest),
+        };
+        self.cur_event.period = period;
+
+        // Event names can contain colons themselves (`cycles:u`, `sched:sched_switch`),
+        // so the name ends at the first colon followed by a space or the end of line.
+        let (kind, payload) = match rest.split_once(": ") {
+            Some((kind, payload)) => (kind, payload.trim()),
+            None => (rest.strip_suffix(':').unwrap_or(rest), ""),
         };
-        self.cur_event.period = period_str.parse().ok();
+        if kind.is_empty() {
+            return Err(());
+        }
         self.cur_event.kind = kind.to_owned();
 
-        if let Some(single_stack_line) = chunks.next() {
+        if payload.is_empty() {
+            self.state = ParserState::AfterEventLine;
+        } else if looks_like_stack_line(payload) {
             // Combined event/stack line
-            if self.parse_stack_line(single_stack_line).is_err() {
+            if self.parse_stack_line(payload).is_err() {
                 self.state = ParserState::AfterEventLine;
                 return Err(());
             }
             self.state = ParserState::AfterCombinedLine;
         } else {
+            // Tracepoint or probe arguments
+            self.cur_event.trace = Some(payload.to_owned());
             self.state = ParserState::AfterEventLine;
         }
         Ok(())
     }
 
+    /// Parse the `comm [pid/]tid [[cpu]] time` prefix of an event line.
+    ///
+    /// Every field is optional in `perf script` output, so each is recognized by its
+    /// shape, from the right, and whatever is left over is the command name.
+    fn parse_event_header(&mut self, header: &str) {
+        let mut tokens: Vec<&str> = header.split_whitespace().collect();
+        if let Some(timestamp_ns) = tokens.last().and_then(|t| parse_timestamp(t)) {
+            self.cur_event.timestamp_ns = Some(timestamp_ns);
+            tokens.pop();
+        }
+        if let Some(cpu) = tokens
+            .last()
+            .and_then(|t| t.strip_prefix('[')?.strip_suffix(']')?.parse().ok())
+        {
+            self.cur_event.cpu = Some(cpu);
+            tokens.pop();
+        }
+        if let Some(&ids) = tokens.last() {
+            let (pid, tid) = match ids.split_once('/') {
+                Some((pid, tid)) => (pid.parse().ok(), tid.parse().ok()),
+                None => (None, ids.parse().ok()),
+            };
+            if tid.is_some() {
+                self.cur_event.pid = pid;
+                self.cur_event.tid = tid;
+                tokens.pop();
+            }
+        }
+        self.cur_event.comm = tokens.join(" ");
+    }
+
     fn parse_stack_line(&mut self, line: &str) -> Result<(), ()> {
-        let Some((_addr, rest)) = line.trim().split_once(' ') else {
+        let Some((addr, rest)) = line.trim().split_once(' ') else {
             return Err(());
         };
         let (funcname, module) = rest
             .rsplit_once(" (")
             .and_then(|(f, m)| m.strip_suffix(')').map(|m| (f, m)))
             .unwrap_or((rest, ""));
-        let (funcname, _offset) = funcname.rsplit_once('+').unwrap_or((funcname, ""));
+        let (funcname, offset) = funcname.rsplit_once('+').unwrap_or((funcname, ""));
 
         self.cur_event.stack.push(StackFrame {
+            addr: u64::from_str_radix(addr, 16).ok(),
             funcname: funcname.to_owned(),
+            offset: offset
+                .strip_prefix("0x")
+                .and_then(|hex| u64::from_str_radix(hex, 16).ok()),
             srcline: None,
+            // Inlined frames without a srcline carry the mark on this line instead.
+            inlined: module == "inlined",
         });
         if funcname != SPECIAL_UNKNOWN || module != SPECIAL_UNKNOWN {
             self.state = ParserState::AfterStackLine;
@@ -86,6 +247,12 @@ impl<R: io::Read> Parser<R> {
 
     fn parse_src_line(&mut self, line: &str) -> Result<(), ()> {
         let line = line.trim();
+        // With `--inline`, perf marks the srclines of inlined frames.
+        if line.ends_with(" (inlined)") {
+            if let Some(last_frame) = self.cur_event.stack.last_mut() {
+                last_frame.inlined = true;
+            }
+        }
         let (srcinfo, _module) = line.rsplit_once(' ').unwrap_or((line, ""));
         let Some((path, lineno_str)) = srcinfo.rsplit_once(':') else {
             self.state = ParserState::AfterSrcLine;
@@ -112,7 +279,13 @@ impl<R: io::Read> Iterator for Parser<R> {
         let mut line = String::new();
         loop {
             line.clear();
-            let bytes_read = self.src.read_line(&mut line).ok()?;
+            let bytes_read = match self.pending_line.take() {
+                Some(pending) => {
+                    line = pending;
+                    line.len()
+                }
+                None => self.src.read_line(&mut line).ok()?,
+            };
             if bytes_read == 0 {
                 // EOF
                 if self.state != ParserState::Start {
@@ -131,21 +304,86 @@ impl<R: io::Read> Iterator for Parser<R> {
             }
 
             let result = match self.state {
-                ParserState::Start => self.parse_event_line(line),
+                ParserState::Start => {
+                    let result = self.parse_event_line(line);
+                    if self.state == ParserState::AfterSidebandLine {
+                        self.state = ParserState::Start;
+                        return Some(mem::take(&mut self.cur_event));
+                    }
+                    result
+                }
                 ParserState::AfterEventLine => self.parse_stack_line(line),
+                // The sampled frame had no srcline, so this line starts the next event.
+                ParserState::AfterCombinedLine if is_event_line(line) => {
+                    self.pending_line = Some(line.to_owned());
+                    self.state = ParserState::Start;
+                    return Some(mem::take(&mut self.cur_event));
+                }
                 ParserState::AfterCombinedLine => {
                     maybe_handle_weird_line(line, self.parse_src_line(line));
                     self.state = ParserState::Start;
                     return Some(mem::take(&mut self.cur_event));
                 }
+                // Frames without source info have no srcline line.
+                ParserState::AfterStackLine if looks_like_stack_line(line) => {
+                    self.parse_stack_line(line)
+                }
                 ParserState::AfterStackLine => self.parse_src_line(line),
                 ParserState::AfterSrcLine => self.parse_stack_line(line),
+                ParserState::AfterSidebandLine => unreachable!(),
             };
             maybe_handle_weird_line(line, result);
         }
     }
 }
 
+/// Split an event line into its `comm tid [cpu] time` header and the rest.
+///
+/// The header ends at the colon after the timestamp. Command names can contain
+/// colons too (`kworker/0:1`), so that is preferred over the first colon.
+fn split_event_header(line: &str) -> Option<(&str, &str)> {
+    line.match_indices(':')
+        .map(|(idx, _)| idx)
+        .find(|&idx| {
+            line[..idx]
+                .split_whitespace()
+                .last()
+                .and_then(parse_timestamp)
+                .is_some()
+        })
+        .or_else(|| line.find(':'))
+        .map(|idx| (&line[..idx], &line[idx + 1..]))
+}
+
+/// Whether a line is a timestamped event line rather than a srcline.
+fn is_event_line(line: &str) -> bool {
+    split_event_header(line).is_some_and(|(header, _)| {
+        header
+            .split_whitespace()
+            .last()
+            .and_then(parse_timestamp)
+            .is_some()
+    })
+}
+
+/// Whether the text after an event name is a stack frame (`55d5a1 main+0x12 (/bin)`)
+/// rather than tracepoint arguments.
+fn looks_like_stack_line(s: &str) -> bool {
+    s.split_once(' ')
+        .is_some_and(|(addr, _)| !addr.is_empty() && addr.bytes().all(|b| b.is_ascii_hexdigit()))
+}
+
+/// Parse a `perf script` timestamp like `12345.678901` into nanoseconds.
+fn parse_timestamp(s: &str) -> Option<u64> {
+    let (secs, frac) = s.split_once('.')?;
+    let secs: u64 = secs.parse().ok()?;
+    if frac.is_empty() || frac.len() > 9 || !frac.bytes().all(|b| b.is_ascii_digit()) {
+        return None;
+    }
+    let frac_ns: u64 = frac.parse::<u64>().ok()? * 10u64.pow(9 - frac.len() as u32);
+    Some(secs * 1_000_000_000 + frac_ns)
+}
+
 fn maybe_handle_weird_line(line: &str, result: Result<(), ()>) {
     if result.is_err() {
         // FIXME: use logging infrastructure instead
@@ -165,4 +403,6 @@ enum ParserState {
     AfterStackLine,
     /// After parsing a stack srcline line.
     AfterSrcLine,
+    /// After parsing a one-line side-band record, which is complete by itself.
+    AfterSidebandLine,
 }
@@ -0,0 +1,116 @@
+use std::fs::File;
+use std::io;
+use std::ops::Deref;
+
+/// A whole file, mapped read-only into memory where the platform allows it and read
+/// into a buffer otherwise.
+pub enum Mmap {
+    Mapped { ptr: *const u8, len: usize },
+    Read(Vec<u8>),
+}
+
+// The mapping is read-only and owned, so sharing it is as safe as sharing a `Vec`.
+unsafe impl Send for Mmap {}
+unsafe impl Sync for Mmap {}
+
+#[cfg(all(unix, target_pointer_width = "64"))]
+mod sys {
+    use std::ffi::{c_int, c_void};
+
+    pub const PROT_READ: c_int = 1;
+    pub const MAP_PRIVATE: c_int = 2;
+
+    unsafe extern "C" {
+        pub fn mmap(
+            addr: *mut c_void,
+            len: usize,
+            prot: c_int,
+            flags: c_int,
+            fd: c_int,
+            offset: i64,
+        ) -> *mut c_void;
+        pub fn munmap(addr: *mut c_void, len: usize) -> c_int;
+    }
+}
+
+impl Mmap {
+    #[cfg(all(unix, target_pointer_width = "64"))]
+    pub fn open(file: &File) -> io::Result<Self> {
+        use std::os::fd::AsRawFd;
+        use std::ptr;
+
+        let len = file.metadata()?.len() as usize;
+        // Empty mappings are an error; there's nothing to map anyway.
+        if len == 0 {
+            return Ok(Mmap::Read(Vec::new()));
+        }
+        let ptr = unsafe {
+            sys::mmap(
+                ptr::null_mut(),
+                len,
+                sys::PROT_READ,
+                sys::MAP_PRIVATE,
+                file.as_raw_fd(),
+                0,
+            )
+        };
+        // MAP_FAILED
+        if ptr as usize == usize::MAX {
+            return Err(io::Error::last_os_error());
+        }
+        Ok(Mmap::Mapped {
+            ptr: ptr as *const u8,
+            len,
+        })
+    }
+
+    #[cfg(not(all(unix, target_pointer_width = "64")))]
+    pub fn open(file: &File) -> io::Result<Self> {
+        use std::io::Read;
+
+        let mut bytes = Vec::new();
+        (&*file).read_to_end(&mut bytes)?;
+        Ok(Mmap::Read(bytes))
+    }
+}
+
+impl Deref for Mmap {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        match self {
+            Mmap::Mapped { ptr, len } => unsafe { std::slice::from_raw_parts(*ptr, *len) },
+            Mmap::Read(bytes) => bytes,
+        }
+    }
+}
+
+impl Drop for Mmap {
+    fn drop(&mut self) {
+        #[cfg(all(unix, target_pointer_width = "64"))]
+        if let Mmap::Mapped { ptr, len } = self {
+            unsafe {
+                sys::munmap(*ptr as *mut _, *len);
+            }
+        }
+    }
+}
+
+/// Little-endian integers at byte offsets, or `None` past the end of `bytes`.
+pub fn u16_at(bytes: &[u8], pos: usize) -> Option<u16> {
+    Some(u16::from_le_bytes(
+        bytes.get(pos..pos.checked_add(2)?)?.try_into().ok()?,
+    ))
+}
+
+pub fn u32_at(bytes: &[u8], pos: usize) -> Option<u32> {
+    Some(u32::from_le_bytes(
+        bytes.get(pos..pos.checked_add(4)?)?.try_into().ok()?,
+    ))
+}
+
+pub fn u64_at(bytes: &[u8], pos: usize) -> Option<u64> {
+    Some(u64::from_le_bytes(
+        bytes.get(pos..pos.checked_add(8)?)?.try_into().ok()?,
+    ))
+}
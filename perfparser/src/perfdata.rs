@@ -0,0 +1,1630 @@
+//! Reading `perf record`'s perf.data files directly, without `perf script`.
+//!
+//! The file is memory-mapped and decoded in place: `Record`s borrow from the mapping,
+//! so walking them, callchains included, copies nothing. `PerfDataFile::events`
+//! turns the samples into the same `Event`s `Parser` gives for `perf script` output,
+//! in the same timestamp order, resolving each distinct code address once rather
+//! than once per sample.
+
+use std::cmp::{self, Reverse};
+use std::collections::{BTreeMap, BinaryHeap, HashMap, HashSet};
+use std::fs::File;
+use std::io;
+use std::ops::Range;
+use std::path::Path;
+
+use crate::mmap::{Mmap, u32_at, u64_at};
+use crate::symbols::symbolize;
+use crate::unwind::{StackDump, Unwinder, UserRegs};
+use crate::{Event, SPECIAL_UNKNOWN, StackFrame, Subsample};
+
+const MAGIC: &[u8; 8] = b"PERFILE2";
+const MAGIC_BIG_ENDIAN: &[u8; 8] = b"2ELIFREP";
+const FILE_HEADER_SIZE: u64 = 104;
+/// Feature bit of the section naming each event.
+const HEADER_EVENT_DESC: usize = 12;
+/// Feature bit of `perf record -z`'s compression settings.
+const HEADER_COMPRESSED: usize = 27;
+
+const PERF_RECORD_MMAP: u32 = 1;
+const PERF_RECORD_COMM: u32 = 3;
+const PERF_RECORD_FORK: u32 = 7;
+const PERF_RECORD_SAMPLE: u32 = 9;
+const PERF_RECORD_MMAP2: u32 = 10;
+const PERF_RECORD_FINISHED_ROUND: u32 = 68;
+const PERF_RECORD_COMPRESSED: u32 = 81;
+
+const PERF_SAMPLE_IP: u64 = 1 << 0;
+const PERF_SAMPLE_TID: u64 = 1 << 1;
+const PERF_SAMPLE_TIME: u64 = 1 << 2;
+const PERF_SAMPLE_ADDR: u64 = 1 << 3;
+const PERF_SAMPLE_READ: u64 = 1 << 4;
+const PERF_SAMPLE_CALLCHAIN: u64 = 1 << 5;
+const PERF_SAMPLE_ID: u64 = 1 << 6;
+const PERF_SAMPLE_CPU: u64 = 1 << 7;
+const PERF_SAMPLE_PERIOD: u64 = 1 << 8;
+const PERF_SAMPLE_STREAM_ID: u64 = 1 << 9;
+const PERF_SAMPLE_RAW: u64 = 1 << 10;
+const PERF_SAMPLE_BRANCH_STACK: u64 = 1 << 11;
+const PERF_SAMPLE_REGS_USER: u64 = 1 << 12;
+const PERF_SAMPLE_STACK_USER: u64 = 1 << 13;
+const PERF_SAMPLE_IDENTIFIER: u64 = 1 << 16;
+
+const PERF_FORMAT_TOTAL_TIME_ENABLED: u64 = 1 << 0;
+const PERF_FORMAT_TOTAL_TIME_RUNNING: u64 = 1 << 1;
+const PERF_FORMAT_ID: u64 = 1 << 2;
+const PERF_FORMAT_GROUP: u64 = 1 << 3;
+const PERF_FORMAT_LOST: u64 = 1 << 4;
+
+/// Branch stacks with this have the hardware index before the entries.
+const PERF_SAMPLE_BRANCH_HW_INDEX: u64 = 1 << 17;
+const PERF_SAMPLE_REGS_ABI_64: u64 = 2;
+/// x86 `perf_event_x86_regs` indices of the registers unwinding needs.
+const PERF_REG_X86_BP: u32 = 6;
+const PERF_REG_X86_SP: u32 = 7;
+const PERF_REG_X86_IP: u32 = 8;
+
+/// Callchain entries from here up mark a switch of context, like into user space,
+/// rather than being addresses.
+const PERF_CONTEXT_MAX: u64 = -4095i64 as u64;
+/// The callchain marker before the user part.
+const PERF_CONTEXT_USER: u64 = -512i64 as u64;
+
+/// Processes perf attributes kernel mappings to.
+const KERNEL_PID: u32 = u32::MAX;
+
+/// Names of the generic hardware and software events, by config.
+const HARDWARE_EVENTS: &[&str] = &[
+    "cycles",
+    "instructions",
+    "cache-references",
+    "cache-misses",
+    "branch-instructions",
+    "branch-misses",
+    "bus-cycles",
+    "stalled-cycles-frontend",
+    "stalled-cycles-backend",
+    "ref-cycles",
+];
+const SOFTWARE_EVENTS: &[&str] = &[
+    "cpu-clock",
+    "task-clock",
+    "page-faults",
+    "context-switches",
+    "cpu-migrations",
+    "minor-faults",
+    "major-faults",
+];
+
+fn invalid(what: &str) -> io::Error {
+    io::Error::new(
+        io::ErrorKind::InvalidData,
+        format!("malformed perf.data: {what}"),
+    )
+}
+
+/// An event recorded in a perf.data file, and how its samples are laid out.
+#[derive(Debug, Clone)]
+pub struct EventAttr {
+    /// The event as given to `perf record`, like `cycles:u`.
+    pub name: String,
+    sample_type: u64,
+    read_format: u64,
+    branch_sample_type: u64,
+    /// Which registers `PERF_SAMPLE_REGS_USER` samples carry.
+    sample_regs_user: u64,
+}
+
+pub struct PerfDataFile {
+    map: Mmap,
+    attrs: Vec<EventAttr>,
+    /// Which of `attrs` each sample ID belongs to.
+    attr_ids: HashMap<u64, usize>,
+    data: Range<usize>,
+}
+
+impl PerfDataFile {
+    /// Map a perf.data file and read its header.
+    ///
+    /// Recordings perf can't seek in, like those written to a pipe or with
+    /// compression (`perf record -z`), big-endian ones and files in perf's older
+    /// formats are unsupported.
+    pub fn open(path: &Path) -> io::Result<Self> {
+        let map = Mmap::open(&File::open(path)?)?;
+        match map.get(..8) {
+            Some(magic) if magic == MAGIC => {}
+            Some(magic) if magic == MAGIC_BIG_ENDIAN => {
+                return Err(io::Error::new(
+                    io::ErrorKind::Unsupported,
+                    "big-endian perf.data",
+                ));
+            }
+            _ => {
+                return Err(io::Error::new(
+                    io::ErrorKind::Unsupported,
+                    "perf.data without the PERFILE2 magic",
+                ));
+            }
+        }
+        if u64_at(&map, 8) != Some(FILE_HEADER_SIZE) {
+            return Err(io::Error::new(
+                io::ErrorKind::Unsupported,
+                "pipe-mode perf.data",
+            ));
+        }
+        let header = |pos| u64_at(&map, pos).ok_or_else(|| invalid("truncated header"));
+        let attr_size = header(16)? as usize;
+        let (attrs_offset, attrs_size) = (header(24)? as usize, header(32)? as usize);
+        let (data_offset, data_size) = (header(40)? as usize, header(48)? as usize);
+        let features = [header(72)?, header(80)?, header(88)?, header(96)?];
+        if attr_size < 16 + 40 || data_offset.saturating_add(data_size) > map.len() {
+            return Err(invalid("bad sections"));
+        }
+
+        let mut attrs = Vec::new();
+        let mut attr_ids = HashMap::new();
+        for i in 0..attrs_size / attr_size {
+            let attr = attrs_offset + i * attr_size;
+            let field = |pos| u64_at(&map, attr + pos).ok_or_else(|| invalid("truncated attr"));
+            let type_ = u32_at(&map, attr).ok_or_else(|| invalid("truncated attr"))?;
+            let config = field(8)?;
+            // Attrs from before perf knew of user registers end before them.
+            let optional = |pos: usize| {
+                (attr_size >= 16 + pos + 8)
+                    .then(|| u64_at(&map, attr + pos))
+                    .flatten()
+                    .unwrap_or(0)
+            };
+            attrs.push(EventAttr {
+                name: default_event_name(type_, config),
+                sample_type: field(24)?,
+                read_format: field(32)?,
+                branch_sample_type: optional(72),
+                sample_regs_user: optional(80),
+            });
+            let (ids_offset, ids_size) = (field(attr_size - 16)?, field(attr_size - 8)?);
+            for id in (ids_offset..ids_offset.saturating_add(ids_size)).step_by(8) {
+                let id = u64_at(&map, id as usize).ok_or_else(|| invalid("truncated ids"))?;
+                attr_ids.insert(id, i);
+            }
+        }
+        if attrs.is_empty() {
+            return Err(invalid("no events"));
+        }
+
+        // The feature sections follow the data, one for each feature bit set.
+        let has_feature = |bit: usize| features[bit / 64] >> (bit % 64) & 1 == 1;
+        if has_feature(HEADER_COMPRESSED) {
+            return Err(io::Error::new(
+                io::ErrorKind::Unsupported,
+                "compressed perf.data",
+            ));
+        }
+        if has_feature(HEADER_EVENT_DESC) {
+            let index = (0..HEADER_EVENT_DESC)
+                .filter(|&bit| has_feature(bit))
+                .count();
+            let section = data_offset + data_size + index * 16;
+            if let (Some(offset), Some(size)) = (u64_at(&map, section), u64_at(&map, section + 8)) {
+                let desc = map.get(offset as usize..offset.saturating_add(size) as usize);
+                if let Some(names) = desc.and_then(event_desc_names) {
+                    for (attr, name) in attrs.iter_mut().zip(names) {
+                        attr.name = name;
+                    }
+                }
+            }
+        }
+
+        Ok(PerfDataFile {
+            map,
+            attrs,
+            attr_ids,
+            data: data_offset..data_offset + data_size,
+        })
+    }
+
+    pub fn attrs(&self) -> &[EventAttr] {
+        &self.attrs
+    }
+
+    /// The records of the data section, in the order perf wrote them.
+    pub fn records(&self) -> Records<'_> {
+        Records {
+            file: self,
+            pos: self.data.start,
+        }
+    }
+
+    /// The samples as `Event`s, with their call stacks symbolized.
+    ///
+    /// Stacks are resolved against the binaries at the paths they were mapped from,
+    /// so rebuilding the target after recording gives wrong lines. Callers' return
+    /// addresses are looked up one byte back, inside the call instruction, so that
+    /// they resolve to the line of the call.
+    pub fn events(&self) -> io::Result<Events<'_>> {
+        self.sampled_events(Subsample::all())
+    }
+
+    /// Like `events`, but only for a subsample of the samples. Only the addresses in
+    /// those are symbolized, and only their user stacks unwound.
+    ///
+    /// User stacks dumped with `--call-graph dwarf` are unwound by the binaries'
+    /// `.eh_frame`; see `unwind`.
+    pub fn sampled_events(&self, subsample: Subsample) -> io::Result<Events<'_>> {
+        // First pass: find every distinct code address sampled in each binary.
+        let mut maps = Maps::default();
+        let mut unwinder = Unwinder::default();
+        let mut wanted: HashMap<&str, HashSet<u64>> = HashMap::new();
+        let mut index = 0;
+        for record in self.records() {
+            match record? {
+                Record::Sample(sample) => {
+                    index += 1;
+                    if !subsample.keeps(index - 1) {
+                        continue;
+                    }
+                    for (i, ip) in stack_ips(&sample, &maps, &mut unwinder).enumerate() {
+                        if let Some((path, offset)) = maps.resolve(sample.pid, lookup_ip(i, ip)) {
+                            wanted.entry(path).or_default().insert(offset);
+                        }
+                    }
+                }
+                record => maps.update(&record),
+            }
+        }
+
+        let mut symbols = HashMap::new();
+        for (path, offsets) in wanted {
+            let offsets: Vec<u64> = offsets.into_iter().collect();
+            for (offset, frames) in symbolize(path, &offsets)? {
+                symbols.insert((path, offset), frames);
+            }
+        }
+        Ok(Events::new(self.records(), symbols, subsample))
+    }
+
+    fn parse_sample<'a>(&'a self, body: &'a [u8]) -> Option<Sample<'a>> {
+        let attr = self.sample_attr(body)?;
+        let sample_type = attr.sample_type;
+        let has = |flag: u64| sample_type & flag != 0;
+        let mut cursor = Cursor {
+            bytes: body,
+            pos: 0,
+        };
+        if has(PERF_SAMPLE_IDENTIFIER) {
+            cursor.u64()?;
+        }
+        let ip = has(PERF_SAMPLE_IP).then(|| cursor.u64()).flatten();
+        let (pid, tid) = if has(PERF_SAMPLE_TID) {
+            (Some(cursor.u32()?), Some(cursor.u32()?))
+        } else {
+            (None, None)
+        };
+        let time = has(PERF_SAMPLE_TIME).then(|| cursor.u64()).flatten();
+        for flag in [PERF_SAMPLE_ADDR, PERF_SAMPLE_ID, PERF_SAMPLE_STREAM_ID] {
+            if has(flag) {
+                cursor.u64()?;
+            }
+        }
+        let cpu = if has(PERF_SAMPLE_CPU) {
+            let cpu = cursor.u32()?;
+            cursor.u32()?;
+            Some(cpu)
+        } else {
+            None
+        };
+        let period = has(PERF_SAMPLE_PERIOD).then(|| cursor.u64()).flatten();
+        if has(PERF_SAMPLE_READ) {
+            cursor.skip_read_values(attr.read_format)?;
+        }
+        let callchain = if has(PERF_SAMPLE_CALLCHAIN) {
+            let nr = cursor.u64()? as usize;
+            cursor.take(nr.checked_mul(8)?)?
+        } else {
+            &[]
+        };
+        if has(PERF_SAMPLE_RAW) {
+            let size = cursor.u32()? as usize;
+            cursor.take(size)?;
+        }
+        if has(PERF_SAMPLE_BRANCH_STACK) {
+            let nr = cursor.u64()? as usize;
+            if attr.branch_sample_type & PERF_SAMPLE_BRANCH_HW_INDEX != 0 {
+                cursor.u64()?;
+            }
+            // from, to and flags of each branch.
+            cursor.take(nr.checked_mul(24)?)?;
+        }
+        let mut user_regs = None;
+        if has(PERF_SAMPLE_REGS_USER) {
+            let abi = cursor.u64()?;
+            // Samples in kernel threads have no user registers, nor the values.
+            if abi != 0 {
+                let regs = cursor.take(attr.sample_regs_user.count_ones() as usize * 8)?;
+                if abi == PERF_SAMPLE_REGS_ABI_64 {
+                    user_regs = x86_user_regs(attr.sample_regs_user, regs);
+                }
+            }
+        }
+        let mut user_stack: &[u8] = &[];
+        if has(PERF_SAMPLE_STACK_USER) {
+            let size = cursor.u64()? as usize;
+            if size > 0 {
+                let dump = cursor.take(size)?;
+                // Only the start of the dump was filled in.
+                let dyn_size = cursor.u64()? as usize;
+                user_stack = &dump[..dyn_size.min(size)];
+            }
+        }
+        Some(Sample {
+            attr,
+            ip,
+            pid,
+            tid,
+            time,
+            cpu,
+            period,
+            callchain: Callchain { bytes: callchain },
+            user_regs,
+            user_stack,
+        })
+    }
+
+    /// The event a sample belongs to, found by its sample ID if several were recorded.
+    fn sample_attr(&self, body: &[u8]) -> Option<&EventAttr> {
+        if self.attrs.len() == 1 {
+            return self.attrs.first();
+        }
+        // perf requires every event to put the ID at the same place.
+        let sample_type = self.attrs[0].sample_type;
+        let id = if sample_type & PERF_SAMPLE_IDENTIFIER != 0 {
+            u64_at(body, 0)?
+        } else if sample_type & PERF_SAMPLE_ID != 0 {
+            let before = [
+                PERF_SAMPLE_IP,
+                PERF_SAMPLE_TID,
+                PERF_SAMPLE_TIME,
+                PERF_SAMPLE_ADDR,
+            ];
+            let pos = before.iter().filter(|&&f| sample_type & f != 0).count() * 8;
+            u64_at(body, pos)?
+        } else {
+            return self.attrs.first();
+        };
+        self.attrs.get(*self.attr_ids.get(&id)?)
+    }
+}
+
+/// The registers to unwind from, out of the `regs` of a sample recorded with the
+/// `mask` of `sample_regs_user`, in the order of their indices.
+fn x86_user_regs(mask: u64, regs: &[u8]) -> Option<UserRegs> {
+    let reg = |index: u32| {
+        let pos = (mask & ((1 << index) - 1)).count_ones() as usize * 8;
+        (mask >> index & 1 == 1)
+            .then(|| u64_at(regs, pos))
+            .flatten()
+    };
+    Some(UserRegs {
+        ip: reg(PERF_REG_X86_IP)?,
+        sp: reg(PERF_REG_X86_SP)?,
+        bp: reg(PERF_REG_X86_BP),
+    })
+}
+
+/// The name perf gives a generic event, for files without event descriptions.
+fn default_event_name(type_: u32, config: u64) -> String {
+    let names = match type_ {
+        0 => HARDWARE_EVENTS,
+        1 => SOFTWARE_EVENTS,
+        _ => &[],
+    };
+    names.get(config as usize).map_or_else(
+        || format!("raw-{type_}-{config:#x}"),
+        |name| (*name).to_owned(),
+    )
+}
+
+/// Event names from the `HEADER_EVENT_DESC` feature section, in the order of the
+/// file's attrs.
+fn event_desc_names(desc: &[u8]) -> Option<Vec<String>> {
+    let mut cursor = Cursor {
+        bytes: desc,
+        pos: 0,
+    };
+    let count = cursor.u32()?;
+    let attr_size = cursor.u32()? as usize;
+    let mut names = Vec::new();
+    for _ in 0..count {
+        cursor.take(attr_size)?;
+        let nr_ids = cursor.u32()? as usize;
+        let len = cursor.u32()? as usize;
+        let name = cursor.take(len)?;
+        let name = name.split(|&b| b == 0).next().unwrap_or(name);
+        names.push(String::from_utf8_lossy(name).into_owned());
+        cursor.take(nr_ids.checked_mul(8)?)?;
+    }
+    Some(names)
+}
+
+struct Cursor<'a> {
+    bytes: &'a [u8],
+    pos: usize,
+}
+
+impl<'a> Cursor<'a> {
+    fn take(&mut self, len: usize) -> Option<&'a [u8]> {
+        let bytes = self.bytes.get(self.pos..self.pos.checked_add(len)?)?;
+        self.pos += len;
+        Some(bytes)
+    }
+
+    fn u32(&mut self) -> Option<u32> {
+        let n = u32_at(self.bytes, self.pos)?;
+        self.pos += 4;
+        Some(n)
+    }
+
+    fn u64(&mut self) -> Option<u64> {
+        let n = u64_at(self.bytes, self.pos)?;
+        self.pos += 8;
+        Some(n)
+    }
+
+    /// Skip the counter values of a `PERF_SAMPLE_READ` sample.
+    fn skip_read_values(&mut self, read_format: u64) -> Option<()> {
+        let has = |flag: u64| read_format & flag != 0;
+        let times = has(PERF_FORMAT_TOTAL_TIME_ENABLED) as usize
+            + has(PERF_FORMAT_TOTAL_TIME_RUNNING) as usize;
+        let per_value = 1 + has(PERF_FORMAT_ID) as usize + has(PERF_FORMAT_LOST) as usize;
+        let words = if has(PERF_FORMAT_GROUP) {
+            let nr = self.u64()? as usize;
+            times + nr.checked_mul(per_value)?
+        } else {
+            times + per_value
+        };
+        self.take(words.checked_mul(8)?).map(|_| ())
+    }
+}
+
+/// A record of the data section, borrowing from the mapped file.
+#[derive(Debug)]
+pub enum Record<'a> {
+    Sample(Sample<'a>),
+    Mmap {
+        pid: u32,
+        start: u64,
+        len: u64,
+        pgoff: u64,
+        filename: &'a str,
+    },
+    Comm {
+        pid: u32,
+        tid: u32,
+        comm: &'a str,
+    },
+    Fork {
+        pid: u32,
+        ppid: u32,
+    },
+    /// Any other kind of record, by its `PERF_RECORD_*` type.
+    Other(u32),
+}
+
+#[derive(Debug)]
+pub struct Sample<'a> {
+    pub attr: &'a EventAttr,
+    pub ip: Option<u64>,
+    pub pid: Option<u32>,
+    pub tid: Option<u32>,
+    pub time: Option<u64>,
+    pub cpu: Option<u32>,
+    pub period: Option<u64>,
+    pub callchain: Callchain<'a>,
+    /// The user registers of `--call-graph dwarf` samples in user code, or that
+    /// entered the kernel from it.
+    pub user_regs: Option<UserRegs>,
+    /// The top of the user stack as perf dumped it, from the stack pointer up.
+    pub user_stack: &'a [u8],
+}
+
+impl<'a> Sample<'a> {
+    /// The addresses of the sample's stack, leaf first: its callchain if it was
+    /// recorded with one, otherwise just the sampled instruction.
+    ///
+    /// With `--call-graph dwarf` the callchain only has the kernel part; see
+    /// `stack_ips` for the whole stack.
+    pub fn frame_ips(&self) -> impl Iterator<Item = u64> + 'a {
+        let ip = self.ip.filter(|_| self.callchain.bytes.is_empty());
+        ip.into_iter().chain(self.callchain.ips())
+    }
+}
+
+/// The addresses of a sample's stack, leaf first, with the user part unwound from
+/// the dumped stack if perf dumped one instead of walking it.
+fn stack_ips<'a>(
+    sample: &Sample<'a>,
+    maps: &Maps<'a>,
+    unwinder: &mut Unwinder,
+) -> impl Iterator<Item = u64> + 'a {
+    let Some(regs) = sample.user_regs.filter(|_| !sample.user_stack.is_empty()) else {
+        return Either::Left(sample.frame_ips());
+    };
+    let stack = StackDump {
+        sp: regs.sp,
+        bytes: sample.user_stack,
+    };
+    let user = unwinder.unwind(regs, stack, |ip| maps.resolve(sample.pid, ip));
+    Either::Right(sample.callchain.kernel_ips().chain(user))
+}
+
+/// One of two iterators of the same items.
+enum Either<L, R> {
+    Left(L),
+    Right(R),
+}
+
+impl<T, L: Iterator<Item = T>, R: Iterator<Item = T>> Iterator for Either<L, R> {
+    type Item = T;
+
+    fn next(&mut self) -> Option<T> {
+        match self {
+            Either::Left(iter) => iter.next(),
+            Either::Right(iter) => iter.next(),
+        }
+    }
+}
+
+/// A sample's callchain, read in place from the file.
+#[derive(Debug, Clone, Copy)]
+pub struct Callchain<'a> {
+    bytes: &'a [u8],
+}
+
+impl<'a> Callchain<'a> {
+    /// Addresses, leaf first, without the markers perf puts between the kernel and
+    /// user parts.
+    pub fn ips(&self) -> impl Iterator<Item = u64> + 'a {
+        self.ips_with_markers().filter(|&ip| ip < PERF_CONTEXT_MAX)
+    }
+
+    /// Addresses of the kernel part, leaf first.
+    pub fn kernel_ips(&self) -> impl Iterator<Item = u64> + 'a {
+        self.ips_with_markers()
+            .take_while(|&ip| ip != PERF_CONTEXT_USER)
+            .filter(|&ip| ip < PERF_CONTEXT_MAX)
+    }
+
+    fn ips_with_markers(&self) -> impl Iterator<Item = u64> + 'a {
+        self.bytes
+            .chunks_exact(8)
+            .map(|word| u64::from_le_bytes(word.try_into().unwrap()))
+    }
+}
+
+pub struct Records<'a> {
+    file: &'a PerfDataFile,
+    pos: usize,
+}
+
+impl<'a> Iterator for Records<'a> {
+    type Item = io::Result<Record<'a>>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        let map = &self.file.map;
+        if self.pos >= self.file.data.end {
+            return None;
+        }
+        let header = (u32_at(map, self.pos), map.get(self.pos + 6..self.pos + 8));
+        let (Some(type_), Some(size)) = header else {
+            self.pos = self.file.data.end;
+            return Some(Err(invalid("truncated record")));
+        };
+        let size = u16::from_le_bytes(size.try_into().unwrap()) as usize;
+        let body_range = self.pos + 8..self.pos + size;
+        if size < 8 || body_range.end > self.file.data.end {
+            self.pos = self.file.data.end;
+            return Some(Err(invalid("bad record size")));
+        }
+        self.pos = body_range.end;
+        let body = &map[body_range];
+
+        let record = match type_ {
+            PERF_RECORD_SAMPLE => self.file.parse_sample(body).map(Record::Sample),
+            PERF_RECORD_MMAP => parse_mmap(body, 32),
+            // MMAP2 adds the inode or build ID, and protection, before the filename.
+            PERF_RECORD_MMAP2 => parse_mmap(body, 64),
+            PERF_RECORD_COMM => (|| {
+                Some(Record::Comm {
+                    pid: u32_at(body, 0)?,
+                    tid: u32_at(body, 4)?,
+                    comm: c_str(body.get(8..)?),
+                })
+            })(),
+            PERF_RECORD_FORK => (|| {
+                Some(Record::Fork {
+                    pid: u32_at(body, 0)?,
+                    ppid: u32_at(body, 4)?,
+                })
+            })(),
+            PERF_RECORD_COMPRESSED => {
+                self.pos = self.file.data.end;
+                return Some(Err(io::Error::new(
+                    io::ErrorKind::Unsupported,
+                    "compressed perf.data",
+                )));
+            }
+            _ => Some(Record::Other(type_)),
+        };
+        Some(record.ok_or_else(|| invalid("truncated record")))
+    }
+}
+
+fn parse_mmap(body: &[u8], filename_pos: usize) -> Option<Record<'_>> {
+    Some(Record::Mmap {
+        pid: u32_at(body, 0)?,
+        start: u64_at(body, 8)?,
+        len: u64_at(body, 16)?,
+        pgoff: u64_at(body, 24)?,
+        filename: c_str(body.get(filename_pos..)?),
+    })
+}
+
+/// A NUL-terminated string, or "" if it isn't UTF-8.
+fn c_str(bytes: &[u8]) -> &str {
+    let bytes = bytes.split(|&b| b == 0).next().unwrap_or(bytes);
+    std::str::from_utf8(bytes).unwrap_or("")
+}
+
+/// The address to symbolize for the `i`th frame from the leaf.
+fn lookup_ip(i: usize, ip: u64) -> u64 {
+    if i == 0 { ip } else { ip.saturating_sub(1) }
+}
+
+#[derive(Debug, Clone, Copy)]
+struct Mapping<'a> {
+    end: u64,
+    pgoff: u64,
+    filename: &'a str,
+}
+
+/// Files mapped into each process, by start address.
+#[derive(Default)]
+struct Maps<'a> {
+    by_pid: HashMap<u32, BTreeMap<u64, Mapping<'a>>>,
+}
+
+impl<'a> Maps<'a> {
+    fn update(&mut self, record: &Record<'a>) {
+        match *record {
+            Record::Mmap {
+                pid,
+                start,
+                len,
+                pgoff,
+                filename,
+            } if pid != KERNEL_PID => {
+                self.by_pid.entry(pid).or_default().insert(
+                    start,
+                    Mapping {
+                        end: start.saturating_add(len),
+                        pgoff,
+                        filename,
+                    },
+                );
+            }
+            // A new process starts with a copy of its parent's mappings.
+            Record::Fork { pid, ppid } if pid != ppid => {
+                if let Some(parent) = self.by_pid.get(&ppid) {
+                    let parent = parent.clone();
+                    self.by_pid.insert(pid, parent);
+                }
+            }
+            _ => {}
+        }
+    }
+
+    /// The mapped file an address is in, and the offset into it.
+    fn resolve(&self, pid: Option<u32>, ip: u64) -> Option<(&'a str, u64)> {
+        let (&start, mapping) = self.by_pid.get(&pid?)?.range(..=ip).next_back()?;
+        (ip < mapping.end && mapping.filename.starts_with('/'))
+            .then(|| (mapping.filename, ip - start + mapping.pgoff))
+    }
+}
+
+/// The samples of a perf.data file as `Event`s; see `PerfDataFile::events`.
+///
+/// Samples come out in timestamp order, as `perf script` gives them, rather than in
+/// the order of the file, where each CPU's buffer is written out in turn. Like perf,
+/// this relies on the rounds perf marks with `PERF_RECORD_FINISHED_ROUND`: once a
+/// round is written, nothing later in the file predates the round before it, so only
+/// the samples since then need holding back.
+///
+/// Stops at the first malformed record, keeping the error for `take_error`, so that
+/// callers can tell a truncated profile from a whole one.
+pub struct Events<'a> {
+    records: Records<'a>,
+    maps: Maps<'a>,
+    unwinder: Unwinder,
+    comms: HashMap<u32, &'a str>,
+    symbols: HashMap<(&'a str, u64), Vec<StackFrame>>,
+    subsample: Subsample,
+    /// Index of the next sample record.
+    index: u64,
+    /// Samples read but not yet returned, earliest first.
+    pending: BinaryHeap<Reverse<PendingEvent>>,
+    /// Pending samples up to this time can be returned.
+    flush_ns: u64,
+    /// The latest sample time as of the last round, which becomes `flush_ns` at the
+    /// next one.
+    next_flush_ns: u64,
+    max_timestamp_ns: u64,
+    /// Number of samples pushed to `pending`, to keep ties in file order.
+    pushed: u64,
+    error: Option<io::Error>,
+}
+
+struct PendingEvent {
+    timestamp_ns: u64,
+    seq: u64,
+    event: Event,
+}
+
+impl PendingEvent {
+    fn key(&self) -> (u64, u64) {
+        (self.timestamp_ns, self.seq)
+    }
+}
+
+impl PartialEq for PendingEvent {
+    fn eq(&self, other: &Self) -> bool {
+        self.key() == other.key()
+    }
+}
+
+impl Eq for PendingEvent {}
+
+impl PartialOrd for PendingEvent {
+    fn partial_cmp(&self, other: &Self) -> Option<cmp::Ordering> {
+        Some(self.cmp(other))
+    }
+}
+
+impl Ord for PendingEvent {
+    fn cmp(&self, other: &Self) -> cmp::Ordering {
+        self.key().cmp(&other.key())
+    }
+}
+
+impl<'a> Events<'a> {
+    fn new(
+        records: Records<'a>,
+        symbols: HashMap<(&'a str, u64), Vec<StackFrame>>,
+        subsample: Subsample,
+    ) -> Self {
+        Events {
+            records,
+            maps: Maps::default(),
+            unwinder: Unwinder::default(),
+            comms: HashMap::new(),
+            symbols,
+            subsample,
+            index: 0,
+            pending: BinaryHeap::new(),
+            flush_ns: 0,
+            next_flush_ns: 0,
+            max_timestamp_ns: 0,
+            pushed: 0,
+            error: None,
+        }
+    }
+
+    /// The error that stopped reading early, if any.
+    pub fn take_error(&mut self) -> Option<io::Error> {
+        self.error.take()
+    }
+
+    fn frames(&self, pid: Option<u32>, i: usize, ip: u64) -> Vec<StackFrame> {
+        let lookup = lookup_ip(i, ip);
+        let resolved = self
+            .maps
+            .resolve(pid, lookup)
+            .and_then(|key| self.symbols.get(&key));
+        match resolved {
+            Some(frames) => frames
+                .iter()
+                .map(|frame| StackFrame {
+                    addr: Some(ip),
+                    // Undo the step back, to report the return address as perf does.
+                    offset: frame.offset.map(|offset| offset + (ip - lookup)),
+                    ..frame.clone()
+                })
+                .collect(),
+            None => vec![StackFrame {
+                addr: Some(ip),
+                funcname: SPECIAL_UNKNOWN.to_owned(),
+                ..StackFrame::default()
+            }],
+        }
+    }
+
+    fn event(&self, sample: &Sample<'a>, ips: impl Iterator<Item = u64>) -> Event {
+        let comm = sample
+            .tid
+            .or(sample.pid)
+            .and_then(|id| self.comms.get(&id))
+            .copied()
+            .unwrap_or_default();
+        let stack = ips
+            .enumerate()
+            .flat_map(|(i, ip)| self.frames(sample.pid, i, ip))
+            .collect();
+        Event {
+            comm: comm.to_owned(),
+            pid: sample.pid,
+            tid: sample.tid,
+            cpu: sample.cpu,
+            timestamp_ns: sample.time,
+            period: sample.period.map(|period| period as usize),
+            kind: sample.attr.name.clone(),
+            trace: None,
+            stack,
+        }
+    }
+
+    /// Let every pending sample out, once there are no more records to order them by.
+    fn finish(&mut self) {
+        self.flush_ns = u64::MAX;
+    }
+}
+
+impl<'a> Iterator for Events<'a> {
+    type Item = Event;
+
+    fn next(&mut self) -> Option<Event> {
+        loop {
+            if self
+                .pending
+                .peek()
+                .is_some_and(|Reverse(pending)| pending.timestamp_ns <= self.flush_ns)
+            {
+                return self.pending.pop().map(|Reverse(pending)| pending.event);
+            }
+            let record = match self.records.next() {
+                Some(Ok(record)) => record,
+                Some(Err(e)) => {
+                    self.error = Some(e);
+                    self.pending.clear();
+                    return None;
+                }
+                None if self.flush_ns == u64::MAX => return None,
+                None => {
+                    self.finish();
+                    continue;
+                }
+            };
+            match record {
+                Record::Sample(sample) => {
+                    self.index += 1;
+                    if !self.subsample.keeps(self.index - 1) {
+                        continue;
+                    }
+                    let ips = stack_ips(&sample, &self.maps, &mut self.unwinder);
+                    let event = self.event(&sample, ips);
+                    // Without timestamps there's nothing to order by.
+                    let Some(timestamp_ns) = event.timestamp_ns else {
+                        return Some(event);
+                    };
+                    self.max_timestamp_ns = self.max_timestamp_ns.max(timestamp_ns);
+                    self.pending.push(Reverse(PendingEvent {
+                        timestamp_ns,
+                        seq: self.pushed,
+                        event,
+                    }));
+                    self.pushed += 1;
+                }
+                Record::Comm { pid, tid, comm } => {
+                    self.comms.insert(tid, comm);
+                    self.comms.entry(pid).or_insert(comm);
+                }
+                Record::Other(PERF_RECORD_FINISHED_ROUND) => {
+                    self.flush_ns = self.next_flush_ns;
+                    self.next_flush_ns = self.max_timestamp_ns;
+                }
+                record => self.maps.update(&record),
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use std::fs;
+    use std::path::PathBuf;
+    use std::process::Command;
+
+    use super::*;
+    use crate::Parser;
+
+    const PERF_RECORD_MISC_MMAP_BUILD_ID: u16 = 1 << 14;
+    /// What `perf record` samples without a call graph.
+    const BASIC: u64 =
+        PERF_SAMPLE_IP | PERF_SAMPLE_TID | PERF_SAMPLE_TIME | PERF_SAMPLE_CPU | PERF_SAMPLE_PERIOD;
+    /// `perf_event_attr` as of `PERF_ATTR_SIZE_VER8`.
+    const ATTR_SIZE: usize = 136;
+    /// Bit of `sample_id_all` in the attr's flags.
+    const SAMPLE_ID_ALL: u64 = 1 << 18;
+
+    struct Attr {
+        type_: u32,
+        config: u64,
+        sample_type: u64,
+        read_format: u64,
+        sample_regs_user: u64,
+        ids: Vec<u64>,
+    }
+
+    impl Attr {
+        fn new(type_: u32, config: u64, sample_type: u64) -> Self {
+            Self {
+                type_,
+                config,
+                sample_type,
+                read_format: 0,
+                sample_regs_user: 0,
+                ids: Vec::new(),
+            }
+        }
+    }
+
+    /// The fields of a sample, written in the order `sample_type` lays them out.
+    #[derive(Default)]
+    struct SampleFields {
+        id: u64,
+        ip: u64,
+        pid: u32,
+        tid: u32,
+        time: u64,
+        cpu: u32,
+        period: u64,
+        read: Vec<u64>,
+        callchain: Vec<u64>,
+        /// User registers, in the order of their indices.
+        regs: Vec<u64>,
+        stack: Vec<u8>,
+    }
+
+    fn sample_body(sample_type: u64, fields: &SampleFields) -> Vec<u8> {
+        let has = |flag: u64| sample_type & flag != 0;
+        let mut body = Vec::new();
+        if has(PERF_SAMPLE_IDENTIFIER) {
+            body.extend(fields.id.to_le_bytes());
+        }
+        if has(PERF_SAMPLE_IP) {
+            body.extend(fields.ip.to_le_bytes());
+        }
+        if has(PERF_SAMPLE_TID) {
+            body.extend(fields.pid.to_le_bytes());
+            body.extend(fields.tid.to_le_bytes());
+        }
+        if has(PERF_SAMPLE_TIME) {
+            body.extend(fields.time.to_le_bytes());
+        }
+        if has(PERF_SAMPLE_ID) {
+            body.extend(fields.id.to_le_bytes());
+        }
+        if has(PERF_SAMPLE_CPU) {
+            body.extend(fields.cpu.to_le_bytes());
+            body.extend(0u32.to_le_bytes());
+        }
+        if has(PERF_SAMPLE_PERIOD) {
+            body.extend(fields.period.to_le_bytes());
+        }
+        if has(PERF_SAMPLE_READ) {
+            body.extend(fields.read.iter().flat_map(|n| n.to_le_bytes()));
+        }
+        if has(PERF_SAMPLE_CALLCHAIN) {
+            body.extend((fields.callchain.len() as u64).to_le_bytes());
+            body.extend(fields.callchain.iter().flat_map(|ip| ip.to_le_bytes()));
+        }
+        if has(PERF_SAMPLE_REGS_USER) {
+            body.extend(PERF_SAMPLE_REGS_ABI_64.to_le_bytes());
+            body.extend(fields.regs.iter().flat_map(|reg| reg.to_le_bytes()));
+        }
+        if has(PERF_SAMPLE_STACK_USER) {
+            // perf dumps a fixed size and says how much of it it filled in.
+            let size = fields.stack.len().next_multiple_of(8) + 64;
+            let mut dump = fields.stack.clone();
+            dump.resize(size, 0);
+            body.extend((size as u64).to_le_bytes());
+            body.extend(dump);
+            body.extend((fields.stack.len() as u64).to_le_bytes());
+        }
+        body
+    }
+
+    /// The `sample_id_all` trailer of a non-sample record, for `BASIC` samples.
+    fn id_trailer(pid: u32, tid: u32, time: u64) -> Vec<u8> {
+        let mut trailer = Vec::new();
+        trailer.extend(pid.to_le_bytes());
+        trailer.extend(tid.to_le_bytes());
+        trailer.extend(time.to_le_bytes());
+        trailer.extend([0; 8]);
+        trailer
+    }
+
+    fn c_string(s: &str) -> Vec<u8> {
+        let mut bytes = s.as_bytes().to_vec();
+        bytes.resize((s.len() / 8 + 1) * 8, 0);
+        bytes
+    }
+
+    fn comm(pid: u32, tid: u32, name: &str, trailer: &[u8]) -> (u32, u16, Vec<u8>) {
+        let mut body = Vec::new();
+        body.extend(pid.to_le_bytes());
+        body.extend(tid.to_le_bytes());
+        body.extend(c_string(name));
+        body.extend(trailer);
+        (PERF_RECORD_COMM, 0, body)
+    }
+
+    fn fork(pid: u32, ppid: u32, time: u64) -> (u32, u16, Vec<u8>) {
+        let mut body = Vec::new();
+        for id in [pid, ppid, pid, ppid] {
+            body.extend(id.to_le_bytes());
+        }
+        body.extend(time.to_le_bytes());
+        (PERF_RECORD_FORK, 0, body)
+    }
+
+    /// An MMAP2 record identifying the file by build ID, or by inode without one.
+    fn mmap2(
+        pid: u32,
+        start: u64,
+        len: u64,
+        pgoff: u64,
+        build_id: Option<[u8; 20]>,
+        filename: &str,
+    ) -> (u32, u16, Vec<u8>) {
+        let mut body = Vec::new();
+        body.extend(pid.to_le_bytes());
+        body.extend(pid.to_le_bytes());
+        body.extend(start.to_le_bytes());
+        body.extend(len.to_le_bytes());
+        body.extend(pgoff.to_le_bytes());
+        let misc = match build_id {
+            Some(build_id) => {
+                body.extend([20, 0, 0, 0]);
+                body.extend(build_id);
+                PERF_RECORD_MISC_MMAP_BUILD_ID
+            }
+            None => {
+                // maj, min, ino, ino_generation
+                body.extend([8u8, 0, 0, 0, 1, 0, 0, 0]);
+                body.extend(4242u64.to_le_bytes());
+                body.extend(1u64.to_le_bytes());
+                0
+            }
+        };
+        // PROT_READ | PROT_EXEC, MAP_PRIVATE
+        body.extend(5u32.to_le_bytes());
+        body.extend(2u32.to_le_bytes());
+        body.extend(c_string(filename));
+        (PERF_RECORD_MMAP2, misc, body)
+    }
+
+    fn sample(attr: &Attr, fields: SampleFields) -> (u32, u16, Vec<u8>) {
+        (
+            PERF_RECORD_SAMPLE,
+            0,
+            sample_body(attr.sample_type, &fields),
+        )
+    }
+
+    fn finished_round() -> (u32, u16, Vec<u8>) {
+        (PERF_RECORD_FINISHED_ROUND, 0, Vec::new())
+    }
+
+    /// A perf.data file of the given events and records, as `perf record` writes
+    /// them without feature sections.
+    fn write_perf_data(name: &str, attrs: &[Attr], records: &[(u32, u16, Vec<u8>)]) -> PathBuf {
+        let ids: Vec<u8> = attrs
+            .iter()
+            .flat_map(|attr| &attr.ids)
+            .flat_map(|id| id.to_le_bytes())
+            .collect();
+        let ids_offset = FILE_HEADER_SIZE as usize;
+        let attrs_offset = ids_offset + ids.len();
+        let attr_size = ATTR_SIZE + 16;
+        let data_offset = attrs_offset + attrs.len() * attr_size;
+
+        let mut data = Vec::new();
+        for (type_, misc, body) in records {
+            assert_eq!(body.len() % 8, 0, "records are 8-byte aligned");
+            data.extend(type_.to_le_bytes());
+            data.extend(misc.to_le_bytes());
+            data.extend(((8 + body.len()) as u16).to_le_bytes());
+            data.extend(body);
+        }
+
+        let mut file = Vec::new();
+        file.extend(MAGIC);
+        for n in [
+            FILE_HEADER_SIZE,
+            attr_size as u64,
+            attrs_offset as u64,
+            (attrs.len() * attr_size) as u64,
+            data_offset as u64,
+            data.len() as u64,
+        ] {
+            file.extend(n.to_le_bytes());
+        }
+        // No event types section, nor features.
+        file.resize(FILE_HEADER_SIZE as usize, 0);
+        file.extend(&ids);
+
+        let mut next_id = ids_offset;
+        for attr in attrs {
+            let mut raw = vec![0; ATTR_SIZE];
+            raw[0..4].copy_from_slice(&attr.type_.to_le_bytes());
+            raw[4..8].copy_from_slice(&(ATTR_SIZE as u32).to_le_bytes());
+            raw[8..16].copy_from_slice(&attr.config.to_le_bytes());
+            raw[24..32].copy_from_slice(&attr.sample_type.to_le_bytes());
+            raw[32..40].copy_from_slice(&attr.read_format.to_le_bytes());
+            raw[40..48].copy_from_slice(&SAMPLE_ID_ALL.to_le_bytes());
+            raw[80..88].copy_from_slice(&attr.sample_regs_user.to_le_bytes());
+            file.extend(raw);
+            file.extend((next_id as u64).to_le_bytes());
+            file.extend(((attr.ids.len() * 8) as u64).to_le_bytes());
+            next_id += attr.ids.len() * 8;
+        }
+        file.extend(data);
+
+        let path =
+            std::env::temp_dir().join(format!("perfparser-{}-{name}.data", std::process::id()));
+        fs::write(&path, file).unwrap();
+        path
+    }
+
+    type EventSummary = (
+        String,
+        Option<u32>,
+        Option<u32>,
+        Option<u32>,
+        Option<u64>,
+        Option<usize>,
+        String,
+        Vec<Option<u64>>,
+    );
+
+    /// What the readers agree on about an event; symbols aren't compared, since the
+    /// direct reader names them with `addr2line` rather than perf's symbol tables.
+    fn summary(event: &Event) -> EventSummary {
+        (
+            event.comm.clone(),
+            event.pid,
+            event.tid,
+            event.cpu,
+            event.timestamp_ns,
+            event.period,
+            event.kind.clone(),
+            event.stack.iter().map(|frame| frame.addr).collect(),
+        )
+    }
+
+    /// Check the direct reader's events for one sample against what `perf script`
+    /// prints for it.
+    fn check_against_script(name: &str, sample_type: u64, callchain: Vec<u64>, script: &str) {
+        let attr = Attr::new(0, 0, sample_type);
+        let records = [
+            comm(100, 100, "app", &id_trailer(100, 100, 1_000_000_000)),
+            mmap2(100, 0x400000, 0x10000, 0, None, "/nonexistent/app"),
+            sample(
+                &attr,
+                SampleFields {
+                    ip: 0x401234,
+                    pid: 100,
+                    tid: 100,
+                    time: 1_000_100_000,
+                    cpu: 2,
+                    period: 1000,
+                    callchain,
+                    ..SampleFields::default()
+                },
+            ),
+        ];
+        let path = write_perf_data(name, &[attr], &records);
+        let direct: Vec<_> = PerfDataFile::open(&path)
+            .unwrap()
+            .events()
+            .unwrap()
+            .map(|event| summary(&event))
+            .collect();
+        fs::remove_file(&path).unwrap();
+        let parsed: Vec<_> = Parser::new(script.as_bytes())
+            .map(|event| summary(&event))
+            .collect();
+        assert_eq!(direct, parsed);
+    }
+
+    #[test]
+    fn sample_without_callchain_matches_perf_script() {
+        check_against_script(
+            "no-callchain",
+            BASIC,
+            vec![],
+            "app   100/100  [002]     1.000100:       1000 cycles:  \
+             401234 [unknown] (/nonexistent/app)\n",
+        );
+    }
+
+    #[test]
+    fn sample_with_callchain_matches_perf_script() {
+        check_against_script(
+            "callchain",
+            BASIC | PERF_SAMPLE_CALLCHAIN,
+            vec![PERF_CONTEXT_USER, 0x401234, 0x401100, 0x400f00],
+            "app   100/100  [002]     1.000100:       1000 cycles: \n\
+             \t  401234 [unknown] (/nonexistent/app)\n\
+             \t  401100 [unknown] (/nonexistent/app)\n\
+             \t  400f00 [unknown] (/nonexistent/app)\n\
+             \n",
+        );
+    }
+
+    #[test]
+    fn samples_are_attributed_to_their_event_by_id() {
+        let sample_type = PERF_SAMPLE_IDENTIFIER | BASIC | PERF_SAMPLE_READ | PERF_SAMPLE_CALLCHAIN;
+        let mut cycles = Attr::new(0, 0, sample_type);
+        cycles.ids = vec![11];
+        let mut misses = Attr::new(0, 3, sample_type);
+        misses.ids = vec![22];
+        for attr in [&mut cycles, &mut misses] {
+            attr.read_format = PERF_FORMAT_GROUP | PERF_FORMAT_ID;
+        }
+        // Both events' values, as a group: nr, then (value, id) of each.
+        let read = vec![2, 5000, 11, 7, 22];
+        let records = [11, 22].map(|id| {
+            sample(
+                &cycles,
+                SampleFields {
+                    id,
+                    ip: 0x401234,
+                    pid: 100,
+                    tid: 101,
+                    time: id * 1000,
+                    read: read.clone(),
+                    callchain: vec![0x401234, 0x401100],
+                    ..SampleFields::default()
+                },
+            )
+        });
+        let path = write_perf_data("ids", &[cycles, misses], &records);
+        let file = PerfDataFile::open(&path).unwrap();
+        let samples: Vec<_> = file
+            .records()
+            .map(|record| match record.unwrap() {
+                Record::Sample(sample) => (
+                    sample.attr.name.clone(),
+                    sample.tid,
+                    sample.frame_ips().collect::<Vec<_>>(),
+                ),
+                record => panic!("unexpected {record:?}"),
+            })
+            .collect();
+        fs::remove_file(&path).unwrap();
+        assert_eq!(
+            samples,
+            [
+                ("cycles".to_owned(), Some(101), vec![0x401234, 0x401100]),
+                (
+                    "cache-misses".to_owned(),
+                    Some(101),
+                    vec![0x401234, 0x401100]
+                ),
+            ]
+        );
+    }
+
+    #[test]
+    fn mmap2_with_build_id_or_inode() {
+        let attr = Attr::new(0, 0, BASIC);
+        let records = [
+            mmap2(100, 0x400000, 0x2000, 0x1000, Some([0xab; 20]), "/opt/app"),
+            mmap2(100, 0x7f0000, 0x3000, 0, None, "/usr/lib/libc.so.6"),
+        ];
+        let path = write_perf_data("mmap2", &[attr], &records);
+        let file = PerfDataFile::open(&path).unwrap();
+        let mmaps: Vec<_> = file
+            .records()
+            .map(|record| match record.unwrap() {
+                Record::Mmap {
+                    pid,
+                    start,
+                    len,
+                    pgoff,
+                    filename,
+                } => (pid, start, len, pgoff, filename.to_owned()),
+                record => panic!("unexpected {record:?}"),
+            })
+            .collect();
+        fs::remove_file(&path).unwrap();
+        assert_eq!(
+            mmaps,
+            [
+                (100, 0x400000, 0x2000, 0x1000, "/opt/app".to_owned()),
+                (100, 0x7f0000, 0x3000, 0, "/usr/lib/libc.so.6".to_owned()),
+            ]
+        );
+    }
+
+    #[test]
+    fn comm_and_fork_carry_over_to_children() {
+        let attr = Attr::new(0, 0, BASIC);
+        let records = [
+            comm(100, 100, "parent", &id_trailer(100, 100, 1000)),
+            mmap2(100, 0x400000, 0x2000, 0x1000, None, "/opt/app"),
+            fork(200, 100, 2000),
+            comm(200, 200, "child", &id_trailer(200, 200, 3000)),
+            sample(
+                &attr,
+                SampleFields {
+                    ip: 0x400010,
+                    pid: 200,
+                    tid: 200,
+                    time: 4000,
+                    ..SampleFields::default()
+                },
+            ),
+        ];
+        let path = write_perf_data("fork", &[attr], &records);
+        let file = PerfDataFile::open(&path).unwrap();
+        let mut maps = Maps::default();
+        for record in file.records() {
+            let record = record.unwrap();
+            if let Record::Fork { pid, ppid } = record {
+                assert_eq!((pid, ppid), (200, 100));
+            }
+            maps.update(&record);
+        }
+        assert_eq!(
+            maps.resolve(Some(200), 0x400010),
+            Some(("/opt/app", 0x1010))
+        );
+        assert_eq!(maps.resolve(Some(200), 0x402000), None);
+        assert_eq!(maps.resolve(Some(300), 0x400010), None);
+
+        let events: Vec<_> = file.events().unwrap().collect();
+        fs::remove_file(&path).unwrap();
+        assert_eq!(events.len(), 1);
+        // The trailer after the name isn't part of it.
+        assert_eq!(events[0].comm, "child");
+    }
+
+    #[test]
+    fn events_come_out_in_timestamp_order() {
+        let attr = Attr::new(0, 0, BASIC);
+        let at = |time: u64, cpu: u32| {
+            sample(
+                &attr,
+                SampleFields {
+                    ip: 0x401000,
+                    pid: 100,
+                    tid: 100 + cpu,
+                    time,
+                    cpu,
+                    ..SampleFields::default()
+                },
+            )
+        };
+        // Each round has the buffer of CPU 1, then of CPU 0.
+        let records = [
+            at(30, 1),
+            at(10, 0),
+            finished_round(),
+            at(40, 1),
+            at(20, 0),
+            at(35, 0),
+            finished_round(),
+            at(50, 1),
+            at(45, 0),
+        ];
+        let path = write_perf_data("order", &[Attr::new(0, 0, BASIC)], &records);
+        let times: Vec<_> = PerfDataFile::open(&path)
+            .unwrap()
+            .events()
+            .unwrap()
+            .map(|event| event.timestamp_ns.unwrap())
+            .collect();
+        fs::remove_file(&path).unwrap();
+        assert_eq!(times, [10, 20, 30, 35, 40, 45, 50]);
+    }
+
+    #[test]
+    fn malformed_records_stop_events_with_an_error() {
+        let attr = Attr::new(0, 0, BASIC);
+        let at = |time: u64| {
+            sample(
+                &attr,
+                SampleFields {
+                    ip: 0x401000,
+                    pid: 100,
+                    tid: 100,
+                    time,
+                    ..SampleFields::default()
+                },
+            )
+        };
+        // A sample too short for its fields.
+        let truncated = (PERF_RECORD_SAMPLE, 0, vec![0; 8]);
+        let records = [at(10), finished_round(), at(20), truncated, at(30)];
+        let path = write_perf_data("malformed", &[Attr::new(0, 0, BASIC)], &records);
+        let file = PerfDataFile::open(&path).unwrap();
+        // `events` checks the records before returning these, so build them directly.
+        let mut events = Events::new(file.records(), HashMap::new(), Subsample::all());
+        let times: Vec<_> = events
+            .by_ref()
+            .map(|event| event.timestamp_ns.unwrap())
+            .collect();
+        let error = events.take_error().unwrap();
+        fs::remove_file(&path).unwrap();
+        assert!(times.len() < 3);
+        assert_eq!(error.kind(), io::ErrorKind::InvalidData);
+        assert!(file.events().is_err());
+    }
+
+    /// The registers and top of the stack of the caller, like perf samples them.
+    #[cfg(target_arch = "x86_64")]
+    #[inline(never)]
+    fn capture_user_stack() -> ([u64; 3], Vec<u8>) {
+        let (ip, sp, bp): (u64, u64, u64);
+        unsafe {
+            std::arch::asm!(
+                "lea {ip}, [rip]",
+                "mov {sp}, rsp",
+                "mov {bp}, rbp",
+                ip = out(reg) ip,
+                sp = out(reg) sp,
+                bp = out(reg) bp,
+            );
+        }
+        let maps = fs::read_to_string("/proc/self/maps").unwrap();
+        let stack_end = maps
+            .lines()
+            .filter_map(|line| {
+                let (start, end) = line.split_whitespace().next()?.split_once('-')?;
+                let range =
+                    u64::from_str_radix(start, 16).ok()?..u64::from_str_radix(end, 16).ok()?;
+                range.contains(&sp).then_some(range.end)
+            })
+            .next()
+            .unwrap();
+        let len = (stack_end - sp).min(16 * 1024) as usize;
+        let stack = unsafe { std::slice::from_raw_parts(sp as *const u8, len) }.to_vec();
+        ([bp, sp, ip], stack)
+    }
+
+    #[cfg(target_arch = "x86_64")]
+    #[inline(never)]
+    fn unwound_callee() -> ([u64; 3], Vec<u8>) {
+        let captured = capture_user_stack();
+        std::hint::black_box(&captured);
+        captured
+    }
+
+    #[cfg(target_arch = "x86_64")]
+    #[inline(never)]
+    fn unwound_caller() -> ([u64; 3], Vec<u8>) {
+        let captured = unwound_callee();
+        std::hint::black_box(&captured);
+        captured
+    }
+
+    /// Unwind a stack of this test, dumped the way `--call-graph dwarf` dumps it.
+    #[cfg(target_arch = "x86_64")]
+    #[test]
+    fn user_stack_dumps_are_unwound() {
+        let (regs, stack) = unwound_caller();
+        let exe = std::env::current_exe().unwrap().canonicalize().unwrap();
+        let exe = exe.to_str().unwrap();
+        let pid = std::process::id();
+        let maps = fs::read_to_string("/proc/self/maps").unwrap();
+        let mut records: Vec<_> = maps
+            .lines()
+            .filter_map(|line| {
+                let fields: Vec<_> = line.split_whitespace().collect();
+                if fields.get(5) != Some(&exe) {
+                    return None;
+                }
+                let (start, end) = fields[0].split_once('-')?;
+                let start = u64::from_str_radix(start, 16).ok()?;
+                let end = u64::from_str_radix(end, 16).ok()?;
+                let pgoff = u64::from_str_radix(fields[2], 16).ok()?;
+                Some(mmap2(pid, start, end - start, pgoff, None, exe))
+            })
+            .collect();
+        let mut attr = Attr::new(
+            0,
+            0,
+            BASIC | PERF_SAMPLE_CALLCHAIN | PERF_SAMPLE_REGS_USER | PERF_SAMPLE_STACK_USER,
+        );
+        attr.sample_regs_user = 1 << PERF_REG_X86_BP | 1 << PERF_REG_X86_SP | 1 << PERF_REG_X86_IP;
+        records.push(sample(
+            &attr,
+            SampleFields {
+                ip: regs[2],
+                pid,
+                tid: pid,
+                time: 1000,
+                regs: regs.to_vec(),
+                stack,
+                ..SampleFields::default()
+            },
+        ));
+        let path = write_perf_data("unwind", &[attr], &records);
+        let events: Vec<_> = PerfDataFile::open(&path)
+            .unwrap()
+            .events()
+            .unwrap()
+            .collect();
+        fs::remove_file(&path).unwrap();
+
+        assert_eq!(events.len(), 1);
+        let stack = &events[0].stack;
+        assert_eq!(stack[0].addr, Some(regs[2]));
+        let position = |name: &str| {
+            stack
+                .iter()
+                .position(|frame| frame.funcname.contains(name))
+                .unwrap_or_else(|| panic!("no {name} in {stack:#?}"))
+        };
+        let callee = position("unwound_callee");
+        assert!(position("capture_user_stack") < callee);
+        assert!(callee < position("unwound_caller"));
+        assert!(position("unwound_caller") < position("user_stack_dumps_are_unwound"));
+    }
+
+    /// Compare both readers on a real recording, if perf can record here.
+    #[test]
+    fn matches_perf_script_on_a_recording() {
+        let path =
+            std::env::temp_dir().join(format!("perfparser-{}-real.data", std::process::id()));
+        let recorded = Command::new("perf")
+            .args(["record", "-q", "-F", "4999", "--call-graph", "fp", "-o"])
+            .arg(&path)
+            .args([
+                "--",
+                "sh",
+                "-c",
+                "i=0; while [ $i -lt 100000 ]; do i=$((i+1)); done",
+            ])
+            .output();
+        if !recorded.is_ok_and(|output| output.status.success()) {
+            let _ = fs::remove_file(&path);
+            eprintln!("perf can't record here; skipping");
+            return;
+        }
+        let direct: Vec<_> = PerfDataFile::open(&path)
+            .unwrap()
+            .events()
+            .unwrap()
+            .map(|event| summary(&event))
+            .collect();
+        let script = Command::new("perf")
+            .args([
+                "script",
+                "--ns",
+                "-F",
+                "comm,pid,tid,cpu,time,period,event,ip,sym,dso",
+                "-i",
+            ])
+            .arg(&path)
+            .output()
+            .unwrap();
+        fs::remove_file(&path).unwrap();
+        let parsed: Vec<_> = Parser::new(&script.stdout[..])
+            .map(|event| summary(&event))
+            .collect();
+        assert!(!direct.is_empty());
+        assert_eq!(direct, parsed);
+    }
+}
@@ -0,0 +1,189 @@
+use std::collections::HashMap;
+use std::fs::File;
+use std::io::{self, Write};
+use std::process::{Command, Stdio};
+use std::thread;
+
+use crate::mmap::{Mmap, u16_at, u32_at, u64_at};
+use crate::{SPECIAL_UNKNOWN, SourceLine, StackFrame};
+
+const ELF_MAGIC: &[u8; 4] = b"\x7fELF";
+const ELFCLASS64: u8 = 2;
+const ELFDATA2LSB: u8 = 1;
+const PT_LOAD: u32 = 1;
+const SHT_SYMTAB: u32 = 2;
+const SHT_DYNSYM: u32 = 11;
+const STT_FUNC: u8 = 2;
+
+/// Where an ELF binary's loadable segments and functions are.
+pub(crate) struct Elf {
+    /// `(p_offset, p_filesz, p_vaddr)` of each loadable segment.
+    segments: Vec<(u64, u64, u64)>,
+    /// `(start, end)` addresses of functions, sorted by start.
+    functions: Vec<(u64, u64)>,
+}
+
+impl Elf {
+    pub(crate) fn parse(bytes: &[u8]) -> Option<Self> {
+        if bytes.get(..4)? != ELF_MAGIC
+            || *bytes.get(4)? != ELFCLASS64
+            || *bytes.get(5)? != ELFDATA2LSB
+        {
+            return None;
+        }
+
+        let phoff = u64_at(bytes, 0x20)? as usize;
+        let phentsize = u16_at(bytes, 0x36)? as usize;
+        let phnum = u16_at(bytes, 0x38)? as usize;
+        let mut segments = Vec::new();
+        for i in 0..phnum {
+            let ph = phoff + i * phentsize;
+            if u32_at(bytes, ph)? == PT_LOAD {
+                segments.push((
+                    u64_at(bytes, ph + 8)?,
+                    u64_at(bytes, ph + 32)?,
+                    u64_at(bytes, ph + 16)?,
+                ));
+            }
+        }
+
+        let shoff = u64_at(bytes, 0x28)? as usize;
+        let shentsize = u16_at(bytes, 0x3a)? as usize;
+        let shnum = u16_at(bytes, 0x3c)? as usize;
+        let mut functions = Vec::new();
+        // Stripped binaries only have the dynamic symbols.
+        for wanted in [SHT_SYMTAB, SHT_DYNSYM] {
+            for i in 0..shnum {
+                let sh = shoff + i * shentsize;
+                if u32_at(bytes, sh + 4)? != wanted {
+                    continue;
+                }
+                let offset = u64_at(bytes, sh + 24)? as usize;
+                let size = u64_at(bytes, sh + 32)? as usize;
+                let entsize = (u64_at(bytes, sh + 56)? as usize).max(24);
+                for sym in (offset..offset + size).step_by(entsize) {
+                    let info = *bytes.get(sym + 4)?;
+                    let value = u64_at(bytes, sym + 8)?;
+                    let size = u64_at(bytes, sym + 16)?;
+                    if info & 0xf == STT_FUNC && value != 0 {
+                        functions.push((value, value + size.max(1)));
+                    }
+                }
+            }
+            if !functions.is_empty() {
+                break;
+            }
+        }
+        functions.sort_unstable();
+        Some(Elf {
+            segments,
+            functions,
+        })
+    }
+
+    /// The virtual address an offset into the file is loaded at.
+    pub(crate) fn vaddr(&self, file_offset: u64) -> Option<u64> {
+        self.segments
+            .iter()
+            .find(|&&(offset, size, _)| (offset..offset + size).contains(&file_offset))
+            .map(|&(offset, _, vaddr)| file_offset - offset + vaddr)
+    }
+
+    /// How far `vaddr` is into the function containing it.
+    fn function_offset(&self, vaddr: u64) -> Option<u64> {
+        let i = self.functions.partition_point(|&(start, _)| start <= vaddr);
+        let (start, end) = *self.functions.get(i.checked_sub(1)?)?;
+        (vaddr < end).then_some(vaddr - start)
+    }
+}
+
+/// Resolve offsets into a mapped binary to stack frames, innermost first: the
+/// functions inlined at the address, then the function it's in.
+///
+/// Line info comes from one `addr2line` run over all the offsets, so symbolizing a
+/// binary costs one process however many addresses a recording sampled in it.
+/// Offsets that can't be resolved, for instance because the binary has no debug
+/// info or was deleted since the recording, are left out.
+pub fn symbolize(path: &str, file_offsets: &[u64]) -> io::Result<HashMap<u64, Vec<StackFrame>>> {
+    let mut resolved = HashMap::new();
+    let Ok(file) = File::open(path) else {
+        return Ok(resolved);
+    };
+    let Some(elf) = Elf::parse(&Mmap::open(&file)?) else {
+        return Ok(resolved);
+    };
+    let addrs: Vec<(u64, u64)> = file_offsets
+        .iter()
+        .filter_map(|&offset| Some((offset, elf.vaddr(offset)?)))
+        .collect();
+    if addrs.is_empty() {
+        return Ok(resolved);
+    }
+
+    let mut child = Command::new("addr2line")
+        .args(["-a", "-f", "-i", "-C", "-e", path])
+        .stdin(Stdio::piped())
+        .stdout(Stdio::piped())
+        .stderr(Stdio::null())
+        .spawn()?;
+    let mut stdin = child.stdin.take().unwrap();
+    let input: String = addrs
+        .iter()
+        .map(|&(_, vaddr)| format!("{vaddr:#x}\n"))
+        .collect();
+    // Written from another thread so that a full stdout pipe can't deadlock us.
+    let output = thread::scope(|s| {
+        s.spawn(move || stdin.write_all(input.as_bytes()));
+        child.wait_with_output()
+    })?;
+    if !output.status.success() {
+        return Err(io::Error::other("addr2line failed"));
+    }
+
+    let stdout = String::from_utf8_lossy(&output.stdout);
+    let mut lines = stdout.lines().peekable();
+    for &(offset, vaddr) in &addrs {
+        // Each address's block starts with the address itself (`-a`).
+        if !lines.next().is_some_and(is_address_line) {
+            return Err(io::Error::other("unexpected addr2line output"));
+        }
+        let mut frames = Vec::new();
+        while let Some(funcname) = lines.next_if(|line| !is_address_line(line)) {
+            let location = lines.next().unwrap_or("??:0");
+            frames.push(StackFrame {
+                addr: None,
+                funcname: if funcname == "??" {
+                    SPECIAL_UNKNOWN.to_owned()
+                } else {
+                    funcname.to_owned()
+                },
+                offset: elf.function_offset(vaddr),
+                srcline: parse_location(location),
+                inlined: true,
+            });
+        }
+        if let Some(outermost) = frames.last_mut() {
+            outermost.inlined = false;
+            resolved.insert(offset, frames);
+        }
+    }
+    Ok(resolved)
+}
+
+fn is_address_line(line: &str) -> bool {
+    line.strip_prefix("0x")
+        .is_some_and(|hex| !hex.is_empty() && hex.bytes().all(|b| b.is_ascii_hexdigit()))
+}
+
+/// Parse an `addr2line` location like `/src/main.rs:12 (discriminator 3)`.
+fn parse_location(location: &str) -> Option<SourceLine> {
+    let location = location
+        .split_once(" (discriminator")
+        .map_or(location, |(location, _)| location);
+    let (path, line) = location.rsplit_once(':')?;
+    let line = line.parse().ok().filter(|&line| line > 0)?;
+    (path != "??").then(|| SourceLine {
+        path: path.to_owned(),
+        line,
+    })
+}
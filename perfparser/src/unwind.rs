@@ -0,0 +1,667 @@
+//! Unwinding the user stacks perf dumps with `--call-graph dwarf`, by the call frame
+//! information in each binary's `.eh_frame`, as `perf script` does with libunwind.
+//!
+//! Only what x86-64 code built by rustc and C compilers needs is supported: the CFA
+//! as an offset from the stack or frame pointer, and the return address and frame
+//! pointer saved at offsets from the CFA. Frames described any other way end the
+//! stack.
+
+use std::collections::HashMap;
+use std::fs::File;
+use std::ops::Range;
+
+use crate::mmap::{Mmap, u16_at, u32_at, u64_at};
+use crate::symbols::Elf;
+
+/// DWARF numbers of the x86-64 registers unwinding needs.
+const DWARF_RBP: u16 = 6;
+const DWARF_RSP: u16 = 7;
+
+/// Frames unwound at most per sample, like perf's default `--max-stack`.
+const MAX_FRAMES: usize = 127;
+
+const DW_EH_PE_OMIT: u8 = 0xff;
+const DW_EH_PE_PCREL: u8 = 0x10;
+
+/// User registers at the time of a sample.
+#[derive(Debug, Clone, Copy)]
+pub struct UserRegs {
+    pub ip: u64,
+    pub sp: u64,
+    pub bp: Option<u64>,
+}
+
+/// The top of a user stack as perf copied it, starting at the sampled stack pointer.
+#[derive(Debug, Clone, Copy)]
+pub struct StackDump<'a> {
+    pub sp: u64,
+    pub bytes: &'a [u8],
+}
+
+impl StackDump<'_> {
+    fn read(&self, addr: u64) -> Option<u64> {
+        let pos = addr.checked_sub(self.sp)?;
+        u64_at(self.bytes, usize::try_from(pos).ok()?)
+    }
+}
+
+/// Unwinds user stacks, loading each binary's unwind table the first time a stack
+/// passes through it.
+#[derive(Default)]
+pub struct Unwinder {
+    /// `None` for binaries that can't be read or have no `.eh_frame`.
+    tables: HashMap<String, Option<UnwindTable>>,
+}
+
+impl Unwinder {
+    /// The return addresses of a stack, leaf first, starting with the sampled `ip`.
+    ///
+    /// `resolve` gives the mapped file an address is in and the offset into it.
+    pub fn unwind<'p>(
+        &mut self,
+        regs: UserRegs,
+        stack: StackDump<'_>,
+        resolve: impl Fn(u64) -> Option<(&'p str, u64)>,
+    ) -> Vec<u64> {
+        let mut frames = vec![regs.ip];
+        let mut regs = regs;
+        while frames.len() < MAX_FRAMES {
+            // Callers' return addresses are looked up inside the call instruction, as
+            // the call may be the last instruction of the function.
+            let lookup = if frames.len() == 1 {
+                regs.ip
+            } else {
+                regs.ip.saturating_sub(1)
+            };
+            let row = resolve(lookup).and_then(|(path, offset)| self.table(path)?.row(offset));
+            let Some(caller) = step(regs, row, stack) else {
+                break;
+            };
+            // The stack grows down, so callers' frames are always higher up.
+            if caller.ip == 0 || caller.sp <= regs.sp {
+                break;
+            }
+            frames.push(caller.ip);
+            regs = caller;
+        }
+        frames
+    }
+
+    fn table(&mut self, path: &str) -> Option<&UnwindTable> {
+        if !self.tables.contains_key(path) {
+            self.tables.insert(path.to_owned(), UnwindTable::load(path));
+        }
+        self.tables[path].as_ref()
+    }
+}
+
+/// The registers of the caller of the frame `regs` describe, by its unwind row, or by
+/// the frame pointer for code without unwind info.
+fn step(regs: UserRegs, row: Option<Row>, stack: StackDump<'_>) -> Option<UserRegs> {
+    let Some(row) = row else {
+        let bp = regs.bp?;
+        return Some(UserRegs {
+            ip: stack.read(bp.checked_add(8)?)?,
+            sp: bp.checked_add(16)?,
+            bp: stack.read(bp),
+        });
+    };
+    let base = match row.cfa_reg {
+        DWARF_RSP => regs.sp,
+        DWARF_RBP => regs.bp?,
+        _ => return None,
+    };
+    let cfa = base.checked_add_signed(row.cfa_offset)?;
+    let Rule::Offset(ra_offset) = row.ra else {
+        // The outermost frame leaves its return address undefined.
+        return None;
+    };
+    let bp = match row.bp {
+        Rule::Same => regs.bp,
+        Rule::Offset(offset) => stack.read(cfa.checked_add_signed(offset)?),
+        Rule::Undefined | Rule::Unsupported => None,
+    };
+    Some(UserRegs {
+        ip: stack.read(cfa.checked_add_signed(ra_offset)?)?,
+        sp: cfa,
+        bp,
+    })
+}
+
+/// How to recover a register in the caller.
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+enum Rule {
+    /// It wasn't changed.
+    Same,
+    Undefined,
+    /// It was saved at this offset from the CFA.
+    Offset(i64),
+    /// Some other way, which this unwinder doesn't follow.
+    Unsupported,
+}
+
+/// The unwind row at one address: where the CFA, the caller's stack pointer, is, and
+/// how to get at the frame pointer and return address.
+#[derive(Debug, Clone, Copy)]
+struct Row {
+    /// `u16::MAX` if the CFA is given by an expression.
+    cfa_reg: u16,
+    cfa_offset: i64,
+    bp: Rule,
+    ra: Rule,
+}
+
+struct Cie {
+    code_align: u64,
+    data_align: i64,
+    ra_reg: u16,
+    fde_encoding: u8,
+    /// Whether FDEs have augmentation data to skip.
+    has_augmentation_data: bool,
+    instructions: Range<usize>,
+}
+
+struct Fde {
+    start: u64,
+    end: u64,
+    cie: usize,
+    instructions: Range<usize>,
+}
+
+/// The call frame information of one binary.
+struct UnwindTable {
+    map: Mmap,
+    elf: Elf,
+    cies: Vec<Cie>,
+    /// Sorted by `start`.
+    fdes: Vec<Fde>,
+}
+
+impl UnwindTable {
+    fn load(path: &str) -> Option<Self> {
+        let map = Mmap::open(&File::open(path).ok()?).ok()?;
+        let elf = Elf::parse(&map)?;
+        let (offset, size, addr) = find_section(&map, ".eh_frame")?;
+        let section = offset..offset.checked_add(size)?.min(map.len());
+        let (cies, mut fdes) = parse_eh_frame(&map, section, addr)?;
+        fdes.sort_unstable_by_key(|fde| fde.start);
+        Some(UnwindTable {
+            map,
+            elf,
+            cies,
+            fdes,
+        })
+    }
+
+    /// The unwind row at an offset into the file, if unwind info covers it.
+    fn row(&self, file_offset: u64) -> Option<Row> {
+        let vaddr = self.elf.vaddr(file_offset)?;
+        let i = self.fdes.partition_point(|fde| fde.start <= vaddr);
+        let fde = self.fdes.get(i.checked_sub(1)?)?;
+        if vaddr >= fde.end {
+            return None;
+        }
+        let cie = &self.cies[fde.cie];
+        let mut initial = Row {
+            cfa_reg: DWARF_RSP,
+            cfa_offset: 8,
+            bp: Rule::Same,
+            ra: Rule::Offset(-8),
+        };
+        let mut program = CfaProgram {
+            bytes: &self.map,
+            cie,
+            loc: fde.start,
+            target: u64::MAX,
+            remembered: Vec::new(),
+        };
+        program.run(cie.instructions.clone(), &mut initial, None)?;
+        let mut row = initial;
+        program.target = vaddr;
+        program.run(fde.instructions.clone(), &mut row, Some(&initial))?;
+        Some(row)
+    }
+}
+
+/// The file offset, size and load address of a section.
+fn find_section(bytes: &[u8], name: &str) -> Option<(usize, usize, u64)> {
+    let shoff = u64_at(bytes, 0x28)? as usize;
+    let shentsize = u16_at(bytes, 0x3a)? as usize;
+    let shnum = u16_at(bytes, 0x3c)? as usize;
+    let shstrndx = u16_at(bytes, 0x3e)? as usize;
+    let strtab = u64_at(bytes, shoff + shstrndx * shentsize + 24)? as usize;
+    (0..shnum).find_map(|i| {
+        let sh = shoff + i * shentsize;
+        let name_offset = u32_at(bytes, sh)? as usize;
+        let section_name = bytes.get(strtab.checked_add(name_offset)?..)?;
+        let section_name = section_name.split(|&b| b == 0).next()?;
+        (section_name == name.as_bytes()).then_some((
+            u64_at(bytes, sh + 24)? as usize,
+            u64_at(bytes, sh + 32)? as usize,
+            u64_at(bytes, sh + 16)?,
+        ))
+    })
+}
+
+/// The CIEs and FDEs of an `.eh_frame` section loaded at `addr`.
+fn parse_eh_frame(bytes: &[u8], section: Range<usize>, addr: u64) -> Option<(Vec<Cie>, Vec<Fde>)> {
+    let address_of = |pos: usize| addr + (pos - section.start) as u64;
+    let mut cies = Vec::new();
+    let mut cie_ids: HashMap<usize, Option<usize>> = HashMap::new();
+    let mut fdes = Vec::new();
+    let mut pos = section.start;
+    while pos + 4 <= section.end {
+        let mut reader = Reader { bytes, pos };
+        let (length, body_start) = reader.entry_length()?;
+        if length == 0 {
+            break;
+        }
+        let entry_end = body_start.checked_add(length)?;
+        if entry_end > section.end {
+            break;
+        }
+        pos = entry_end;
+        let id_pos = reader.pos;
+        let id = reader.u32()? as usize;
+        if id == 0 {
+            continue;
+        }
+        // FDEs point back at their CIE, relative to the pointer.
+        let Some(cie_pos) = id_pos.checked_sub(id) else {
+            continue;
+        };
+        let cie_id = *cie_ids.entry(cie_pos).or_insert_with(|| {
+            let cie = parse_cie(bytes, cie_pos, section.end)?;
+            cies.push(cie);
+            Some(cies.len() - 1)
+        });
+        let Some(cie_id) = cie_id else {
+            continue;
+        };
+        let cie = &cies[cie_id];
+        let Some(start) = reader.encoded(cie.fde_encoding, &address_of) else {
+            continue;
+        };
+        // The range is a length, so only the format of the encoding applies.
+        let Some(len) = reader.encoded(cie.fde_encoding & 0x0f, &address_of) else {
+            continue;
+        };
+        if cie.has_augmentation_data {
+            let Some(skip) = reader.uleb() else {
+                continue;
+            };
+            reader.pos = reader.pos.saturating_add(skip as usize);
+        }
+        if reader.pos > entry_end || len == 0 {
+            continue;
+        }
+        fdes.push(Fde {
+            start,
+            end: start.wrapping_add(len),
+            cie: cie_id,
+            instructions: reader.pos..entry_end,
+        });
+    }
+    Some((cies, fdes))
+}
+
+fn parse_cie(bytes: &[u8], pos: usize, section_end: usize) -> Option<Cie> {
+    let mut reader = Reader { bytes, pos };
+    let (length, body_start) = reader.entry_length()?;
+    let end = body_start.checked_add(length)?;
+    if end > section_end || reader.u32()? != 0 {
+        return None;
+    }
+    let version = reader.u8()?;
+    let augmentation = reader.c_str()?;
+    // GCC 2's "eh" augmentation has a pointer of unknown meaning first.
+    if augmentation.starts_with(b"eh") {
+        return None;
+    }
+    let code_align = reader.uleb()?;
+    let data_align = reader.sleb()?;
+    let ra_reg = if version == 1 {
+        reader.u8()? as u16
+    } else {
+        reader.uleb()? as u16
+    };
+    let mut fde_encoding = 0;
+    let has_augmentation_data = augmentation.first() == Some(&b'z');
+    if has_augmentation_data {
+        let data_len = reader.uleb()? as usize;
+        let data_end = reader.pos.checked_add(data_len)?;
+        for &c in &augmentation[1..] {
+            match c {
+                b'R' => fde_encoding = reader.u8()?,
+                b'L' => {
+                    reader.u8()?;
+                }
+                b'P' => {
+                    let encoding = reader.u8()?;
+                    // Only the size matters, to skip the personality routine.
+                    reader.encoded(encoding & 0x0f, &|_| 0)?;
+                }
+                _ => {}
+            }
+        }
+        reader.pos = data_end;
+    }
+    if reader.pos > end {
+        return None;
+    }
+    Some(Cie {
+        code_align,
+        data_align,
+        ra_reg,
+        fde_encoding,
+        has_augmentation_data,
+        instructions: reader.pos..end,
+    })
+}
+
+/// Runs CFA instructions up to a target address.
+struct CfaProgram<'a> {
+    bytes: &'a [u8],
+    cie: &'a Cie,
+    loc: u64,
+    target: u64,
+    remembered: Vec<Row>,
+}
+
+impl CfaProgram<'_> {
+    /// Apply instructions to `row` until the location passes the target. `initial`
+    /// is the row the CIE's instructions set up, which `DW_CFA_restore` goes back
+    /// to. Returns `None` for instructions it doesn't know.
+    fn run(
+        &mut self,
+        instructions: Range<usize>,
+        row: &mut Row,
+        initial: Option<&Row>,
+    ) -> Option<()> {
+        let mut reader = Reader {
+            bytes: &self.bytes[..instructions.end],
+            pos: instructions.start,
+        };
+        let code_align = self.cie.code_align;
+        let data_align = self.cie.data_align;
+        while reader.pos < instructions.end {
+            let op = reader.u8()?;
+            let advance = match op >> 6 {
+                1 => Some((op & 0x3f) as u64),
+                2 => {
+                    let offset = reader.uleb()? as i64 * data_align;
+                    self.set(row, (op & 0x3f) as u16, Rule::Offset(offset));
+                    None
+                }
+                3 => {
+                    self.restore(row, initial, (op & 0x3f) as u16);
+                    None
+                }
+                _ => match op {
+                    // DW_CFA_nop
+                    0x00 => None,
+                    // DW_CFA_set_loc
+                    0x01 => {
+                        let loc = reader.encoded(self.cie.fde_encoding & 0x0f, &|_| 0)?;
+                        if loc > self.target {
+                            return Some(());
+                        }
+                        self.loc = loc;
+                        None
+                    }
+                    // DW_CFA_advance_loc1, 2 and 4
+                    0x02 => Some(reader.u8()? as u64),
+                    0x03 => Some(reader.u16()? as u64),
+                    0x04 => Some(reader.u32()? as u64),
+                    // DW_CFA_offset_extended
+                    0x05 => {
+                        let reg = reader.uleb()? as u16;
+                        let offset = reader.uleb()? as i64 * data_align;
+                        self.set(row, reg, Rule::Offset(offset));
+                        None
+                    }
+                    // DW_CFA_restore_extended
+                    0x06 => {
+                        let reg = reader.uleb()? as u16;
+                        self.restore(row, initial, reg);
+                        None
+                    }
+                    // DW_CFA_undefined
+                    0x07 => {
+                        let reg = reader.uleb()? as u16;
+                        self.set(row, reg, Rule::Undefined);
+                        None
+                    }
+                    // DW_CFA_same_value
+                    0x08 => {
+                        let reg = reader.uleb()? as u16;
+                        self.set(row, reg, Rule::Same);
+                        None
+                    }
+                    // DW_CFA_register
+                    0x09 => {
+                        let reg = reader.uleb()? as u16;
+                        reader.uleb()?;
+                        self.set(row, reg, Rule::Unsupported);
+                        None
+                    }
+                    // DW_CFA_remember_state
+                    0x0a => {
+                        self.remembered.push(*row);
+                        None
+                    }
+                    // DW_CFA_restore_state
+                    0x0b => {
+                        *row = self.remembered.pop()?;
+                        None
+                    }
+                    // DW_CFA_def_cfa
+                    0x0c => {
+                        row.cfa_reg = reader.uleb()? as u16;
+                        row.cfa_offset = reader.uleb()? as i64;
+                        None
+                    }
+                    // DW_CFA_def_cfa_register
+                    0x0d => {
+                        row.cfa_reg = reader.uleb()? as u16;
+                        None
+                    }
+                    // DW_CFA_def_cfa_offset
+                    0x0e => {
+                        row.cfa_offset = reader.uleb()? as i64;
+                        None
+                    }
+                    // DW_CFA_def_cfa_expression
+                    0x0f => {
+                        let len = reader.uleb()? as usize;
+                        reader.pos = reader.pos.checked_add(len)?;
+                        row.cfa_reg = u16::MAX;
+                        None
+                    }
+                    // DW_CFA_expression and DW_CFA_val_expression
+                    0x10 | 0x16 => {
+                        let reg = reader.uleb()? as u16;
+                        let len = reader.uleb()? as usize;
+                        reader.pos = reader.pos.checked_add(len)?;
+                        self.set(row, reg, Rule::Unsupported);
+                        None
+                    }
+                    // DW_CFA_offset_extended_sf
+                    0x11 => {
+                        let reg = reader.uleb()? as u16;
+                        let offset = reader.sleb()? * data_align;
+                        self.set(row, reg, Rule::Offset(offset));
+                        None
+                    }
+                    // DW_CFA_def_cfa_sf
+                    0x12 => {
+                        row.cfa_reg = reader.uleb()? as u16;
+                        row.cfa_offset = reader.sleb()? * data_align;
+                        None
+                    }
+                    // DW_CFA_def_cfa_offset_sf
+                    0x13 => {
+                        row.cfa_offset = reader.sleb()? * data_align;
+                        None
+                    }
+                    // DW_CFA_val_offset and DW_CFA_val_offset_sf
+                    0x14 | 0x15 => {
+                        let reg = reader.uleb()? as u16;
+                        if op == 0x14 {
+                            reader.uleb()?;
+                        } else {
+                            reader.sleb()?;
+                        }
+                        self.set(row, reg, Rule::Unsupported);
+                        None
+                    }
+                    // DW_CFA_GNU_args_size
+                    0x2e => {
+                        reader.uleb()?;
+                        None
+                    }
+                    // DW_CFA_GNU_negative_offset_extended
+                    0x2f => {
+                        let reg = reader.uleb()? as u16;
+                        let offset = -(reader.uleb()? as i64) * data_align;
+                        self.set(row, reg, Rule::Offset(offset));
+                        None
+                    }
+                    _ => return None,
+                },
+            };
+            if let Some(delta) = advance {
+                let loc = self.loc.checked_add(delta.checked_mul(code_align)?)?;
+                if loc > self.target {
+                    return Some(());
+                }
+                self.loc = loc;
+            }
+        }
+        Some(())
+    }
+
+    fn set(&self, row: &mut Row, reg: u16, rule: Rule) {
+        if reg == DWARF_RBP {
+            row.bp = rule;
+        } else if reg == self.cie.ra_reg {
+            row.ra = rule;
+        }
+    }
+
+    fn restore(&self, row: &mut Row, initial: Option<&Row>, reg: u16) {
+        let Some(initial) = initial else {
+            return;
+        };
+        if reg == DWARF_RBP {
+            row.bp = initial.bp;
+        } else if reg == self.cie.ra_reg {
+            row.ra = initial.ra;
+        }
+    }
+}
+
+struct Reader<'a> {
+    bytes: &'a [u8],
+    pos: usize,
+}
+
+impl<'a> Reader<'a> {
+    fn u8(&mut self) -> Option<u8> {
+        let n = *self.bytes.get(self.pos)?;
+        self.pos += 1;
+        Some(n)
+    }
+
+    fn u16(&mut self) -> Option<u16> {
+        let n = u16_at(self.bytes, self.pos)?;
+        self.pos += 2;
+        Some(n)
+    }
+
+    fn u32(&mut self) -> Option<u32> {
+        let n = u32_at(self.bytes, self.pos)?;
+        self.pos += 4;
+        Some(n)
+    }
+
+    fn u64(&mut self) -> Option<u64> {
+        let n = u64_at(self.bytes, self.pos)?;
+        self.pos += 8;
+        Some(n)
+    }
+
+    fn uleb(&mut self) -> Option<u64> {
+        let mut value = 0u64;
+        let mut shift = 0;
+        loop {
+            let byte = self.u8()?;
+            if shift < 64 {
+                value |= ((byte & 0x7f) as u64) << shift;
+            }
+            shift += 7;
+            if byte & 0x80 == 0 {
+                return Some(value);
+            }
+        }
+    }
+
+    fn sleb(&mut self) -> Option<i64> {
+        let mut value = 0i64;
+        let mut shift = 0;
+        loop {
+            let byte = self.u8()?;
+            if shift < 64 {
+                value |= ((byte & 0x7f) as i64) << shift;
+            }
+            shift += 7;
+            if byte & 0x80 == 0 {
+                if shift < 64 && byte & 0x40 != 0 {
+                    value |= -1i64 << shift;
+                }
+                return Some(value);
+            }
+        }
+    }
+
+    fn c_str(&mut self) -> Option<&'a [u8]> {
+        let rest = self.bytes.get(self.pos..)?;
+        let len = rest.iter().position(|&b| b == 0)?;
+        self.pos += len + 1;
+        Some(&rest[..len])
+    }
+
+    /// The length of a CIE or FDE, and where its body starts.
+    fn entry_length(&mut self) -> Option<(usize, usize)> {
+        let length = match self.u32()? {
+            0xffff_ffff => self.u64()?,
+            length => length as u64,
+        };
+        Some((usize::try_from(length).ok()?, self.pos))
+    }
+
+    /// A pointer in a `DW_EH_PE_*` encoding; `address_of` gives the address a file
+    /// position is loaded at, for PC-relative pointers.
+    fn encoded(&mut self, encoding: u8, address_of: &dyn Fn(usize) -> u64) -> Option<u64> {
+        if encoding == DW_EH_PE_OMIT {
+            return None;
+        }
+        let field_addr = address_of(self.pos);
+        let value = match encoding & 0x0f {
+            0x00 | 0x04 | 0x0c => self.u64()?,
+            0x01 => self.uleb()?,
+            0x02 => self.u16()? as u64,
+            0x03 => self.u32()? as u64,
+            0x09 => self.sleb()? as u64,
+            0x0a => self.u16()? as i16 as i64 as u64,
+            0x0b => self.u32()? as i32 as i64 as u64,
+            _ => return None,
+        };
+        match encoding & 0x70 {
+            0x00 => Some(value),
+            DW_EH_PE_PCREL => Some(field_addr.wrapping_add(value)),
+            // Relative to bases like the GOT, which rustc and GCC don't use here.
+            _ => None,
+        }
+    }
+}
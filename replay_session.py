@@ -0,0 +1,58 @@
+import argparse
+from pathlib import Path
+import shutil
+import tempfile
+import time
+
+from accelerant.agent import AgentConfig, AgentInput, run_agent
+from accelerant.project import Project
+from accelerant.startup import setup_prereqs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run an optimization session on a scratch copy of a project, "
+        "recording the model's responses or replaying a recording."
+    )
+    parser.add_argument("project", type=Path, help="root of the project to optimize")
+    parser.add_argument(
+        "target_binary", type=Path, help="release binary, relative to the project"
+    )
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--record", type=Path, metavar="RECORDING")
+    mode.add_argument("--replay", type=Path, metavar="RECORDING")
+    parser.add_argument("--model", default="gpt-4.1")
+    parser.add_argument(
+        "--trace", type=Path, help="write the timing of every span to this JSONL file"
+    )
+    args = parser.parse_args()
+
+    setup_prereqs()
+    ag_config: AgentConfig = {"model_id": args.model}
+    if args.replay is not None:
+        ag_config["replay_path"] = args.replay.resolve()
+    else:
+        ag_config["record_path"] = args.record.resolve()
+    if args.trace is not None:
+        ag_config["trace_path"] = args.trace.resolve()
+    ag_input: AgentInput = {"perf_data_path": None, "hotspot_lines": None}
+
+    # The agent persists its edits, so work on a copy to keep sessions repeatable.
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        project_root = Path(scratch_dir) / args.project.resolve().name
+        shutil.copytree(
+            args.project, project_root, ignore=shutil.ignore_patterns("target")
+        )
+        project = Project(project_root, project_root / args.target_binary, "rust")
+        start = time.perf_counter()
+        with project.lsp().start_server():
+            with project.fs_sandbox():
+                results = run_agent(project, ag_input, ag_config)
+        elapsed = time.perf_counter() - start
+
+    print(results["final_message"])
+    print(f"Session took {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()